@@ -0,0 +1,145 @@
+import json
+import math
+import threading
+import time
+from collections import Counter
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, retry_after_s):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+
+
+class AdmissionController:
+    """
+    Bounds the requests (and their upload bytes) held by the server at once.
+
+    `admit(lane, nbytes)` returns a ticket, or raises AdmissionRejected when admitting the request
+    would exceed `max_pending` requests in total, the lane's own limit in `lane_limits`, or
+    `max_pending_bytes` of uploads. The ticket is released when the response has been sent.
+    Retry-After is the recent average time a request is held (clamped to 1..60 s): roughly when
+    a slot frees up. `on_reject(lane, reason)` is called for every rejection.
+    """
+
+    def __init__(self, max_pending, max_pending_bytes, lane_limits=None, on_reject=None):
+        self.max_pending = max_pending
+        self.max_pending_bytes = max_pending_bytes
+        self.lane_limits = dict(lane_limits or {})
+        self.on_reject = on_reject
+        self.pending = Counter()
+        self.pending_bytes = 0
+        self.admitted = Counter()
+        self.rejected = Counter()
+        self.max_pending_seen = 0
+        self._hold_s = 1.0 # Moving average of how long a request is held
+        self._lock = threading.Lock()
+
+    def retry_after_s(self):
+        return int(min(max(math.ceil(self._hold_s), 1), 60))
+
+    def admit(self, lane, nbytes):
+        with self._lock:
+            total = sum(self.pending.values())
+            reason = None
+            if total >= self.max_pending:
+                reason = "queue_full"
+            elif lane in self.lane_limits and self.pending[lane] >= self.lane_limits[lane]:
+                reason = "lane_full"
+            elif total and self.pending_bytes + nbytes > self.max_pending_bytes:
+                reason = "bytes_full" # A single oversized request is still admitted when nothing else is pending
+            if reason is not None:
+                self.rejected[(lane, reason)] += 1
+                if self.on_reject is not None:
+                    self.on_reject(lane, reason)
+                raise AdmissionRejected(reason, self.retry_after_s())
+            self.pending[lane] += 1
+            self.pending_bytes += nbytes
+            self.admitted[lane] += 1
+            self.max_pending_seen = max(self.max_pending_seen, total + 1)
+        return _Ticket(self, lane, nbytes)
+
+    def _release(self, ticket):
+        with self._lock:
+            self.pending[ticket.lane] -= 1
+            self.pending_bytes -= ticket.nbytes
+            self._hold_s = 0.9 * self._hold_s + 0.1 * (time.monotonic() - ticket.start)
+
+    def _charge(self, ticket, nbytes):
+        with self._lock:
+            ticket.nbytes += nbytes
+            self.pending_bytes += nbytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_pending": self.max_pending,
+                "max_pending_bytes": self.max_pending_bytes,
+                "lane_limits": dict(self.lane_limits),
+                "pending": dict(self.pending),
+                "pending_bytes": self.pending_bytes,
+                "max_pending_seen": self.max_pending_seen,
+                "admitted": dict(self.admitted),
+                "rejected": {f"{lane}/{reason}": count for (lane, reason), count in sorted(self.rejected.items())},
+                "retry_after_s": self.retry_after_s(),
+            }
+
+
+class _Ticket:
+    def __init__(self, controller, lane, nbytes):
+        self.controller = controller
+        self.lane = lane
+        self.nbytes = nbytes
+        self.start = time.monotonic()
+
+    def charge(self, nbytes):
+        self.controller._charge(self, nbytes)
+
+    def release(self):
+        self.controller._release(self)
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying an AdmissionController to the paths in `paths`, before the body is read.
+    `lane_of(path, headers)` picks the lane; it is stored in the request state as `lane`.
+    Requests without Content-Length are charged for their body bytes as they arrive.
+    """
+
+    def __init__(self, app, controller, paths, lane_of):
+        self.app = app
+        self.controller = controller
+        self.paths = tuple(paths)
+        self.lane_of = lane_of
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+        headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+        lane = self.lane_of(scope["path"], headers)
+        scope.setdefault("state", {})["lane"] = lane
+        content_length = headers.get("content-length")
+        try:
+            ticket = self.controller.admit(lane, int(content_length) if content_length else 0)
+        except AdmissionRejected as e:
+            body = json.dumps({"detail": f"Server busy ({e.reason}); retry later.", "lane": lane}).encode()
+            await send({"type": "http.response.start", "status": 429, "headers": [
+                (b"content-type", b"application/json"),
+                (b"retry-after", str(e.retry_after_s).encode()),
+                (b"content-length", str(len(body)).encode()),
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        if not content_length:
+            async def counting_receive():
+                message = await receive()
+                if message["type"] == "http.request":
+                    ticket.charge(len(message.get("body", b"")))
+                return message
+        try:
+            await self.app(scope, receive if content_length else counting_receive, send)
+        finally:
+            ticket.release()
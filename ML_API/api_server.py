@@ -2,19 +2,36 @@ import os
 import json
 import numpy as np
 import cv2
-import tensorflow as tf
-from tensorflow.keras.models import load_model
-from ultralytics import YOLO
-import torch # For NMS and checking CUDA
-import torchvision # For NMS operations
+# TensorFlow, torch and Ultralytics are imported lazily where they are used,
+# so the server starts answering /health before the frameworks have loaded.
 import io
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Body
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi import FastAPI, File, UploadFile, HTTPException, Body, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.datastructures import UploadFile as StarletteUploadFile
+from pydantic import BaseModel, PrivateAttr
 from typing import Optional, List, Dict, Any
 
+from micro_batcher import MicroBatcher
+from result_cache import ResultCache, files_identity
+from metrics import Registry
+from box_fusion import FUSION_MODES, fuse_boxes_batch
+from bulk_ingest import iter_upload_images
+from slo_controller import SloController
+from admission import AdmissionController, AdmissionMiddleware
+from thread_config import load_thread_config, apply_thread_config
+from raw_image import RAW_IMAGE_CONTENT_TYPE, RawImageError, parse_raw_image, to_pipeline_image
+from request_profiler import RequestProfiler, ProfilerBusy
+from stage_pipeline import Stage, StageStats, split_batch_future
+from inference_engines import (
+    classifier_model_path, detector_model_path, load_classifier, load_detector
+)
+
 # --- Configuration (Update these paths if necessary) ---
 CLASSIFIER_MODEL_DIR = 'classification_models/'
 DETECTOR_MODEL_PATTERN = 'yolo_runs/yolo_fold{}_exp/weights/best.pt'
@@ -27,9 +44,157 @@ DEFAULT_CLASSIFICATION_THRESHOLD = 0.5 # This is implicit in the pipeline output
 DEFAULT_DETECTION_IOU_THRESHOLD = 0.45
 DEFAULT_DETECTION_CONF_THRESHOLD = 0.25
 
+# Dynamic micro-batching: concurrent uploads are coalesced into one batch of at most
+# BATCH_MAX_SIZE images, waiting at most BATCH_MAX_WAIT_MS after the first arrives.
+# BATCH_MAX_SIZE=1 disables batching.
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "10"))
+
+# Inference runs on a dedicated executor with INFERENCE_WORKERS slots (concurrent batches);
+# uploads are decoded on a separate DECODE_WORKERS pool so the event loop never blocks.
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "1"))
+DECODE_WORKERS = int(os.environ.get("DECODE_WORKERS", "4"))
+
+# TensorFlow / torch thread pool sizes measured by autotune_threads.py, applied before the models
+# load. A missing file keeps the framework defaults; its worker count is used by prefork_server.py.
+THREADING_CONFIG = os.environ.get("THREADING_CONFIG", "threading_config.json")
+
+# Result cache keyed on upload bytes + thresholds. RESULT_CACHE_MAX_ENTRIES=0 disables the
+# in-memory tier; set RESULT_CACHE_DIR to also persist results on disk across restarts, up to
+# about RESULT_CACHE_MAX_DISK_ENTRIES files (0: unbounded).
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "1024"))
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "")
+RESULT_CACHE_MAX_DISK_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_DISK_ENTRIES", "100000"))
+
+# CPU inference engines (see inference_engines.py / export_models.py):
+# CLASSIFIER_ENGINE = keras | tflite | tflite_fp16 | tflite_int8, DETECTOR_ENGINE = pytorch | onnx | onnx_int8
+CLASSIFIER_ENGINE = os.environ.get("CLASSIFIER_ENGINE", "keras")
+DETECTOR_ENGINE = os.environ.get("DETECTOR_ENGINE", "pytorch")
+
+# Fold models are loaded in parallel by MODEL_LOAD_WORKERS threads (classifiers and detectors
+# concurrently); WARMUP=1 runs a synthetic image through every fold before reporting ready.
+MODEL_LOAD_WORKERS = int(os.environ.get("MODEL_LOAD_WORKERS", str(NUM_FOLDS)))
+WARMUP = os.environ.get("WARMUP", "1") == "1"
+
+# Run the classifier folds as one fused graph (one call per batch instead of one per fold)
+FUSED_CLASSIFIER_ENSEMBLE = os.environ.get("FUSED_CLASSIFIER_ENSEMBLE", "0") == "1"
+
+# Early-exit classification: folds run one at a time in CLASSIFIER_FOLD_ORDER (1-based fold
+# numbers, e.g. "3,1,5,2,4") and stop once the remaining folds cannot flip the threshold decision.
+# Takes precedence over FUSED_CLASSIFIER_ENSEMBLE.
+EARLY_EXIT_CLASSIFIER = os.environ.get("EARLY_EXIT_CLASSIFIER", "0") == "1"
+CLASSIFIER_FOLD_ORDER = os.environ.get("CLASSIFIER_FOLD_ORDER", "")
+EARLY_EXIT_MARGIN = 1e-6 # Keeps the bound check safe against float32 rounding of the full-ensemble mean
+
+# How the detector folds' boxes are combined (see box_fusion.py): nms | wbf
+BOX_FUSION = os.environ.get("BOX_FUSION", "nms")
+
+# Grayscale ingest: decode uploads once to a single channel, at 1/2, 1/4 or 1/8 resolution when
+# the source is large enough that the models still get at least their input size.
+GRAYSCALE_DECODE = os.environ.get("GRAYSCALE_DECODE", "0") == "1"
+DETECTOR_IMG_SIZE = 640 # Ultralytics inference size the YOLO folds were trained at
+
+# Speculative detection: start the detector folds alongside the classifier folds when a core is spare.
+# The boxes are used for Opacity images and thrown away (cancelled between folds) for Normal ones.
+# SPECULATIVE_SLOTS = batches that may speculate at once (default: cores left over by the inference slots).
+SPECULATIVE_DETECTION = os.environ.get("SPECULATIVE_DETECTION", "0") == "1"
+AVAILABLE_CORES = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+SPECULATIVE_SLOTS = int(os.environ.get("SPECULATIVE_SLOTS", str(min(max(AVAILABLE_CORES - INFERENCE_WORKERS, 0), INFERENCE_WORKERS))))
+
+# Latency SLO controller: under load, run fewer folds per stage (dropped in SLO_DEGRADE_ORDER, keeping
+# the first folds of each SLO_*_FOLD_PRIORITY list) and restore the full ensemble once load drops
+SLO_CONTROLLER = os.environ.get("SLO_CONTROLLER", "0") == "1"
+SLO_LATENCY_TARGET_MS = float(os.environ.get("SLO_LATENCY_TARGET_MS", "2000"))
+SLO_QUEUE_LIMIT = int(os.environ.get("SLO_QUEUE_LIMIT", str(4 * BATCH_MAX_SIZE)))
+SLO_DEGRADE_ORDER = os.environ.get("SLO_DEGRADE_ORDER", "detector,classifier")
+SLO_MIN_FOLDS = int(os.environ.get("SLO_MIN_FOLDS", "1"))
+SLO_CLASSIFIER_FOLD_PRIORITY = os.environ.get("SLO_CLASSIFIER_FOLD_PRIORITY", "")
+SLO_DETECTOR_FOLD_PRIORITY = os.environ.get("SLO_DETECTOR_FOLD_PRIORITY", "")
+SLO_WINDOW = int(os.environ.get("SLO_WINDOW", "50"))            # Recent requests the p95 latency is taken over...
+SLO_WINDOW_S = float(os.environ.get("SLO_WINDOW_S", "10"))      # ...if no older than this
+SLO_COOLDOWN_S = float(os.environ.get("SLO_COOLDOWN_S", "2"))   # Min time between two fold count changes
+
+# Admission control for /predict/*: requests held at once (0 disables), of which bulk-lane at most,
+# and upload bytes held at once. Beyond that, requests get 429 with Retry-After.
+# Lanes: /predict/batch and requests with "X-Request-Priority: bulk" are bulk; everything else is
+# interactive and is batched ahead of queued bulk images.
+ADMISSION_MAX_PENDING = int(os.environ.get("ADMISSION_MAX_PENDING", "64"))
+ADMISSION_MAX_PENDING_BULK = int(os.environ.get("ADMISSION_MAX_PENDING_BULK", "8"))
+ADMISSION_MAX_PENDING_BYTES = int(os.environ.get("ADMISSION_MAX_PENDING_BYTES", str(256 * 2**20)))
+LANE_PRIORITIES = {"interactive": 0, "bulk": 1}
+
+# /predict/batch: images of one bulk request being read, decoded or inferred at once (bounds its memory),
+# max files per request, and max size of one image (upload or archive member)
+BULK_MAX_IN_FLIGHT = int(os.environ.get("BULK_MAX_IN_FLIGHT", str(2 * BATCH_MAX_SIZE)))
+BULK_MAX_FILES = int(os.environ.get("BULK_MAX_FILES", "1000"))
+BULK_MAX_IMAGE_BYTES = int(os.environ.get("BULK_MAX_IMAGE_BYTES", str(64 * 2**20)))
+
+# /predict/raw/: largest pre-decoded pixel array accepted (height x width)
+RAW_IMAGE_MAX_PIXELS = int(os.environ.get("RAW_IMAGE_MAX_PIXELS", str(64 * 2**20)))
+
+# On-demand profiling of single requests: a request carrying the token (X-Profile-Token header or
+# ?profile= query parameter) runs alone under cProfile and the TensorFlow/torch profilers and its trace
+# is written to PROFILE_DIR. No token configured = off, and requests are not even inspected for one.
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_MAX_TRACES = int(os.environ.get("PROFILE_MAX_TRACES", "20"))
+PROFILE_MAX_BYTES = int(os.environ.get("PROFILE_MAX_BYTES", str(512 * 2**20)))
+
+# Stage-pipelined requests: decode + preprocessing (DECODE_WORKERS threads), classification (the
+# micro-batcher on INFERENCE_WORKERS slots) and detection (DETECT_WORKERS threads) as separate stages,
+# so one batch's detection overlaps the next batch's classification. STAGE_QUEUE_SIZE batches may
+# wait for a detect worker before classification stops taking new batches.
+PIPELINE_STAGES = os.environ.get("PIPELINE_STAGES", "0") == "1"
+DETECT_WORKERS = int(os.environ.get("DETECT_WORKERS", "1"))
+STAGE_QUEUE_SIZE = int(os.environ.get("STAGE_QUEUE_SIZE", "2"))
+
 # Global model dictionary (populated at startup)
 models_store = {}
 
+# Startup progress reported by /health: starting -> warming -> ready (or failed)
+startup_state = {
+    "phase": "starting",
+    "classifiers_loaded": 0,
+    "detectors_loaded": 0,
+    "started_at": time.time(),
+    "ready_after_s": None,
+}
+startup_lock = threading.Lock()
+
+def record_fold_loaded(kind):
+    with startup_lock:
+        startup_state[f"{kind}_loaded"] += 1
+
+# --- Prometheus metrics (exposed on GET /metrics) ---
+# Fold labels are the fold's position in the loaded ensemble (1-based).
+metrics_registry = Registry()
+STAGE_LATENCY = metrics_registry.histogram(
+    "ml_api_stage_duration_seconds", "Latency of a pipeline stage (decode and preprocess per image, others per batch).", ["stage"])
+FOLD_LATENCY = metrics_registry.histogram(
+    "ml_api_fold_duration_seconds", "Latency of one fold model call on a batch.", ["stage", "fold"])
+PIPELINE_PATH = metrics_registry.counter(
+    "ml_api_pipeline_path_total", "Images by pipeline path: detection, normal_early_exit, cache_hit or error.", ["path"])
+IN_FLIGHT = metrics_registry.gauge(
+    "ml_api_in_flight", "Requests being handled, batches running inference and requests queued for a batch.", ["kind"])
+MODEL_LOAD_SECONDS = metrics_registry.gauge(
+    "ml_api_model_load_seconds", "Time taken to load each fold model at startup.", ["stage", "fold"])
+STARTUP_SECONDS = metrics_registry.gauge(
+    "ml_api_startup_seconds", "Duration of each startup phase (load, warmup).", ["phase"])
+SPECULATION = metrics_registry.counter(
+    "ml_api_speculative_detection_total", "Speculative detection runs by outcome", ["outcome"])
+SPECULATIVE_WASTED_SECONDS = metrics_registry.counter(
+    "ml_api_speculative_wasted_detector_seconds_total", "Detector time spent on speculative runs that were thrown away")
+ENSEMBLE_FOLDS = metrics_registry.gauge(
+    "ml_api_ensemble_folds", "Folds currently run per stage (reduced by the SLO controller under load).", ["stage"])
+ADMISSION_REJECTED = metrics_registry.counter(
+    "ml_api_admission_rejected_total", "Requests rejected with 429 by admission control.", ["lane", "reason"])
+ADMISSION_PENDING = metrics_registry.gauge(
+    "ml_api_admission_pending", "Admitted requests not yet answered, and their upload bytes.", ["lane", "kind"])
+QUEUED_BY_LANE = metrics_registry.gauge(
+    "ml_api_queued_images", "Images waiting in the micro-batcher queue per lane.", ["lane"])
+FOLDS_SKIPPED = metrics_registry.counter(
+    "ml_api_classifier_folds_skipped_total", "Classifier fold evaluations skipped by early exit.")
+
 # --- Pydantic Models for Request/Response ---
 class BoundingBox(BaseModel):
     x: float
@@ -40,9 +205,16 @@ class BoundingBox(BaseModel):
 class PredictionResponse(BaseModel):
     probability: float
     boundingBox: Optional[BoundingBox] = None
+    # Early-exit mode only: folds evaluated and bounds on the full-ensemble probability
+    foldsUsed: Optional[int] = None
+    probabilityBounds: Optional[List[float]] = None
+    detectorFoldsUsed: Optional[int] = None
+    _degraded: bool = PrivateAttr(default=False) # Came from an SLO-reduced ensemble (not cached)
+    _profile_trace: Optional[str] = PrivateAttr(default=None) # Trace directory of a profiled request
 
 # --- GPU Configuration ---
 def set_gpu_memory_growth():
+    import tensorflow as tf
     gpus = tf.config.experimental.list_physical_devices('GPU')
     if gpus:
         try:
@@ -55,49 +227,79 @@ def set_gpu_memory_growth():
         print("No GPUs detected by TensorFlow.")
 
 # --- Model Loading Functions (Adapted from previous script) ---
-def load_all_classifier_models(model_dir):
-    models = []
-    print("Loading Keras classifier models...")
-    for i in range(1, NUM_FOLDS + 1):
-        model_path = os.path.join(model_dir, f'classifier_split_{i}.keras')
+def load_all_classifier_models(model_dir, engine=CLASSIFIER_ENGINE, on_loaded=None):
+    print(f"Loading classifier models ({engine} engine)...")
+
+    def load_fold(i):
+        model_path = classifier_model_path(model_dir, i, engine)
         if os.path.exists(model_path):
             try:
-                model = load_model(model_path)
-                models.append(model)
+                start = time.perf_counter()
+                model = load_classifier(model_path, engine)
+                MODEL_LOAD_SECONDS.set(time.perf_counter() - start, stage="classifier", fold=i)
                 print(f"Loaded classifier model: {model_path}")
+                if on_loaded:
+                    on_loaded()
+                return model
             except Exception as e:
                 print(f"Error loading classifier model {model_path}: {e}")
         else:
             print(f"Classifier model not found: {model_path}")
+        return None
+
+    # Folds load in parallel; map() keeps them in fold order
+    with ThreadPoolExecutor(max_workers=MODEL_LOAD_WORKERS) as pool:
+        models = [model for model in pool.map(load_fold, range(1, NUM_FOLDS + 1)) if model is not None]
     if not models:
         raise FileNotFoundError(f"No classifier models successfully loaded from {model_dir}.")
     return models
 
-def load_all_detector_models(model_pattern):
-    models = []
-    print("Loading Ultralytics YOLO detector models...")
-    for i in range(1, NUM_FOLDS + 1):
-        model_path = model_pattern.format(i)
+def load_all_detector_models(model_pattern, engine=DETECTOR_ENGINE, on_loaded=None):
+    print(f"Loading Ultralytics YOLO detector models ({engine} engine)...")
+
+    def load_fold(i):
+        model_path = detector_model_path(model_pattern, i, engine)
         if os.path.exists(model_path):
             try:
-                model = YOLO(model_path)
-                models.append(model)
+                start = time.perf_counter()
+                model = load_detector(model_path, engine)
+                MODEL_LOAD_SECONDS.set(time.perf_counter() - start, stage="detector", fold=i)
                 print(f"Loaded detector model: {model_path}")
+                if on_loaded:
+                    on_loaded()
+                return model
             except Exception as e:
                 print(f"Error loading detector model {model_path}: {e}")
         else:
             print(f"Detector model not found: {model_path}")
+        return None
+
+    with ThreadPoolExecutor(max_workers=MODEL_LOAD_WORKERS) as pool:
+        models = [model for model in pool.map(load_fold, range(1, NUM_FOLDS + 1)) if model is not None]
     if not models:
         raise FileNotFoundError(f"No detector models successfully loaded with pattern {model_pattern}.")
     return models
 
 # --- Preprocessing Functions ---
 def preprocess_image_for_classifier(image_array_bgr):
+    if image_array_bgr.ndim == 2:
+        return preprocess_grayscale_for_classifier(image_array_bgr)
     img = cv2.cvtColor(image_array_bgr, cv2.COLOR_BGR2RGB)
     img = cv2.resize(img, (CLASSIFIER_IMG_WIDTH, CLASSIFIER_IMG_HEIGHT))
     img = img.astype(np.float32) / 255.0
     return np.expand_dims(img, axis=0)
 
+def preprocess_grayscale_for_classifier(image_gray):
+    """Grayscale (H, W) uint8 -> (1, H, W, 3) float32 in one allocation; the channel is broadcast, not converted."""
+    resized = cv2.resize(image_gray, (CLASSIFIER_IMG_WIDTH, CLASSIFIER_IMG_HEIGHT))
+    img = np.empty((1, CLASSIFIER_IMG_HEIGHT, CLASSIFIER_IMG_WIDTH, 3), dtype=np.float32)
+    np.divide(resized[..., None], np.float32(255.0), out=img[0])
+    return img
+
+def image_for_detector(image):
+    """RGB input for the YOLO folds from a decoded BGR or grayscale image (same size, so boxes map back 1:1)."""
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB if image.ndim == 2 else cv2.COLOR_BGR2RGB)
+
 # --- Prediction Functions ---
 def predict_with_classifiers(image_array_processed, class_models):
     if not class_models:
@@ -107,146 +309,887 @@ def predict_with_classifiers(image_array_processed, class_models):
     final_label_str = "Opacity" if ensemble_probability >= DEFAULT_CLASSIFICATION_THRESHOLD else "Normal"
     return final_label_str, float(ensemble_probability)
 
+def build_fused_classifier_ensemble(class_models):
+    """
+    Fuses the fold classifiers into one compiled graph with a fixed input signature.
+    Returns a function: float32 batch (N, H, W, 3) -> (mean_probability (N,), fold_probabilities (N, folds)).
+    """
+    if not class_models:
+        raise ValueError("Classifier models not loaded.")
+    import tensorflow as tf
+
+    @tf.function(input_signature=[tf.TensorSpec([None, CLASSIFIER_IMG_HEIGHT, CLASSIFIER_IMG_WIDTH, 3], tf.float32)])
+    def fused_ensemble(batch):
+        fold_probabilities = tf.concat([model(batch, training=False) for model in class_models], axis=-1)
+        return tf.reduce_mean(fold_probabilities, axis=-1), fold_probabilities
+
+    return fused_ensemble
+
+def parse_fold_order(fold_order, num_folds):
+    """1-based fold numbers ("3,1,5") -> 0-based model indices; unlisted folds follow in natural order."""
+    if isinstance(fold_order, str):
+        fold_order = [int(fold) for fold in fold_order.split(",") if fold.strip()]
+    order = [fold - 1 for fold in (fold_order or [])]
+    if len(set(order)) != len(order) or any(index < 0 or index >= num_folds for index in order):
+        raise ValueError(f"Invalid fold order {fold_order} for {num_folds} folds.")
+    return order + [index for index in range(num_folds) if index not in order]
+
+def sequential_fold_evaluation(num_images, num_folds, run_fold, fold_order=None,
+                               thresholds=(DEFAULT_CLASSIFICATION_THRESHOLD,)):
+    """
+    Evaluates folds one at a time and stops for an image once the remaining folds (each in [0, 1])
+    can no longer move its ensemble mean across any threshold. run_fold(fold_index, image_indices)
+    returns that fold's probabilities. Returns (probabilities, folds_used, lower_bounds, upper_bounds);
+    early-exited images get the mean of the folds evaluated, the rest the exact ensemble mean.
+    """
+    order = parse_fold_order(fold_order, num_folds)
+    fold_probabilities = np.zeros((num_folds, num_images), dtype=np.float32)
+    fold_sums = np.zeros(num_images)
+    folds_used = np.zeros(num_images, dtype=int)
+    lower_bounds, upper_bounds = np.zeros(num_images), np.ones(num_images)
+
+    active = np.arange(num_images)
+    for step, fold in enumerate(order, start=1):
+        outputs = np.asarray(run_fold(fold, active)).reshape(-1)
+        fold_probabilities[fold, active] = outputs
+        fold_sums[active] += outputs
+        folds_used[active] = step
+        lower_bounds[active] = fold_sums[active] / num_folds
+        upper_bounds[active] = (fold_sums[active] + num_folds - step) / num_folds
+        settled = np.ones(len(active), dtype=bool)
+        for threshold in thresholds:
+            settled &= ((lower_bounds[active] >= threshold + EARLY_EXIT_MARGIN)
+                        | (upper_bounds[active] < threshold - EARLY_EXIT_MARGIN))
+        active = active[~settled]
+        if active.size == 0:
+            break
+
+    probabilities = fold_sums / np.maximum(folds_used, 1)
+    complete = folds_used == num_folds
+    # Same NumPy mean over the fold axis as predict_with_classifiers_batch, so full evaluations match exactly
+    probabilities[complete] = np.mean(fold_probabilities[:, complete], axis=0)
+    lower_bounds[complete] = upper_bounds[complete] = probabilities[complete]
+    return probabilities, folds_used, lower_bounds, upper_bounds
+
 def ensemble_detections_nms(all_boxes, all_scores, all_classes, iou_threshold):
-    if not all_boxes: return []
-    boxes_tensor = torch.tensor(all_boxes, dtype=torch.float32)
-    scores_tensor = torch.tensor(all_scores, dtype=torch.float32)
-    if boxes_tensor.nelement() == 0: return []
-    keep_indices = torchvision.ops.nms(boxes_tensor, scores_tensor, iou_threshold)
-    final_boxes = []
-    for idx in keep_indices:
-        final_boxes.append([
-            float(boxes_tensor[idx][0]), float(boxes_tensor[idx][1]),
-            float(boxes_tensor[idx][2]), float(boxes_tensor[idx][3]),
-            float(scores_tensor[idx]),
-            int(all_classes[idx])
-        ])
-    return final_boxes
+    """Single-image NMS over the folds' boxes; returns [[x1, y1, x2, y2, score, class_id], ...]."""
+    if len(all_boxes) == 0: return []
+    final_boxes = fuse_boxes_batch([all_boxes], [all_scores], [all_classes], iou_threshold, mode='nms')[0]
+    return [[float(x1), float(y1), float(x2), float(y2), float(score), int(class_id)]
+            for x1, y1, x2, y2, score, class_id in final_boxes]
 
 def predict_with_detectors(image_array_bgr, detect_models, iou_thresh, conf_thresh):
+    return predict_with_detectors_batch([image_array_bgr], detect_models, iou_thresh, conf_thresh)[0]
+
+# --- Batched Prediction Functions (used by the micro-batcher) ---
+def predict_with_classifiers_batch(images_processed, class_models, fused_ensemble=None):
+    """Classifies N preprocessed images with one model.predict call per fold, or one fused call."""
+    if not class_models:
+        raise ValueError("Classifier models not loaded.")
+    batch = np.concatenate(images_processed, axis=0)
+    if fused_ensemble is not None:
+        with STAGE_LATENCY.time(stage="classifier_fused"):
+            _, fold_probabilities = fused_ensemble(batch)
+            all_probabilities = fold_probabilities.numpy().T
+    else:
+        fold_outputs = []
+        for fold, model in enumerate(class_models, start=1):
+            with FOLD_LATENCY.time(stage="classifier", fold=fold):
+                fold_outputs.append(model.predict(batch, verbose=0)[:, 0])
+        all_probabilities = np.stack(fold_outputs)
+    # NumPy mean over the fold axis keeps the result identical between both paths
+    ensemble_probabilities = np.mean(all_probabilities, axis=0)
+    return [
+        ("Opacity" if prob >= DEFAULT_CLASSIFICATION_THRESHOLD else "Normal", float(prob))
+        for prob in ensemble_probabilities
+    ]
+
+def predict_with_classifiers_early_exit_batch(images_processed, class_models, fold_order=None):
+    """
+    Early-exit version of predict_with_classifiers_batch: each fold runs only on the images whose
+    decision is still open. Returns (label, probability, folds_used, [lower, upper]) per image.
+    """
+    if not class_models:
+        raise ValueError("Classifier models not loaded.")
+    batch = np.concatenate(images_processed, axis=0)
+
+    def run_fold(fold, image_indices):
+        with FOLD_LATENCY.time(stage="classifier", fold=fold + 1):
+            return class_models[fold].predict(batch if len(image_indices) == len(batch) else batch[image_indices],
+                                              verbose=0)[:, 0]
+
+    probabilities, folds_used, lower_bounds, upper_bounds = sequential_fold_evaluation(
+        len(batch), len(class_models), run_fold, fold_order
+    )
+    FOLDS_SKIPPED.inc(float(len(class_models) * len(batch) - folds_used.sum()))
+    return [
+        ("Opacity" if prob >= DEFAULT_CLASSIFICATION_THRESHOLD else "Normal", float(prob),
+         int(used), [float(lower), float(upper)])
+        for prob, used, lower, upper in zip(probabilities, folds_used, lower_bounds, upper_bounds)
+    ]
+
+def shared_fold_predictors(detect_models, conf_thresh):
+    """
+    The folds' Ultralytics predictors, if one preprocessed tensor can feed all of them: each fold has
+    been set up by a first predict call with this confidence, and all share input size, stride,
+    precision and device. Returns None otherwise.
+    """
+    predictors = [getattr(model, "predictor", None) for model in detect_models]
+    if any(predictor is None or predictor.imgsz is None or predictor.args.conf != conf_thresh
+           for predictor in predictors):
+        return None
+    signatures = {(tuple(predictor.imgsz), int(predictor.model.stride), bool(predictor.model.fp16), str(predictor.device))
+                  for predictor in predictors}
+    return predictors if len(signatures) == 1 else None
+
+def run_detector_folds(images_rgb, detect_models, conf_thresh, cancelled=None):
+    """
+    Returns each fold's Ultralytics results for images_rgb. Letterboxing, normalization and tensor
+    conversion run once and the tensor is shared by every fold; each fold's own postprocess maps
+    the boxes back to image coordinates, as model.predict does.
+    If the `cancelled` event is set, stops before the next fold and returns None.
+    """
+    predictors = shared_fold_predictors(detect_models, conf_thresh)
+    if predictors is None: # First call sets the predictors up
+        all_results = []
+        for fold, model in enumerate(detect_models, start=1):
+            if cancelled is not None and cancelled.is_set():
+                return None
+            with FOLD_LATENCY.time(stage="detector", fold=fold):
+                all_results.append(model.predict(images_rgb, conf=conf_thresh, verbose=False))
+        return all_results
+
+    import torch
+    all_results = []
+    with torch.inference_mode():
+        with STAGE_LATENCY.time(stage="detector_preprocess"):
+            shared_input = predictors[0].preprocess(images_rgb)
+        for fold, predictor in enumerate(predictors, start=1):
+            if cancelled is not None and cancelled.is_set():
+                return None
+            # The predictor's own lock, as in model.predict: batch is per-call state
+            with FOLD_LATENCY.time(stage="detector", fold=fold), predictor._lock:
+                predictor.batch = ([""] * len(images_rgb), images_rgb, [""] * len(images_rgb))
+                all_results.append(predictor.postprocess(predictor.inference(shared_input), shared_input, images_rgb))
+    return all_results
+
+def predict_with_detectors_batch(images_bgr, detect_models, iou_thresh, conf_thresh, cancelled=None):
+    """
+    Runs detection on N images with one YOLO call per fold; returns one box list per image
+    (None if the `cancelled` event was set before all folds ran).
+    """
     if not detect_models:
         raise ValueError("Detector models not loaded.")
 
-    image_input_for_yolo = cv2.cvtColor(image_array_bgr, cv2.COLOR_BGR2RGB)
-    all_pred_boxes, all_pred_scores, all_pred_classes = [], [], []
+    images_rgb = [image_for_detector(image) for image in images_bgr]
+    per_image = [([], [], []) for _ in images_rgb]
+
+    all_results = run_detector_folds(images_rgb, detect_models, conf_thresh, cancelled)
+    if all_results is None:
+        return None
+    for results in all_results:
+        for (boxes, scores, classes), result in zip(per_image, results):
+            if result.boxes:
+                boxes.append(result.boxes.xyxy.cpu().numpy())
+                scores.append(result.boxes.conf.cpu().numpy())
+                classes.append(result.boxes.cls.cpu().numpy())
 
-    for model in detect_models:
-        results = model.predict(image_input_for_yolo, conf=conf_thresh, verbose=False)
-        if results and results[0].boxes:
-            all_pred_boxes.extend(results[0].boxes.xyxy.cpu().numpy().tolist())
-            all_pred_scores.extend(results[0].boxes.conf.cpu().numpy().tolist())
-            all_pred_classes.extend(results[0].boxes.cls.cpu().numpy().tolist())
+    # One fusion call for the whole batch, on the fold outputs as arrays
+    with STAGE_LATENCY.time(stage="box_fusion"):
+        fused = fuse_boxes_batch(
+            [np.concatenate(boxes) if boxes else np.empty((0, 4), np.float32) for boxes, _, _ in per_image],
+            [np.concatenate(scores) if scores else np.empty(0, np.float32) for _, scores, _ in per_image],
+            [np.concatenate(classes) if classes else np.empty(0, np.float32) for _, _, classes in per_image],
+            iou_thresh, mode=BOX_FUSION, num_models=len(detect_models)
+        )
 
-    if not all_pred_boxes: return []
-    final_ensembled_boxes = ensemble_detections_nms(all_pred_boxes, all_pred_scores, all_pred_classes, iou_thresh)
-    
-    # Format output with class names (assuming class 0 is "Opacity")
     class_names = {0: "Opacity"}
-    formatted_boxes = []
-    for box_data in final_ensembled_boxes:
-        x1, y1, x2, y2, score, class_id = box_data
-        formatted_boxes.append([x1, y1, x2, y2, score, class_names.get(int(class_id), "Unknown")])
-    return formatted_boxes
+    return [
+        [[float(x1), float(y1), float(x2), float(y2), float(score), class_names.get(int(class_id), "Unknown")]
+         for x1, y1, x2, y2, score, class_id in image_boxes]
+        for image_boxes in fused
+    ]
 
-# --- FastAPI Lifespan for Model Loading ---
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Load models at startup
-    print("Application startup: Loading models...")
+def build_prediction_response(classification_prob, detected_boxes, image_shape, folds_used=None, probability_bounds=None,
+                              detector_folds_used=None):
+    detected_bounding_box = None
+    if detected_boxes:
+        # Select the box with the highest confidence score
+        # Each box in detected_boxes is [x1, y1, x2, y2, score, class_name]
+        highest_score_box = max(detected_boxes, key=lambda box: box[4])
+        x1, y1, x2, y2, score, _ = highest_score_box
+
+        # Normalize coordinates to [0, 1] range
+        img_height, img_width = image_shape[:2]
+        detected_bounding_box = BoundingBox(
+            x=float(x1) / img_width,
+            y=float(y1) / img_height,
+            width=float(x2 - x1) / img_width,
+            height=float(y2 - y1) / img_height
+        )
+    return PredictionResponse(probability=classification_prob, boundingBox=detected_bounding_box,
+                              foldsUsed=folds_used, probabilityBounds=probability_bounds,
+                              detectorFoldsUsed=detector_folds_used)
+
+class SpeculativeDetection:
+    """
+    Detector folds started on a batch before its classification is known, on a spare core.
+    take() returns the boxes; discard() cancels the run between folds and counts its detector time as wasted.
+    """
+
+    def __init__(self, images_bgr, detect_models):
+        self.cancelled = threading.Event()
+        self.seconds = 0.0
+        self.future = speculative_executor.submit(self._run, images_bgr, detect_models)
+
+    def _run(self, images_bgr, detect_models):
+        start = time.perf_counter()
+        try:
+            return predict_with_detectors_batch(images_bgr, detect_models, DEFAULT_DETECTION_IOU_THRESHOLD,
+                                                DEFAULT_DETECTION_CONF_THRESHOLD, cancelled=self.cancelled)
+        finally:
+            self.seconds = time.perf_counter() - start
+            speculative_slots.release()
+
+    def take(self):
+        SPECULATION.inc(outcome="used")
+        return self.future.result()
+
+    def discard(self, outcome):
+        self.cancelled.set()
+        SPECULATION.inc(outcome=outcome)
+        # Counted once the run has stopped (right away if it already finished)
+        self.future.add_done_callback(lambda _: SPECULATIVE_WASTED_SECONDS.inc(self.seconds))
+
+def start_speculative_detection(raw_images_bgr, detect_models):
+    """A SpeculativeDetection for the batch, or None when the mode is off or no spare core is free."""
+    if not SPECULATIVE_DETECTION:
+        return None
+    if not speculative_slots.acquire(blocking=False):
+        SPECULATION.inc(outcome="skipped_no_spare_core")
+        return None
+    return SpeculativeDetection(raw_images_bgr, detect_models)
+
+def ensemble_for_batch():
+    """Classifier and detector folds for the next batch: all of them, or the SLO controller's reduced set."""
+    classifiers, detectors = models_store["classifiers"], models_store["detectors"]
+    if slo_controller is None:
+        return classifiers, detectors
+    plan = slo_controller.plan(batcher.queued_requests())
+    ENSEMBLE_FOLDS.set(len(plan["classifier"]), stage="classifier")
+    ENSEMBLE_FOLDS.set(len(plan["detector"]), stage="detector")
+    return [classifiers[i] for i in plan["classifier"]], [detectors[i] for i in plan["detector"]]
+
+def run_pipeline_batch(raw_images_bgr, processed=None, hand_off_detection=False):
+    """
+    Classify-then-detect for a batch of decoded images. Returns one PredictionResponse
+    (or HTTPException) per image, in input order. `processed` are the classifier inputs if the decode
+    stage already made them. hand_off_detection=True queues detection on the detect stage and returns
+    a concurrent Future per image instead, freeing this inference slot for the next batch.
+    """
+    with IN_FLIGHT.track_inprogress(kind="batches"):
+        responses = _run_pipeline_batch(raw_images_bgr, processed, hand_off_detection)
+    count_pipeline_errors(responses)
+    return responses
+
+def count_pipeline_errors(responses):
+    for response in responses:
+        if isinstance(response, Exception):
+            PIPELINE_PATH.inc(path="error")
+
+def _run_pipeline_batch(raw_images_bgr, processed=None, hand_off_detection=False):
+    start = time.perf_counter()
+    classifiers, detectors = ensemble_for_batch()
+    full_classifiers = len(classifiers) == len(models_store["classifiers"])
+    speculation = start_speculative_detection(raw_images_bgr, detectors)
+    try:
+        if processed is None:
+            processed = []
+            for image in raw_images_bgr:
+                with STAGE_LATENCY.time(stage="preprocess"):
+                    processed.append(preprocess_image_for_classifier(image))
+        with STAGE_LATENCY.time(stage="classify"):
+            if EARLY_EXIT_CLASSIFIER:
+                # A reduced ensemble is already in the SLO priority order
+                early_exit_results = predict_with_classifiers_early_exit_batch(
+                    processed, classifiers, CLASSIFIER_FOLD_ORDER if full_classifiers else None
+                )
+                classifications = [(label, prob) for label, prob, _, _ in early_exit_results]
+                early_exit_info = [(used, bounds) for _, _, used, bounds in early_exit_results]
+            else:
+                classifications = predict_with_classifiers_batch(
+                    processed, classifiers, models_store.get("classifier_ensemble") if full_classifiers else None
+                )
+                # With the SLO controller on, every response reports its fold counts
+                early_exit_info = [(len(classifiers) if slo_controller is not None else None, None)] * len(classifications)
+    except Exception as e:
+        print(f"Error during classification: {e}")
+        if speculation is not None:
+            speculation.discard("discarded_error")
+        return [HTTPException(status_code=500, detail=f"Error during classification: {e}")] * len(raw_images_bgr)
+
+    # Stage 2: Detection only for images classified as Opacity
+    positive_indices = [i for i, (label, _) in enumerate(classifications) if label == "Opacity"]
+    if speculation is not None and len(positive_indices) != len(raw_images_bgr):
+        # Normal images, or a mixed batch: the speculative run covered other images than the
+        # sequential path would, so its boxes might differ and are not used
+        speculation.discard("discarded_normal" if not positive_indices else "discarded_mixed_batch")
+        speculation = None
+    args = (raw_images_bgr, classifications, early_exit_info, positive_indices, detectors, full_classifiers, speculation)
+    if hand_off_detection and positive_indices and speculation is None:
+        stage_stats["classify"].record(start, time.perf_counter(), len(raw_images_bgr))
+        # Waits here while STAGE_QUEUE_SIZE batches are already queued for detection
+        return split_batch_future(detect_stage.submit(*args, items=len(positive_indices)), len(raw_images_bgr))
+    responses = _detect_and_respond(*args)
+    if hand_off_detection: # Nothing to detect, or a speculative run already did
+        stage_stats["classify"].record(start, time.perf_counter(), len(raw_images_bgr))
+    return responses
+
+def run_detect_stage(*args):
+    responses = _detect_and_respond(*args)
+    count_pipeline_errors(responses)
+    return responses
+
+def _detect_and_respond(raw_images_bgr, classifications, early_exit_info, positive_indices, detectors,
+                        full_classifiers, speculation):
+    detections = {}
+    if positive_indices:
+        try:
+            with STAGE_LATENCY.time(stage="detect"):
+                if speculation is not None:
+                    batch_boxes = speculation.take()
+                else:
+                    batch_boxes = predict_with_detectors_batch(
+                        [raw_images_bgr[i] for i in positive_indices], detectors,
+                        DEFAULT_DETECTION_IOU_THRESHOLD, DEFAULT_DETECTION_CONF_THRESHOLD
+                    )
+            detections = dict(zip(positive_indices, batch_boxes))
+        except Exception as e:
+            print(f"Error during detection: {e}")
+            error = HTTPException(status_code=500, detail=f"Error during detection: {e}")
+            detections = {i: error for i in positive_indices}
+
+    responses = []
+    for i, (label, prob) in enumerate(classifications):
+        boxes = detections.get(i)
+        if isinstance(boxes, Exception):
+            responses.append(boxes)
+            continue
+        PIPELINE_PATH.inc(path="detection" if label == "Opacity" else "normal_early_exit")
+        detector_folds_used = len(detectors) if slo_controller is not None and label == "Opacity" else None
+        response = build_prediction_response(prob, boxes, raw_images_bgr[i].shape, *early_exit_info[i],
+                                             detector_folds_used=detector_folds_used)
+        response._degraded = not full_classifiers or (label == "Opacity" and len(detectors) < len(models_store["detectors"]))
+        responses.append(response)
+    return responses
+
+def run_submitted_batch(items):
+    """Batch function of the micro-batcher: decoded images, or with PIPELINE_STAGES (image, classifier input) pairs."""
+    if not PIPELINE_STAGES:
+        return run_pipeline_batch(items)
+    images, processed = zip(*items)
+    return run_pipeline_batch(list(images), list(processed), hand_off_detection=True)
+
+def decode_and_preprocess(decode, contents):
+    """Decode stage with PIPELINE_STAGES: the image and its classifier input, or None if undecodable."""
+    with stage_stats["decode"].measure():
+        image = decode(contents)
+        if image is None:
+            return None
+        with STAGE_LATENCY.time(stage="preprocess"):
+            return image, preprocess_image_for_classifier(image)
+
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+decode_executor = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode")
+speculative_executor = ThreadPoolExecutor(max_workers=max(SPECULATIVE_SLOTS, 1), thread_name_prefix="speculative-detect")
+speculative_slots = threading.BoundedSemaphore(SPECULATIVE_SLOTS) if SPECULATIVE_SLOTS > 0 else threading.Semaphore(0)
+detect_stage = Stage("detect", run_detect_stage, DETECT_WORKERS, STAGE_QUEUE_SIZE) if PIPELINE_STAGES else None
+stage_stats = {"decode": StageStats("decode", DECODE_WORKERS), "classify": StageStats("classify", INFERENCE_WORKERS),
+               "detect": detect_stage.stats} if PIPELINE_STAGES else {}
+batcher = MicroBatcher(
+    run_submitted_batch, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+    executor=inference_executor, max_concurrent_batches=INFERENCE_WORKERS
+)
+
+result_cache = ResultCache(max_entries=RESULT_CACHE_MAX_ENTRIES, disk_dir=RESULT_CACHE_DIR,
+                           max_disk_entries=RESULT_CACHE_MAX_DISK_ENTRIES)
+slo_controller = None # Set up once the models are loaded (see configure_slo_controller)
+admission = AdmissionController(
+    ADMISSION_MAX_PENDING, ADMISSION_MAX_PENDING_BYTES, lane_limits={"bulk": ADMISSION_MAX_PENDING_BULK},
+    on_reject=lambda lane, reason: ADMISSION_REJECTED.inc(lane=lane, reason=reason)
+) if ADMISSION_MAX_PENDING > 0 else None
+
+request_profiler = RequestProfiler(
+    PROFILE_TOKEN, PROFILE_DIR, max_traces=PROFILE_MAX_TRACES, max_bytes=PROFILE_MAX_BYTES
+) if PROFILE_TOKEN else None
+
+def profile_requested(request):
+    """True if the request asks to be profiled with the right token (403 for a wrong one)."""
+    if request_profiler is None:
+        return False
+    supplied = request.headers.get("x-profile-token") or request.query_params.get("profile")
+    if supplied is None:
+        return False
+    if not request_profiler.authorized(supplied):
+        raise HTTPException(status_code=403, detail="Invalid profiling token.")
+    return True
+
+def profile_pipeline(contents, decode):
+    """Decode and the pipeline for one image, alone rather than in a shared batch, under the request profiler."""
+    def run():
+        image = decode(contents)
+        if image is None:
+            return HTTPException(status_code=400, detail="Invalid image file or format.")
+        return run_pipeline_batch([image])[0]
+    return request_profiler.profile(run)
+
+def request_lane(path, headers):
+    if path.startswith("/predict/batch") or headers.get("x-request-priority", "").lower() == "bulk":
+        return "bulk"
+    return "interactive"
+
+def lane_of_request(request):
+    return getattr(request.state, "lane", None) or request_lane(request.url.path, request.headers)
+
+def result_cache_key(contents, *variant):
+    return ResultCache.make_key(
+        contents, *variant, DEFAULT_CLASSIFICATION_THRESHOLD,
+        DEFAULT_DETECTION_IOU_THRESHOLD, DEFAULT_DETECTION_CONF_THRESHOLD,
+        # Non-default modes change the response, so their results are cached apart
+        *(("early_exit", CLASSIFIER_FOLD_ORDER) if EARLY_EXIT_CLASSIFIER else ()),
+        *(("box_fusion", BOX_FUSION) if BOX_FUSION != "nms" else ()),
+        *(("grayscale_decode",) if GRAYSCALE_DECODE else ()),
+        *(("slo_fold_counts",) if SLO_CONTROLLER else ()),
+        # TFLite / ONNX (and their fp16 / int8 variants) are not bit-identical to Keras / PyTorch
+        *(("classifier_engine", CLASSIFIER_ENGINE) if CLASSIFIER_ENGINE != "keras" else ()),
+        *(("detector_engine", DETECTOR_ENGINE) if DETECTOR_ENGINE != "pytorch" else ()),
+        # Replacing the fold weights on disk must not serve results of the old ones
+        models_store.get("weights_identity", "")
+    )
+
+def decode_image(contents):
+    with STAGE_LATENCY.time(stage="decode"):
+        if GRAYSCALE_DECODE:
+            return decode_image_grayscale(contents)
+        return cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR)
+
+REDUCED_GRAYSCALE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8), (4, cv2.IMREAD_REDUCED_GRAYSCALE_4), (2, cv2.IMREAD_REDUCED_GRAYSCALE_2)
+)
+
+def grayscale_decode_flag(width, height):
+    """Largest reduction that still leaves the detector its input size and the classifier its resolution."""
+    for factor, flag in REDUCED_GRAYSCALE_FLAGS:
+        if (max(width, height) // factor >= DETECTOR_IMG_SIZE
+                and min(width, height) // factor >= max(CLASSIFIER_IMG_HEIGHT, CLASSIFIER_IMG_WIDTH)):
+            return flag
+    return cv2.IMREAD_GRAYSCALE
+
+def decode_image_grayscale(contents):
+    """Decodes to a single-channel (H, W) uint8 image, reduced in size when the source allows it."""
+    from PIL import Image
+    try:
+        width, height = Image.open(io.BytesIO(contents)).size # Reads the header only
+        flag = grayscale_decode_flag(width, height)
+    except Exception:
+        flag = cv2.IMREAD_GRAYSCALE # Let OpenCV decide whether it can decode the bytes
+    return cv2.imdecode(np.frombuffer(contents, np.uint8), flag)
+
+# --- Model Loading (startup, or once in the parent of a pre-forked server) ---
+def apply_threading_config(tensorflow=True):
+    config = load_thread_config(THREADING_CONFIG)
+    if config:
+        applied = apply_thread_config(config, tensorflow=tensorflow)
+        print(f"Applied threading config from {THREADING_CONFIG}: {applied}")
+
+
+def load_models(tensorflow_threads=True):
+    """
+    Loads all folds (classifiers and detectors concurrently). Returns True on success.
+    tensorflow_threads=False leaves TensorFlow's thread pools as the caller configured them.
+    """
+    apply_threading_config(tensorflow=tensorflow_threads)
     set_gpu_memory_growth() # Configure GPU for TensorFlow
     try:
-        models_store["classifiers"] = load_all_classifier_models(CLASSIFIER_MODEL_DIR)
-        models_store["detectors"] = load_all_detector_models(DETECTOR_MODEL_PATTERN)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="model-load") as pool:
+            classifiers = pool.submit(load_all_classifier_models, CLASSIFIER_MODEL_DIR,
+                                      on_loaded=lambda: record_fold_loaded("classifiers"))
+            detectors = pool.submit(load_all_detector_models, DETECTOR_MODEL_PATTERN,
+                                    on_loaded=lambda: record_fold_loaded("detectors"))
+            models_store["classifiers"] = classifiers.result()
+            models_store["detectors"] = detectors.result()
+        models_store["weights_identity"] = files_identity(
+            [classifier_model_path(CLASSIFIER_MODEL_DIR, i, CLASSIFIER_ENGINE) for i in range(1, NUM_FOLDS + 1)]
+            + [detector_model_path(DETECTOR_MODEL_PATTERN, i, DETECTOR_ENGINE) for i in range(1, NUM_FOLDS + 1)]
+        )
+        if BOX_FUSION not in FUSION_MODES:
+            raise ValueError(f"Unknown BOX_FUSION '{BOX_FUSION}'. Choose one of {FUSION_MODES}.")
+        if EARLY_EXIT_CLASSIFIER:
+            order = parse_fold_order(CLASSIFIER_FOLD_ORDER, len(models_store["classifiers"]))
+            print(f"Early-exit classification enabled (fold order {[index + 1 for index in order]}).")
+        elif FUSED_CLASSIFIER_ENSEMBLE and CLASSIFIER_ENGINE != "keras":
+            print(f"Fused classifier ensemble needs the keras engine; using per-fold {CLASSIFIER_ENGINE} models.")
+        elif FUSED_CLASSIFIER_ENSEMBLE:
+            print("Building fused classifier ensemble...")
+            models_store["classifier_ensemble"] = build_fused_classifier_ensemble(models_store["classifiers"])
         # Check if GPU is available for PyTorch and move detector models if so
-        if torch.cuda.is_available():
+        import torch
+        if torch.cuda.is_available() and DETECTOR_ENGINE == "pytorch":
             print("Moving detector models to GPU...")
             models_store["detectors"] = [model.to('cuda') for model in models_store["detectors"]]
         else:
             print("CUDA not available for PyTorch, detectors will run on CPU.")
+        STARTUP_SECONDS.set(time.perf_counter() - start, phase="load")
         print("Models loaded successfully.")
+        return True
     except FileNotFoundError as e:
         print(f"CRITICAL: {e}. Ensure model paths are correct.")
-        # In a production app, you might want to prevent startup or have a health check fail
     except Exception as e:
         print(f"CRITICAL: An unexpected error occurred during model loading: {e}")
+    return False
+
+def warmup_models():
+    """Runs a synthetic image through every fold so the first real request does not pay tracing costs."""
+    image = np.full((CLASSIFIER_IMG_HEIGHT * 2, CLASSIFIER_IMG_WIDTH * 2, 3), 128, dtype=np.uint8)
+    start = time.perf_counter()
+    predict_with_classifiers_batch(
+        [preprocess_image_for_classifier(image)], models_store["classifiers"], models_store.get("classifier_ensemble")
+    )
+    predict_with_detectors_batch(
+        [image], models_store["detectors"], DEFAULT_DETECTION_IOU_THRESHOLD, DEFAULT_DETECTION_CONF_THRESHOLD
+    )
+    STARTUP_SECONDS.set(time.perf_counter() - start, phase="warmup")
+    print(f"Warmup finished in {time.perf_counter() - start:.2f}s.")
+
+def configure_slo_controller():
+    global slo_controller
+    if not SLO_CONTROLLER:
+        return
+    slo_controller = SloController(
+        fold_priority={
+            "classifier": parse_fold_order(SLO_CLASSIFIER_FOLD_PRIORITY, len(models_store["classifiers"])),
+            "detector": parse_fold_order(SLO_DETECTOR_FOLD_PRIORITY, len(models_store["detectors"])),
+        },
+        degrade_order=[stage.strip() for stage in SLO_DEGRADE_ORDER.split(",") if stage.strip()],
+        latency_target_s=SLO_LATENCY_TARGET_MS / 1000.0, queue_limit=SLO_QUEUE_LIMIT, min_folds=SLO_MIN_FOLDS,
+        window=SLO_WINDOW, window_s=SLO_WINDOW_S, cooldown_s=SLO_COOLDOWN_S
+    )
+    print(f"SLO controller enabled (p95 target {SLO_LATENCY_TARGET_MS:.0f} ms, queue limit {SLO_QUEUE_LIMIT}, "
+          f"{len(slo_controller.levels) - 1} degradation steps).")
+
+def prepare_models():
+    """Background startup: load (unless preloaded by a pre-forked parent), warm up, then report ready."""
+    if models_store.get("classifiers") and models_store.get("detectors"):
+        # Pre-forked worker: models were loaded by the parent and are shared copy-on-write
+        print(f"Worker {os.getpid()}: using preloaded models.")
+    else:
+        print("Application startup: Loading models...")
+        if not load_models():
+            startup_state["phase"] = "failed"
+            return
+    try:
+        configure_slo_controller()
+    except ValueError as e:
+        print(f"CRITICAL: invalid SLO controller configuration: {e}")
+        startup_state["phase"] = "failed"
+        return
+    if WARMUP:
+        startup_state["phase"] = "warming"
+        try:
+            warmup_models()
+        except Exception as e:
+            print(f"Warmup failed (serving anyway): {e}")
+    startup_state["ready_after_s"] = time.time() - startup_state["started_at"]
+    startup_state["phase"] = "ready"
+
+# --- FastAPI Lifespan for Model Loading ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Models load and warm up in the background so /health can report progress right away
+    startup_state["started_at"] = time.time()
+    threading.Thread(target=prepare_models, name="model-startup", daemon=True).start()
+    await batcher.start()
+    print(f"Micro-batching enabled (max batch size {BATCH_MAX_SIZE}, max wait {BATCH_MAX_WAIT_MS} ms, "
+          f"{INFERENCE_WORKERS} inference slot(s)).")
+    if PIPELINE_STAGES:
+        print(f"Stage-pipelined requests enabled ({DECODE_WORKERS} decode, {INFERENCE_WORKERS} classify, "
+              f"{DETECT_WORKERS} detect worker(s); {STAGE_QUEUE_SIZE} batch(es) may queue for detection).")
+    if SPECULATIVE_DETECTION:
+        print(f"Speculative detection enabled ({SPECULATIVE_SLOTS} slot(s) on {AVAILABLE_CORES} core(s)"
+              f"{'; no spare core, so it never runs' if SPECULATIVE_SLOTS == 0 else ''}).")
     yield
     # Clean up models and resources if needed on shutdown
     print("Application shutdown.")
+    await batcher.stop()
+    inference_executor.shutdown(wait=False)
+    decode_executor.shutdown(wait=False)
+    speculative_executor.shutdown(wait=False)
+    if detect_stage is not None:
+        detect_stage.shutdown(wait=False)
     models_store.clear()
 
 app = FastAPI(lifespan=lifespan)
+if admission is not None:
+    # Runs before the upload is read, so rejected requests never buffer their body
+    app.add_middleware(AdmissionMiddleware, controller=admission, paths=("/predict/",), lane_of=request_lane)
 
 # --- API Endpoint ---
 @app.post("/predict/image/", response_model=PredictionResponse)
-async def predict_image_pipeline(file: UploadFile = File(...)):
+async def predict_image_pipeline(request: Request, response: Response, file: UploadFile = File(...)):
     if not models_store.get("classifiers") or not models_store.get("detectors"):
         raise HTTPException(status_code=503, detail="Models are not loaded or unavailable. Please check server logs.")
+    profile = profile_requested(request)
 
+    with IN_FLIGHT.track_inprogress(kind="requests"):
+        result = await _predict_image(file, lane_of_request(request), profile)
+    if result._profile_trace is not None:
+        response.headers["X-Profile-Trace"] = result._profile_trace
+    return result
+
+async def _predict_image(file, lane, profile=False):
     # Read image file
     try:
         contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        raw_image_bgr = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if raw_image_bgr is None:
-            raise HTTPException(status_code=400, detail="Invalid image file or format.")
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Could not process image file: {e}")
     finally:
         await file.close()
+    return await predict_contents(contents, lane, profile=profile)
 
-    # Stage 1: Classification
+async def predict_contents(contents, lane="interactive", decode=decode_image, cache_variant=(), profile=False):
+    """
+    Cache lookup, decode and batched inference for the bytes of one image.
+    `decode(contents)` returns the image; `cache_variant` keeps differently interpreted bytes apart in the cache.
+    profile=True bypasses the cache and the micro-batcher and runs the request under the request profiler.
+    """
+    loop = asyncio.get_running_loop()
+    if profile:
+        try:
+            response, trace = await loop.run_in_executor(inference_executor, profile_pipeline, contents, decode)
+        except ProfilerBusy as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        if isinstance(response, Exception):
+            raise response
+        print(f"Profiled request: trace {trace} in {PROFILE_DIR}.")
+        response._profile_trace = trace
+        return response
     try:
-        processed_img_classifier = preprocess_image_for_classifier(raw_image_bgr)
-        classification_label, classification_prob = predict_with_classifiers(
-            processed_img_classifier, models_store["classifiers"]
-        )
+        cache_key = None
+        if result_cache.enabled:
+            cache_key = await loop.run_in_executor(decode_executor, result_cache_key, contents, *cache_variant)
+            cached = await loop.run_in_executor(decode_executor, result_cache.get, cache_key)
+            if cached is not None:
+                PIPELINE_PATH.inc(path="cache_hit")
+                return PredictionResponse(**cached)
+        if PIPELINE_STAGES:
+            item = await loop.run_in_executor(decode_executor, decode_and_preprocess, decode, contents)
+        else:
+            item = await loop.run_in_executor(decode_executor, decode, contents)
+        if item is None:
+            raise HTTPException(status_code=400, detail="Invalid image file or format.")
     except Exception as e:
-        print(f"Error during classification: {e}")
-        raise HTTPException(status_code=500, detail=f"Error during classification: {e}")
+        raise HTTPException(status_code=400, detail=f"Could not process image file: {e}")
 
-    detected_bounding_box = None
-    # Stage 2: Detection (if classified as Opacity)
-    if classification_label == "Opacity":
+    # Classification and conditional detection run in a shared batch with other
+    # concurrent requests; only this request's response is returned.
+    start = time.perf_counter()
+    response = await batcher.submit(item, priority=LANE_PRIORITIES[lane])
+    if isinstance(response, Future): # Classified; detection finishes on the detect stage
+        response = await asyncio.wrap_future(response)
+        if isinstance(response, Exception):
+            raise response
+    if slo_controller is not None:
+        slo_controller.observe(time.perf_counter() - start)
+    if cache_key is not None and not response._degraded:
+        await loop.run_in_executor(decode_executor, result_cache.put, cache_key, response.model_dump())
+    return response
+
+RAW_UPLOAD_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {RAW_IMAGE_CONTENT_TYPE: {"schema": {"type": "string", "format": "binary"}}},
+    },
+    "parameters": [
+        {"name": "X-Image-Shape", "in": "header", "schema": {"type": "string"}, "example": "1024,1024",
+         "description": "height,width[,channels]; omit to read a 16-byte RIMG preamble from the body"},
+        {"name": "X-Image-Color", "in": "header", "schema": {"type": "string", "enum": ["gray", "bgr", "rgb"]}},
+        {"name": "X-Image-Dtype", "in": "header", "schema": {"type": "string", "enum": ["uint8"]}},
+    ],
+}
+
+@app.post("/predict/raw/", response_model=PredictionResponse, openapi_extra=RAW_UPLOAD_SCHEMA)
+async def predict_raw_image(request: Request, response: Response):
+    """
+    Same as /predict/image/ for a pre-decoded uint8 pixel array sent as the raw request body (see
+    raw_image.py). The array wraps the received buffer and goes straight to preprocessing: no image
+    decode here, no encode on the client.
+    """
+    if not models_store.get("classifiers") or not models_store.get("detectors"):
+        raise HTTPException(status_code=503, detail="Models are not loaded or unavailable. Please check server logs.")
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in (RAW_IMAGE_CONTENT_TYPE, "application/octet-stream"):
+        raise HTTPException(status_code=415, detail=f"Expected Content-Type {RAW_IMAGE_CONTENT_TYPE}.")
+    profile = profile_requested(request)
+
+    with IN_FLIGHT.track_inprogress(kind="requests"):
+        body = await request.body()
         try:
-            detected_boxes = predict_with_detectors(
-                raw_image_bgr, models_store["detectors"],
-                DEFAULT_DETECTION_IOU_THRESHOLD, DEFAULT_DETECTION_CONF_THRESHOLD
-            )
-
-            if detected_boxes:
-                # Select the box with the highest confidence score
-                # Each box in detected_boxes is [x1, y1, x2, y2, score, class_name]
-                highest_score_box = max(detected_boxes, key=lambda box: box[4])
-                x1, y1, x2, y2, score, _ = highest_score_box
-                
-                # Get image dimensions for normalization
-                img_height, img_width = raw_image_bgr.shape[:2]
-                
-                # Normalize coordinates to [0, 1] range
-                detected_bounding_box = BoundingBox(
-                    x=float(x1) / img_width,
-                    y=float(y1) / img_height,
-                    width=float(x2 - x1) / img_width,
-                    height=float(y2 - y1) / img_height
-                )
-        except Exception as e:
-            print(f"Error during detection: {e}")
-            # Optionally, you could allow the API to return classification even if detection fails
-            raise HTTPException(status_code=500, detail=f"Error during detection: {e}")
-    else:
-        print(f"Skipping detection as classification is '{classification_label}' (Prob: {classification_prob:.4f})")
+            image, color = parse_raw_image(body, request.headers, RAW_IMAGE_MAX_PIXELS)
+        except RawImageError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        result = await predict_contents(body, lane_of_request(request), decode=lambda _: to_pipeline_image(image, color),
+                                        cache_variant=("raw", image.shape, color), profile=profile)
+    if result._profile_trace is not None:
+        response.headers["X-Profile-Trace"] = result._profile_trace
+    return result
 
+BATCH_UPLOAD_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "required": ["files"],
+            "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}},
+        }}},
+    }
+}
 
-    return PredictionResponse(
-        probability=classification_prob,
-        boundingBox=detected_bounding_box
-    )
+@app.post("/predict/batch", openapi_extra=BATCH_UPLOAD_SCHEMA)
+async def predict_batch(request: Request):
+    """
+    Many images in one request: several `files` parts, or a single zip/tar archive of images.
+    Streams one NDJSON line per image as soon as it finishes (in completion order):
+    {"index", "filename", "status": 200, "result": PredictionResponse} or {..., "status", "detail"}.
+    """
+    if not models_store.get("classifiers") or not models_store.get("detectors"):
+        raise HTTPException(status_code=503, detail="Models are not loaded or unavailable. Please check server logs.")
+    # The form is parsed here rather than by FastAPI so the spooled uploads stay open while streaming
+    try:
+        form = await request.form(max_files=BULK_MAX_FILES)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not parse multipart upload: {e}")
+    uploads = [(upload.filename or f"file{i}", upload.file)
+               for i, upload in enumerate(form.getlist("files")) if isinstance(upload, StarletteUploadFile)]
+    if not uploads:
+        await form.close()
+        raise HTTPException(status_code=400, detail="No files uploaded (use the 'files' form field).")
+    return StreamingResponse(stream_batch_predictions(uploads, form), media_type="application/x-ndjson")
+
+async def predict_batch_item(index, name, contents):
+    try:
+        if isinstance(contents, Exception):
+            raise HTTPException(status_code=400, detail=f"Could not read image: {contents}")
+        result = await predict_contents(contents, "bulk")
+        return {"index": index, "filename": name, "status": 200, "result": result.model_dump()}
+    except HTTPException as e:
+        return {"index": index, "filename": name, "status": e.status_code, "detail": e.detail}
+    except Exception as e:
+        return {"index": index, "filename": name, "status": 500, "detail": str(e)}
+
+async def stream_batch_predictions(uploads, form):
+    """
+    Pulls images from the upload only when fewer than BULK_MAX_IN_FLIGHT are pending, so archive
+    members are read and decoded lazily, and yields each result line as it completes.
+    """
+    loop = asyncio.get_running_loop()
+    images = iter_upload_images(uploads, BULK_MAX_IMAGE_BYTES)
+    pending = set()
+    index = 0
+    exhausted = False
+    try:
+        with IN_FLIGHT.track_inprogress(kind="requests"):
+            while pending or not exhausted:
+                while not exhausted and len(pending) < BULK_MAX_IN_FLIGHT:
+                    try:
+                        item = await loop.run_in_executor(decode_executor, next, images, None)
+                    except Exception as e: # Unreadable archive: report it and finish what is pending
+                        yield json.dumps({"index": index, "filename": None, "status": 400,
+                                          "detail": f"Could not read upload: {e}"}) + "\n"
+                        item = None
+                    if item is None:
+                        exhausted = True
+                        break
+                    pending.add(asyncio.ensure_future(predict_batch_item(index, *item)))
+                    index += 1
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield json.dumps(task.result()) + "\n"
+    finally:
+        # Client went away or the stream ended: drop queued work and release the spooled uploads
+        for task in pending:
+            task.cancel()
+        await form.close()
 
 @app.get("/health")
 async def health_check():
-    if models_store.get("classifiers") and models_store.get("detectors"):
-        return {"status": "healthy", "message": "Models loaded."}
-    return {"status": "unhealthy", "message": "Models not loaded or error during startup."}
+    phase = startup_state["phase"]
+    body = {
+        "phase": phase,
+        "progress": {
+            "classifiers_loaded": startup_state["classifiers_loaded"],
+            "detectors_loaded": startup_state["detectors_loaded"],
+            "folds_per_stage": NUM_FOLDS,
+        },
+        "uptime_s": time.time() - startup_state["started_at"],
+        "ready_after_s": startup_state["ready_after_s"],
+    }
+    if phase == "ready" and models_store.get("classifiers") and models_store.get("detectors"):
+        return {"status": "healthy", "message": "Models loaded.", **body}
+    if phase == "failed":
+        body.update(status="unhealthy", message="Models not loaded or error during startup.")
+    elif phase == "warming":
+        body.update(status="warming", message="Models loaded; running warmup.")
+    else:
+        body.update(status="starting", message="Loading models.")
+    # Not ready: 503 so orchestration keeps traffic away until warmup has finished
+    return JSONResponse(status_code=503, content=body)
+
+@app.get("/stats/batching")
+async def batching_stats():
+    return batcher.stats()
+
+@app.get("/stats/cache")
+async def cache_stats():
+    return result_cache.stats()
+
+def queued_by_lane():
+    queued = batcher.stats()["queued_by_priority"]
+    return {lane: queued.get(str(priority), 0) for lane, priority in LANE_PRIORITIES.items()}
+
+@app.get("/stats/admission")
+async def admission_stats():
+    if admission is None:
+        return {"enabled": False, "queued_images": queued_by_lane()}
+    return {"enabled": True, **admission.stats(), "queued_images": queued_by_lane()}
+
+@app.get("/stats/stages")
+async def stage_stats_report():
+    """Per-stage throughput with PIPELINE_STAGES (items: requests decoded, images classified, images detected)."""
+    if not PIPELINE_STAGES:
+        return {"enabled": False}
+    return {"enabled": True, "stages": {name: stats.snapshot() for name, stats in stage_stats.items()}}
+
+@app.get("/stats/slo")
+async def slo_stats():
+    if slo_controller is None:
+        return {"enabled": False}
+    return {"enabled": True, **slo_controller.stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text exposition of stage/fold latency histograms, path counters and gauges."""
+    IN_FLIGHT.set(batcher.stats()["queued_requests"], kind="queued")
+    for lane, count in queued_by_lane().items():
+        QUEUED_BY_LANE.set(count, lane=lane)
+    if admission is not None:
+        stats = admission.stats()
+        for lane in LANE_PRIORITIES:
+            ADMISSION_PENDING.set(stats["pending"].get(lane, 0), lane=lane, kind="requests")
+        ADMISSION_PENDING.set(stats["pending_bytes"], lane="all", kind="bytes")
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
 
 # To run this app:
 # 1. Save as api_server.py (or any other name)
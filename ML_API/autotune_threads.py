@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from thread_config import THREAD_CONFIG_KEYS, apply_thread_config
+
+# Sweeps TensorFlow intra/inter-op threads, torch threads and worker processes over the
+# benchmark workload (one image through preprocessing, every classifier fold and every detector
+# fold, as on the Opacity path) and reports the best configuration for throughput and for latency
+# on this host. Every configuration runs in fresh processes, because TensorFlow's thread counts can
+# only be set before its runtime starts; `workers` processes run side by side, as pre-forked
+# workers would. The selected profile is written to a config file that api_server.py and
+# backend/classify.py apply at startup.
+# prefork_server.py runs its workers differently (TensorFlow pinned to one intra- and one inter-op
+# thread, functions run eagerly, CPU only), so worker counts and torch threads are swept a second time
+# in exactly that mode and written as separate prefork profiles, which are the ones it reads.
+#
+#   python autotune_threads.py --output threading_config.json [--objective latency] [--real_models]
+
+
+def available_cores():
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+
+def thread_counts(budget):
+    return sorted({1, max(budget // 2, 1), budget})
+
+
+def candidate_configs(cores, args):
+    """Thread settings per worker count, each worker given an equal share of the cores."""
+    configs = []
+    if not args.no_default:
+        configs.append({key: 0 for key in THREAD_CONFIG_KEYS} | {"workers": 1}) # Framework defaults
+    for workers in args.workers or thread_counts(cores):
+        budget = max(cores // workers, 1)
+        for tf_intra in args.tf_intra or thread_counts(budget):
+            for tf_inter in args.tf_inter or [1, 2]:
+                for torch_threads in args.torch_threads or thread_counts(budget):
+                    configs.append({"tf_intra_op_threads": tf_intra, "tf_inter_op_threads": tf_inter,
+                                    "torch_threads": torch_threads, "workers": workers})
+    return configs
+
+
+def candidate_prefork_configs(cores, args):
+    """Worker counts and torch threads for prefork_server.py, whose TensorFlow is fixed at 1/1 threads and eager."""
+    configs = []
+    for workers in args.workers or thread_counts(cores):
+        for torch_threads in args.torch_threads or thread_counts(max(cores // workers, 1)):
+            configs.append({"tf_intra_op_threads": 1, "tf_inter_op_threads": 1,
+                            "torch_threads": torch_threads, "workers": workers, "prefork": True})
+    return configs
+
+
+def run_worker(args):
+    """Worker process: warm up, report READY, run the workload for --duration seconds once told to start."""
+    if args.prefork_worker:
+        os.environ["CUDA_VISIBLE_DEVICES"] = "-1" # As in prefork_server.py
+    apply_thread_config({"tf_intra_op_threads": args.tf_intra_worker, "tf_inter_op_threads": args.tf_inter_worker,
+                         "torch_threads": args.torch_threads_worker})
+    if args.prefork_worker:
+        import tensorflow as tf
+        tf.config.run_functions_eagerly(True)
+    import api_server
+    from benchmark_pipeline import synthetic_radiograph, build_stand_in_classifiers, build_stand_in_detectors
+    if args.real_models:
+        classifiers = api_server.load_all_classifier_models(api_server.CLASSIFIER_MODEL_DIR)
+        detectors = api_server.load_all_detector_models(api_server.DETECTOR_MODEL_PATTERN)
+    else:
+        classifiers = build_stand_in_classifiers(args.folds, args.classifier_arch)
+        detectors = build_stand_in_detectors(args.folds, args.detector_cfg)
+    image = synthetic_radiograph(args.image_size, 0)
+
+    def workload():
+        processed = api_server.preprocess_image_for_classifier(image)
+        api_server.predict_with_classifiers_batch([processed], classifiers)
+        api_server.predict_with_detectors_batch([image], detectors, api_server.DEFAULT_DETECTION_IOU_THRESHOLD,
+                                                api_server.DEFAULT_DETECTION_CONF_THRESHOLD)
+
+    for _ in range(args.warmup):
+        workload()
+    print("READY", flush=True)
+    sys.stdin.readline()
+    latencies = []
+    begin = time.perf_counter()
+    while time.perf_counter() - begin < args.duration:
+        start = time.perf_counter()
+        workload()
+        latencies.append(time.perf_counter() - start)
+    print("RESULT " + json.dumps({"latencies": latencies, "elapsed_s": time.perf_counter() - begin}), flush=True)
+
+
+def measure_config(config, args):
+    """Starts config["workers"] worker processes, runs them together; returns throughput and latency."""
+    command = [sys.executable, os.path.abspath(__file__), "--run_worker",
+               "--tf_intra_worker", str(config["tf_intra_op_threads"]),
+               "--tf_inter_worker", str(config["tf_inter_op_threads"]),
+               "--torch_threads_worker", str(config["torch_threads"]),
+               "--duration", str(args.duration), "--warmup", str(args.warmup),
+               "--image_size", str(args.image_size), "--folds", str(args.folds),
+               "--classifier_arch", args.classifier_arch, "--detector_cfg", args.detector_cfg]
+    if args.real_models:
+        command.append("--real_models")
+    if config.get("prefork"):
+        command.append("--prefork_worker")
+    workers = [subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, text=True) for _ in range(config["workers"])]
+
+    def read_marker(worker, marker):
+        for line in worker.stdout:
+            if line.startswith(marker):
+                return line[len(marker):].strip()
+        raise RuntimeError(f"Worker exited with status {worker.wait()} before reporting {marker.strip()}.")
+
+    try:
+        for worker in workers:
+            read_marker(worker, "READY")
+        for worker in workers: # All start together, so they compete for the cores as in production
+            worker.stdin.write("go\n")
+            worker.stdin.flush()
+        reports = [json.loads(read_marker(worker, "RESULT ")) for worker in workers]
+    finally:
+        for worker in workers:
+            worker.kill() if worker.poll() is None else None
+            worker.wait()
+    latencies = [latency for report in reports for latency in report["latencies"]]
+    return {
+        **config,
+        "images_per_s": len(latencies) / max(report["elapsed_s"] for report in reports),
+        "p50_ms": float(np.percentile(latencies, 50)) * 1000.0,
+        "p95_ms": float(np.percentile(latencies, 95)) * 1000.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep TensorFlow/torch threads and worker counts on this host.")
+    parser.add_argument("--output", type=str, default="threading_config.json", help="Config file to write.")
+    parser.add_argument("--report", type=str, default=None, help="Optional JSON file with every measurement.")
+    parser.add_argument("--objective", type=str, default="throughput", choices=["throughput", "latency"],
+                        help="Which best configuration the config file selects.")
+    parser.add_argument("--workers", type=int, nargs="+", default=None, help="Worker counts (default: 1, cores/2, cores).")
+    parser.add_argument("--tf_intra", type=int, nargs="+", default=None)
+    parser.add_argument("--tf_inter", type=int, nargs="+", default=None)
+    parser.add_argument("--torch_threads", type=int, nargs="+", default=None)
+    parser.add_argument("--no_default", action="store_true", help="Skip the framework-default baseline.")
+    parser.add_argument("--skip_prefork", action="store_true",
+                        help="Do not sweep worker counts in prefork_server.py's mode (TensorFlow 1/1 threads, eager).")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds measured per configuration.")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--image_size", type=int, default=1024)
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--classifier_arch", type=str, default="densenet121", choices=["densenet121", "tiny"])
+    parser.add_argument("--detector_cfg", type=str, default="yolov8n.yaml")
+    parser.add_argument("--real_models", action="store_true", help="Use the configured fold models instead of stand-ins.")
+    # Internal: worker process mode
+    parser.add_argument("--run_worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--tf_intra_worker", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--tf_inter_worker", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--torch_threads_worker", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--prefork_worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_worker:
+        run_worker(args)
+        sys.exit(0)
+
+    def sweep(configs):
+        results = []
+        for config in configs:
+            try:
+                result = measure_config(config, args)
+            except RuntimeError as e:
+                print(f"{config}: failed ({e})")
+                continue
+            results.append(result)
+            print(f"{'prefork ' if config.get('prefork') else ''}workers {config['workers']:>2} "
+                  f"tf {config['tf_intra_op_threads']:>2}/{config['tf_inter_op_threads']} torch {config['torch_threads']:>2}: "
+                  f"{result['images_per_s']:7.2f} images/s, p50 {result['p50_ms']:8.1f} ms, p95 {result['p95_ms']:8.1f} ms")
+        return results
+
+    def best_profiles(results):
+        return {
+            "throughput": max(results, key=lambda result: result["images_per_s"]),
+            # Tail latency, as the SLO controller and the benchmarks judge it
+            "latency": min(results, key=lambda result: result["p95_ms"]),
+        }
+
+    cores = available_cores()
+    results = sweep(candidate_configs(cores, args))
+    if not results:
+        raise SystemExit("No configuration could be measured.")
+    profiles = best_profiles(results)
+    prefork_results = [] if args.skip_prefork else sweep(candidate_prefork_configs(cores, args))
+
+    config = {
+        "selected": args.objective,
+        "profiles": profiles,
+        **({"prefork_profiles": best_profiles(prefork_results)} if prefork_results else {}),
+        "host": {"cores": cores, "platform": platform.platform(), "python": sys.version.split()[0],
+                 "real_models": args.real_models, "classifier_arch": args.classifier_arch},
+        "measured_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    print(json.dumps({key: config[key] for key in ("profiles", "prefork_profiles") if key in config}, indent=4))
+    with open(args.output, "w") as f:
+        json.dump(config, f, indent=4)
+    print(f"Wrote {args.output} (selected: {args.objective}).")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"host": config["host"], "results": results, "prefork_results": prefork_results}, f, indent=4)
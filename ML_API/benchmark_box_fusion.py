@@ -0,0 +1,131 @@
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from box_fusion import fuse_boxes_batch
+
+# Benchmarks the NumPy box-fusion engine against the previous torchvision path (fold outputs
+# round-tripped through .tolist(), torch tensors, per-element indexing) and checks that NMS
+# results are identical. Inputs are synthetic fold detections clustered around a few objects.
+#
+#   python benchmark_box_fusion.py --batch_sizes 1 8 32 --boxes_per_fold 5 50
+
+
+def legacy_ensemble_nms(all_boxes, all_scores, all_classes, iou_threshold):
+    """The torchvision implementation box_fusion.py replaces, kept here as the reference."""
+    import torch
+    import torchvision
+    if not all_boxes: return []
+    boxes_tensor = torch.tensor(all_boxes, dtype=torch.float32)
+    scores_tensor = torch.tensor(all_scores, dtype=torch.float32)
+    keep_indices = torchvision.ops.nms(boxes_tensor, scores_tensor, iou_threshold)
+    return [[
+        float(boxes_tensor[idx][0]), float(boxes_tensor[idx][1]),
+        float(boxes_tensor[idx][2]), float(boxes_tensor[idx][3]),
+        float(scores_tensor[idx]), int(all_classes[idx])
+    ] for idx in keep_indices]
+
+
+def legacy_path(batch, iou_threshold):
+    results = []
+    for fold_outputs in batch:
+        boxes, scores, classes = [], [], []
+        for fold_boxes, fold_scores, fold_classes in fold_outputs:
+            boxes.extend(fold_boxes.tolist())
+            scores.extend(fold_scores.tolist())
+            classes.extend(fold_classes.tolist())
+        results.append(legacy_ensemble_nms(boxes, scores, classes, iou_threshold))
+    return results
+
+
+def concatenated(batch):
+    return ([np.concatenate([boxes for boxes, _, _ in image]) for image in batch],
+            [np.concatenate([scores for _, scores, _ in image]) for image in batch],
+            [np.concatenate([classes for _, _, classes in image]) for image in batch])
+
+
+def numpy_per_image_path(batch, iou_threshold):
+    return [fuse_boxes_batch(*concatenated([image]), iou_threshold)[0] for image in batch]
+
+
+def numpy_batched_path(batch, iou_threshold, mode='nms', num_models=None):
+    return fuse_boxes_batch(*concatenated(batch), iou_threshold, mode=mode, num_models=num_models)
+
+
+def synthetic_fold_detections(rng, folds, boxes_per_fold, image_size=1024, objects=3):
+    """Per fold: (boxes (K, 4), scores (K,), classes (K,)) float32, jittered around a few objects."""
+    centers = rng.random((objects, 2)) * image_size * 0.8 + 50
+    detections = []
+    for _ in range(folds):
+        count = int(rng.integers(0, boxes_per_fold + 1))
+        xy = centers[rng.integers(0, objects, count)] + rng.normal(0, 12, (count, 2))
+        wh = rng.normal(120, 15, (count, 2))
+        detections.append((
+            np.hstack([xy - wh / 2, xy + wh / 2]).astype(np.float32),
+            rng.uniform(0.25, 1.0, count).astype(np.float32),
+            np.zeros(count, dtype=np.float32),
+        ))
+    return detections
+
+
+def time_ms(fn, iterations):
+    fn()
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    return {"p50_ms": float(np.percentile(latencies, 50)), "p95_ms": float(np.percentile(latencies, 95))}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark NumPy box fusion against the torchvision NMS path.")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--boxes_per_fold", type=int, nargs="+", default=[5, 50])
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--iou", type=float, default=0.45)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--parity_trials", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+
+    # Parity: NMS mode must reproduce the torchvision path exactly
+    mismatches = 0
+    for _ in range(args.parity_trials):
+        batch = [synthetic_fold_detections(rng, args.folds, max(args.boxes_per_fold))
+                 for _ in range(int(rng.integers(1, 9)))]
+        for reference, fused in zip(legacy_path(batch, args.iou), numpy_batched_path(batch, args.iou)):
+            candidate = [[float(x1), float(y1), float(x2), float(y2), float(score), int(class_id)]
+                         for x1, y1, x2, y2, score, class_id in fused]
+            mismatches += int(reference != candidate)
+
+    results = []
+    for boxes_per_fold in args.boxes_per_fold:
+        for batch_size in args.batch_sizes:
+            batch = [synthetic_fold_detections(rng, args.folds, boxes_per_fold) for _ in range(batch_size)]
+            row = {
+                "batch_size": batch_size,
+                "boxes_per_fold": boxes_per_fold,
+                "torchvision": time_ms(lambda: legacy_path(batch, args.iou), args.iterations),
+                "numpy_nms_per_image": time_ms(lambda: numpy_per_image_path(batch, args.iou), args.iterations),
+                "numpy_nms_batched": time_ms(lambda: numpy_batched_path(batch, args.iou), args.iterations),
+                "numpy_wbf_batched": time_ms(lambda: numpy_batched_path(batch, args.iou, 'wbf', args.folds),
+                                             args.iterations),
+            }
+            row["speedup_batched_vs_torchvision_p50"] = row["torchvision"]["p50_ms"] / row["numpy_nms_batched"]["p50_ms"]
+            results.append(row)
+            print(f"batch {batch_size:>3} boxes/fold {boxes_per_fold:>3}: torchvision {row['torchvision']['p50_ms']:.3f} ms, "
+                  f"numpy batched {row['numpy_nms_batched']['p50_ms']:.3f} ms, wbf {row['numpy_wbf_batched']['p50_ms']:.3f} ms")
+
+    report = {"parity_trials": args.parity_trials, "nms_parity_mismatches": mismatches, "results": results}
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,98 @@
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+import numpy as np
+import cv2
+
+import api_server
+from benchmark_pipeline import synthetic_radiograph
+
+# Compares the two ingest paths per request: bytes allocated (peak traced by tracemalloc, which
+# sees NumPy and OpenCV output arrays) and time, from upload bytes to classifier + detector inputs.
+#   color     - cv2.IMREAD_COLOR at full resolution, BGR->RGB for the classifier and again for YOLO
+#   grayscale - single-channel decode, reduced resolution when large enough (GRAYSCALE_DECODE=1)
+#
+#   python benchmark_decode.py --sizes 1024 2048 3000
+#   python benchmark_decode.py --images sample_radiographs/
+
+
+def color_path(contents):
+    image = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR)
+    return image, api_server.preprocess_image_for_classifier(image), api_server.image_for_detector(image)
+
+
+def grayscale_path(contents):
+    image = api_server.decode_image_grayscale(contents)
+    return image, api_server.preprocess_image_for_classifier(image), api_server.image_for_detector(image)
+
+
+def measure(path_fn, contents, iterations):
+    path_fn(contents) # Warm up
+    latencies, peaks = [], []
+    for _ in range(iterations):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        outputs = path_fn(contents)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        del outputs
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "peak_allocated_mb": float(np.median(peaks)) / 2**20,
+    }
+
+
+def load_samples(args):
+    if args.images:
+        names = sorted(name for name in os.listdir(args.images) if name.lower().endswith(('.png', '.jpg', '.jpeg')))
+        for name in names[:args.limit]:
+            with open(os.path.join(args.images, name), "rb") as f:
+                yield name, f.read()
+    else:
+        for size in args.sizes:
+            gray = cv2.cvtColor(synthetic_radiograph(size, size), cv2.COLOR_BGR2GRAY)
+            for codec in ('.jpg', '.png'):
+                yield f"synthetic_{size}{codec}", cv2.imencode(codec, gray)[1].tobytes()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bytes allocated and time per request: color vs grayscale ingest.")
+    parser.add_argument("--images", type=str, default=None, help="Directory of sample uploads (default: synthetic).")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024, 2048, 3000])
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    rows = []
+    for name, contents in load_samples(args):
+        color_image, color_input, _ = color_path(contents)
+        gray_image, gray_input, _ = grayscale_path(contents)
+        row = {
+            "image": name,
+            "upload_kb": len(contents) / 1024,
+            "color_decoded_shape": list(color_image.shape),
+            "grayscale_decoded_shape": list(gray_image.shape),
+            "color": measure(color_path, contents, args.iterations),
+            "grayscale": measure(grayscale_path, contents, args.iterations),
+            # 0 when the source is grayscale and decoded at full resolution
+            "classifier_input_max_abs_diff": float(np.max(np.abs(color_input - gray_input))),
+        }
+        row["speedup_p50"] = row["color"]["p50_ms"] / row["grayscale"]["p50_ms"]
+        row["allocation_ratio"] = row["color"]["peak_allocated_mb"] / max(row["grayscale"]["peak_allocated_mb"], 1e-9)
+        rows.append(row)
+        print(f"{name:<24} color {row['color']['p50_ms']:8.2f} ms {row['color']['peak_allocated_mb']:7.2f} MB | "
+              f"grayscale {row['grayscale']['p50_ms']:8.2f} ms {row['grayscale']['peak_allocated_mb']:7.2f} MB "
+              f"{tuple(gray_image.shape)}")
+    tracemalloc.stop()
+
+    print(json.dumps(rows, indent=4))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(rows, f, indent=4)
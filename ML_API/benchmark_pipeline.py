@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+import cv2
+
+import api_server
+
+# Per-stage micro-benchmarks for the inference pipeline. Runs fully offline: the fold models
+# are randomly initialised stand-ins with the production architectures (DenseNet121 classifier,
+# YOLOv8 detector), so no trained weights are needed.
+#
+#   python benchmark_pipeline.py run --output bench.json
+#   python benchmark_pipeline.py compare baseline.json bench.json --tolerance 0.15
+#
+# Stages: imdecode, preprocess, classifier fold i, detector fold i, all detector folds with
+# per-fold vs shared preprocessing, ensemble NMS; reported as p50/p95/p99 per image size and batch size.
+
+
+def synthetic_radiograph(size, seed):
+    """Smooth grayscale gradient plus noise, replicated to 3 channels, so codecs compress realistically."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    image = 0.5 + 0.3 * np.sin(6.0 * x) * np.cos(4.0 * y) + rng.normal(0.0, 0.05, (size, size))
+    gray = (np.clip(image, 0.0, 1.0) * 255).astype(np.uint8)
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+
+def build_stand_in_classifiers(num_folds, arch):
+    import tensorflow as tf
+    models = []
+    for fold in range(num_folds):
+        tf.keras.utils.set_random_seed(fold)
+        shape = (api_server.CLASSIFIER_IMG_HEIGHT, api_server.CLASSIFIER_IMG_WIDTH, 3)
+        if arch == 'densenet121':
+            model = tf.keras.applications.DenseNet121(weights=None, input_shape=shape, classes=1,
+                                                      classifier_activation='sigmoid')
+        else:
+            inputs = tf.keras.Input(shape)
+            x = tf.keras.layers.Conv2D(16, 3, strides=2, activation='relu')(inputs)
+            x = tf.keras.layers.GlobalAveragePooling2D()(x)
+            model = tf.keras.Model(inputs, tf.keras.layers.Dense(1, activation='sigmoid')(x))
+        models.append(model)
+    return models
+
+
+def build_stand_in_detectors(num_folds, cfg):
+    import torch
+    from ultralytics import YOLO
+    models = []
+    for fold in range(num_folds):
+        torch.manual_seed(fold)
+        models.append(YOLO(cfg))
+    return models
+
+
+def random_boxes(count, image_size, rng):
+    xy = rng.random((count, 2)) * image_size * 0.8
+    wh = rng.random((count, 2)) * image_size * 0.2 + 8.0
+    return np.hstack([xy, xy + wh]).tolist(), rng.random(count).tolist(), [0.0] * count
+
+
+def time_stage(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    return {
+        "n": iterations,
+        "mean_ms": float(np.mean(latencies)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+def run_benchmarks(args):
+    results = {}
+
+    def record(name, fn):
+        results[name] = time_stage(fn, args.iterations, args.warmup)
+        print(f"{name:<48} p50 {results[name]['p50_ms']:9.3f} ms   p99 {results[name]['p99_ms']:9.3f} ms")
+
+    images = {size: synthetic_radiograph(size, size) for size in args.image_sizes}
+
+    for size, image in images.items():
+        for codec in ('.jpg', '.png'):
+            encoded = cv2.imencode(codec, image)[1].tobytes()
+            record(f"imdecode/{codec[1:]}/{size}", lambda: api_server.decode_image(encoded))
+        record(f"preprocess/{size}", lambda: api_server.preprocess_image_for_classifier(image))
+
+    classifiers = build_stand_in_classifiers(args.folds, args.classifier_arch)
+    classifier_input = api_server.preprocess_image_for_classifier(images[args.image_sizes[0]])
+    for batch_size in args.batch_sizes:
+        batch = np.repeat(classifier_input, batch_size, axis=0)
+        for fold, model in enumerate(classifiers, start=1):
+            record(f"classifier_fold{fold}/batch{batch_size}", lambda: model.predict(batch, verbose=0))
+
+    detectors = build_stand_in_detectors(args.folds, args.detector_cfg)
+    conf = api_server.DEFAULT_DETECTION_CONF_THRESHOLD
+    shared_preprocess_mismatches = 0
+    for size, image in images.items():
+        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        for batch_size in args.batch_sizes:
+            batch = [rgb] * batch_size
+            for fold, model in enumerate(detectors, start=1):
+                record(f"detector_fold{fold}/{size}/batch{batch_size}",
+                       lambda: model.predict(batch, conf=conf, verbose=False))
+            # All folds: each one preprocessing the batch itself vs one shared preprocessed tensor
+            record(f"detector_folds_per_fold_preprocess/{size}/batch{batch_size}",
+                   lambda: [model.predict(batch, conf=conf, verbose=False) for model in detectors])
+            record(f"detector_folds_shared_preprocess/{size}/batch{batch_size}",
+                   lambda: api_server.run_detector_folds(batch, detectors, conf))
+            reference = [model.predict(batch, conf=conf, verbose=False) for model in detectors]
+            shared = api_server.run_detector_folds(batch, detectors, conf)
+            shared_preprocess_mismatches += sum(
+                not np.array_equal(a.boxes.data.cpu().numpy(), b.boxes.data.cpu().numpy())
+                for fold_a, fold_b in zip(reference, shared) for a, b in zip(fold_a, fold_b)
+            )
+
+    rng = np.random.default_rng(0)
+    for boxes_per_fold in args.nms_boxes_per_fold:
+        boxes, scores, classes = random_boxes(boxes_per_fold * args.folds, args.image_sizes[-1], rng)
+        record(f"ensemble_nms/{boxes_per_fold * args.folds}_boxes",
+               lambda: api_server.ensemble_detections_nms(boxes, scores, classes, api_server.DEFAULT_DETECTION_IOU_THRESHOLD))
+
+    return {
+        "meta": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "classifier_arch": args.classifier_arch,
+            "detector_cfg": args.detector_cfg,
+            "folds": args.folds,
+            "iterations": args.iterations,
+            "shared_preprocess_box_mismatches": shared_preprocess_mismatches,
+        },
+        "results": results,
+    }
+
+
+def compare_reports(baseline, current, metric, tolerance):
+    """Returns (rows, regressions) comparing `metric` per stage; a regression is current > baseline * (1 + tolerance)."""
+    rows, regressions = [], []
+    for name, base in baseline["results"].items():
+        if name not in current["results"]:
+            continue
+        ratio = current["results"][name][metric] / base[metric] if base[metric] > 0 else 1.0
+        row = {"stage": name, "baseline_ms": base[metric], "current_ms": current["results"][name][metric], "ratio": ratio}
+        rows.append(row)
+        if ratio > 1.0 + tolerance:
+            regressions.append(row)
+    return rows, regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage micro-benchmarks for the inference pipeline.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks and write a JSON report.")
+    run_parser.add_argument("--output", type=str, default="benchmark_report.json")
+    run_parser.add_argument("--image_sizes", type=int, nargs="+", default=[512, 1024, 2048])
+    run_parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 4, 8])
+    run_parser.add_argument("--nms_boxes_per_fold", type=int, nargs="+", default=[10, 100])
+    run_parser.add_argument("--folds", type=int, default=api_server.NUM_FOLDS)
+    run_parser.add_argument("--iterations", type=int, default=30)
+    run_parser.add_argument("--warmup", type=int, default=3)
+    run_parser.add_argument("--classifier_arch", type=str, default="densenet121", choices=["densenet121", "tiny"],
+                            help="'tiny' is a small stand-in for quick CI smoke runs.")
+    run_parser.add_argument("--detector_cfg", type=str, default="yolov8n.yaml",
+                            help="Ultralytics model config used for randomly initialised detectors.")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare a report against a baseline.")
+    compare_parser.add_argument("baseline", type=str)
+    compare_parser.add_argument("current", type=str)
+    compare_parser.add_argument("--metric", type=str, default="p50_ms", choices=["mean_ms", "p50_ms", "p95_ms", "p99_ms"])
+    compare_parser.add_argument("--tolerance", type=float, default=0.15,
+                                help="Allowed slowdown before a stage counts as a regression (0.15 = 15%%).")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        report = run_benchmarks(args)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"Wrote {args.output}")
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        rows, regressions = compare_reports(baseline, current, args.metric, args.tolerance)
+        for row in rows:
+            flag = "REGRESSION" if row in regressions else ""
+            print(f"{row['stage']:<48} {row['baseline_ms']:9.3f} -> {row['current_ms']:9.3f} ms  x{row['ratio']:.2f} {flag}")
+        if regressions:
+            print(f"{len(regressions)} stage(s) regressed by more than {args.tolerance:.0%} on {args.metric}.")
+            sys.exit(1)
+        print("No regressions.")
@@ -0,0 +1,82 @@
+import argparse
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+import cv2
+
+import api_server
+
+# Sequential vs speculative detection (SPECULATIVE_DETECTION=1) on the loaded fold models, one
+# image per request. The classification threshold is forced to 0 / above 1 so every image takes the
+# Opacity / Normal path whatever the weights. Reports p50/p95 latency for both cases, process CPU
+# seconds per request (the difference on Normal images is the CPU speculation wastes) and checks
+# that Opacity responses are identical.
+#
+#   python benchmark_speculation.py --image sample.png --iterations 20 --slots 1
+
+
+def drain_speculative_executor():
+    """Waits until discarded speculative runs have stopped, so their CPU time is counted."""
+    api_server.speculative_executor.submit(lambda: None).result()
+
+
+def run_case(image, iterations, speculative, slots, threshold):
+    api_server.SPECULATIVE_DETECTION = speculative
+    api_server.speculative_slots = threading.BoundedSemaphore(slots) if slots > 0 else threading.Semaphore(0)
+    api_server.DEFAULT_CLASSIFICATION_THRESHOLD = threshold
+    api_server.run_pipeline_batch([image]) # Warm up
+    drain_speculative_executor()
+    latencies, responses = [], []
+    cpu_start = time.process_time()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        response = api_server.run_pipeline_batch([image])[0]
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        responses.append(response)
+    drain_speculative_executor()
+    cpu_per_request = (time.process_time() - cpu_start) / iterations
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "cpu_s_per_request": cpu_per_request,
+    }, responses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency and wasted CPU of speculative detection.")
+    parser.add_argument("--image", type=str, required=True)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--slots", type=int, default=max(api_server.SPECULATIVE_SLOTS, 1),
+                        help="Speculative slots (default: spare cores, at least 1).")
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    image = cv2.imread(args.image)
+    if image is None:
+        raise SystemExit(f"Could not read {args.image}")
+    if not api_server.load_models():
+        raise SystemExit("Model loading failed.")
+    api_server.warmup_models()
+
+    report = {"cores": api_server.AVAILABLE_CORES, "slots": args.slots}
+    mismatches = 0
+    for case, threshold in (("opacity", 0.0), ("normal", 1.01)):
+        sequential, sequential_responses = run_case(image, args.iterations, False, args.slots, threshold)
+        speculative, speculative_responses = run_case(image, args.iterations, True, args.slots, threshold)
+        mismatches += sum(a.model_dump() != b.model_dump() for a, b in zip(sequential_responses, speculative_responses))
+        report[case] = {"sequential": sequential, "speculative": speculative,
+                        "p50_speedup": sequential["p50_ms"] / speculative["p50_ms"]}
+        print(f"{case:<8} p50 sequential {sequential['p50_ms']:8.1f} ms, speculative {speculative['p50_ms']:8.1f} ms | "
+              f"CPU/request {sequential['cpu_s_per_request']:.3f} s vs {speculative['cpu_s_per_request']:.3f} s")
+    report["wasted_cpu_s_per_normal_request"] = (report["normal"]["speculative"]["cpu_s_per_request"]
+                                                 - report["normal"]["sequential"]["cpu_s_per_request"])
+    report["response_mismatches"] = mismatches
+
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    sys.exit(1 if mismatches else 0)
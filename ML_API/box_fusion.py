@@ -0,0 +1,139 @@
+import numpy as np
+
+# Vectorized fusion of the detector folds' boxes, on NumPy arrays end to end.
+#
+#   nms - greedy non-maximum suppression, class-agnostic, identical to torchvision.ops.nms
+#         (same float32 IoU arithmetic, same score ordering, boxes kept in descending score order)
+#   wbf - weighted boxes fusion: overlapping boxes are merged into their score-weighted average,
+#         and the fused score is down-weighted when fewer folds than num_models agree
+#
+# Every function takes one (boxes, scores, classes) set per image and processes the whole
+# batch at once; images are padded to the largest box count and never interact.
+# Output per image: float32 array (K, 6) of [x1, y1, x2, y2, score, class_id], sorted by score.
+
+FUSION_MODES = ('nms', 'wbf')
+
+
+def _pad_batch(per_image_boxes, per_image_scores, per_image_classes):
+    """Stacks variable-length per-image arrays into score-sorted (B, M, ...) arrays plus a validity mask."""
+    counts = [len(scores) for scores in per_image_scores]
+    batch_size, max_count = len(counts), max(counts, default=0)
+    boxes = np.zeros((batch_size, max_count, 4), dtype=np.float32)
+    scores = np.full((batch_size, max_count), -np.inf, dtype=np.float32)
+    classes = np.zeros((batch_size, max_count), dtype=np.float32)
+    for b, count in enumerate(counts):
+        if count:
+            boxes[b, :count] = np.asarray(per_image_boxes[b], dtype=np.float32).reshape(count, 4)
+            scores[b, :count] = np.asarray(per_image_scores[b], dtype=np.float32).reshape(count)
+            classes[b, :count] = np.asarray(per_image_classes[b], dtype=np.float32).reshape(count)
+    # Stable descending sort; padding (-inf) ends up last
+    order = np.argsort(-scores, axis=1, kind='stable')
+    boxes = np.take_along_axis(boxes, order[..., None], axis=1)
+    scores = np.take_along_axis(scores, order, axis=1)
+    classes = np.take_along_axis(classes, order, axis=1)
+    valid = np.arange(max_count)[None, :] < np.asarray(counts)[:, None]
+    return boxes, scores, classes, valid
+
+
+def _box_iou(boxes_a, boxes_b):
+    """IoU between (..., N, 4) and (..., M, 4) float32 boxes -> (..., N, M), with torchvision's arithmetic."""
+    x1_a, y1_a, x2_a, y2_a = (boxes_a[..., k, None] for k in range(4))
+    x1_b, y1_b, x2_b, y2_b = (boxes_b[..., None, :, k] for k in range(4))
+    area_a = (x2_a - x1_a) * (y2_a - y1_a)
+    area_b = (x2_b - x1_b) * (y2_b - y1_b)
+    width = np.maximum(np.minimum(x2_a, x2_b) - np.maximum(x1_a, x1_b), np.float32(0))
+    height = np.maximum(np.minimum(y2_a, y2_b) - np.maximum(y1_a, y1_b), np.float32(0))
+    intersection = width * height
+    return intersection / (area_a + area_b - intersection)
+
+
+def nms_batch(per_image_boxes, per_image_scores, per_image_classes, iou_threshold):
+    """Greedy class-agnostic NMS for every image in one pass. Returns one (K, 6) array per image."""
+    boxes, scores, classes, valid = _pad_batch(per_image_boxes, per_image_scores, per_image_classes)
+    max_count = boxes.shape[1]
+    # Greedy pass: each step keeps, for every image, the next box not suppressed so far and
+    # suppresses the lower-scored boxes overlapping it, so the loop runs once per kept box
+    suppressed = ~valid
+    keep = np.zeros_like(valid)
+    positions = np.arange(max_count)
+    last_kept = np.full(len(boxes), -1)
+    while True:
+        candidates = ~suppressed & (positions[None, :] > last_kept[:, None])
+        has_candidate = candidates.any(axis=1)
+        if not has_candidate.any():
+            break
+        last_kept[~has_candidate] = max_count
+        rows = np.flatnonzero(has_candidate)
+        kept = candidates[rows].argmax(axis=1)
+        keep[rows, kept] = True
+        last_kept[rows] = kept
+        with np.errstate(invalid='ignore', divide='ignore'):
+            iou = _box_iou(boxes[rows, kept][:, None, :], boxes[rows])[:, 0, :]
+        # Float IoU vs double threshold, as in torchvision; only later (lower-scored) boxes are suppressed
+        suppressed[rows] |= (iou.astype(np.float64) > iou_threshold) & (positions[None, :] > kept[:, None])
+    return [
+        np.concatenate([boxes[b, keep[b]], scores[b, keep[b], None], classes[b, keep[b], None]], axis=1)
+        for b in range(len(boxes))
+    ]
+
+
+def wbf_batch(per_image_boxes, per_image_scores, per_image_classes, iou_threshold, num_models):
+    """
+    Weighted boxes fusion for every image in one pass. Boxes are visited in descending score order;
+    each joins the fused box it overlaps most (IoU > iou_threshold) or starts a new one.
+    Fused score = mean cluster score * min(cluster size, num_models) / num_models.
+    """
+    boxes, scores, classes, valid = _pad_batch(per_image_boxes, per_image_scores, per_image_classes)
+    batch_size, max_count = scores.shape
+    rows = np.arange(batch_size)
+    weighted_boxes = np.zeros((batch_size, max_count, 4), dtype=np.float64)
+    weights = np.zeros((batch_size, max_count), dtype=np.float64)
+    fused = np.zeros((batch_size, max_count, 4), dtype=np.float32)
+    counts = np.zeros((batch_size, max_count), dtype=np.int64)
+    cluster_classes = np.zeros((batch_size, max_count), dtype=np.float32)
+    num_clusters = np.zeros(batch_size, dtype=np.int64)
+
+    for i in range(max_count):
+        active = valid[:, i]
+        if not active.any():
+            break
+        # Only the clusters that exist so far (in the image with the most) are compared
+        width = max(int(num_clusters.max()), 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            iou = _box_iou(boxes[:, i:i + 1], fused[:, :width])[:, 0, :]
+        iou = np.where(np.arange(width)[None, :] < num_clusters[:, None], np.nan_to_num(iou, nan=-1.0), -1.0)
+        best = np.argmax(iou, axis=1)
+        matched = iou[rows, best] > iou_threshold
+        targets = rows[active]
+        target = np.where(matched, best, num_clusters)[active]
+        score = scores[targets, i].astype(np.float64)
+        weighted_boxes[targets, target] += score[:, None] * boxes[targets, i]
+        weights[targets, target] += score
+        fused[targets, target] = weighted_boxes[targets, target] / weights[targets, target, None]
+        counts[targets, target] += 1
+        new_cluster = active & ~matched
+        cluster_classes[rows[new_cluster], num_clusters[new_cluster]] = classes[new_cluster, i]
+        num_clusters += new_cluster
+
+    results = []
+    for b in range(batch_size):
+        n = num_clusters[b]
+        fused_boxes = weighted_boxes[b, :n] / weights[b, :n, None]
+        fused_scores = weights[b, :n] / counts[b, :n] * np.minimum(counts[b, :n], num_models) / num_models
+        order = np.argsort(-fused_scores, kind='stable')
+        results.append(np.concatenate([
+            fused_boxes[order], fused_scores[order, None], cluster_classes[b, :n][order, None]
+        ], axis=1).astype(np.float32))
+    return results
+
+
+def fuse_boxes_batch(per_image_boxes, per_image_scores, per_image_classes, iou_threshold,
+                     mode='nms', num_models=None):
+    """Fuses each image's ensemble boxes with `mode` ('nms' or 'wbf'; wbf needs num_models)."""
+    if mode == 'nms':
+        return nms_batch(per_image_boxes, per_image_scores, per_image_classes, iou_threshold)
+    if mode == 'wbf':
+        if not num_models:
+            raise ValueError("Weighted boxes fusion needs num_models (number of detector folds).")
+        return wbf_batch(per_image_boxes, per_image_scores, per_image_classes, iou_threshold, num_models)
+    raise ValueError(f"Unknown box fusion mode '{mode}'. Choose one of {FUSION_MODES}.")
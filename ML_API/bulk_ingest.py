@@ -0,0 +1,97 @@
+import os
+import tarfile
+import zipfile
+
+# Lazy iteration over the images of a bulk upload: several files, or one zip/tar archive.
+# Nothing is read until the caller asks for the next item, so a consumer that pulls items
+# only when it has room keeps at most that many images in memory. Uploads are file objects
+# (Starlette spools them to disk), archives are read member by member from them.
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+class MemberTooLarge(Exception):
+    pass
+
+
+def _read_limited(fileobj, max_bytes):
+    contents = fileobj.read(max_bytes + 1)
+    if len(contents) > max_bytes:
+        raise MemberTooLarge(f"larger than the {max_bytes} byte limit")
+    return contents
+
+
+def _is_image_name(name):
+    base = os.path.basename(name)
+    return name.lower().endswith(IMAGE_EXTENSIONS) and not base.startswith('.') and '__MACOSX/' not in name
+
+
+def _iter_zip(fileobj, max_bytes):
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or not _is_image_name(info.filename):
+                continue
+            try:
+                if info.file_size > max_bytes: # Declared size; _read_limited also guards the actual size
+                    raise MemberTooLarge(f"larger than the {max_bytes} byte limit")
+                with archive.open(info) as member:
+                    yield info.filename, _read_limited(member, max_bytes)
+            except Exception as e:
+                yield info.filename, e
+
+
+def _iter_tar(fileobj, max_bytes):
+    # Streaming mode: members are read in order, without seeking back
+    with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+        for member in archive:
+            if not member.isfile() or not _is_image_name(member.name):
+                continue
+            try:
+                if member.size > max_bytes:
+                    raise MemberTooLarge(f"larger than the {max_bytes} byte limit")
+                yield member.name, _read_limited(archive.extractfile(member), max_bytes)
+            except Exception as e:
+                yield member.name, e
+
+
+def archive_kind(fileobj):
+    """'zip', 'tar' or None for a seekable upload; leaves the position at the start."""
+    try:
+        fileobj.seek(0)
+        if zipfile.is_zipfile(fileobj):
+            return 'zip'
+        fileobj.seek(0)
+        try:
+            with tarfile.open(fileobj=fileobj, mode="r:*") as archive:
+                archive.next()
+            return 'tar'
+        except tarfile.TarError:
+            return None
+    finally:
+        fileobj.seek(0)
+
+
+def iter_upload_images(uploads, max_bytes):
+    """
+    Yields (name, bytes) for every image in `uploads`, a list of (filename, file object) pairs.
+    A single upload that is a zip or tar archive is expanded to its image members (other
+    members are skipped). Items that cannot be read are yielded as (name, Exception).
+    """
+    if len(uploads) == 1:
+        name, fileobj = uploads[0]
+        kind = archive_kind(fileobj)
+        if kind == 'zip':
+            yield from _iter_zip(fileobj, max_bytes)
+            return
+        if kind == 'tar':
+            try:
+                yield from _iter_tar(fileobj, max_bytes)
+            except tarfile.TarError as e: # Truncated or corrupt archive
+                yield name, e
+            return
+    for name, fileobj in uploads:
+        try:
+            fileobj.seek(0)
+            yield name, _read_limited(fileobj, max_bytes)
+        except Exception as e:
+            yield name, e
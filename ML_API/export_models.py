@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import cv2
+
+from inference_engines import (
+    classifier_model_path, detector_model_path, export_classifier_tflite, export_detector_onnx
+)
+import api_server
+
+# Exports every fold to its optimized CPU format and checks parity with the original framework:
+#   classifier_split_{i}.keras -> classifier_split_{i}.tflite
+#   yolo_fold{i}_exp/weights/best.pt -> yolo_fold{i}_exp/weights/best.onnx
+# Serve the exported artifacts with CLASSIFIER_ENGINE=tflite DETECTOR_ENGINE=onnx.
+#
+#   python export_models.py --images validation_images/
+
+
+def box_iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    intersection = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def match_boxes(reference_boxes, candidate_boxes):
+    """Greedy one-to-one matching by IoU. Returns (matched pairs [(iou, score_diff)], unmatched count)."""
+    unused = list(candidate_boxes)
+    pairs = []
+    for ref in sorted(reference_boxes, key=lambda box: box[4], reverse=True):
+        if not unused:
+            break
+        best = max(unused, key=lambda box: box_iou(ref, box))
+        iou = box_iou(ref, best)
+        if iou > 0:
+            pairs.append((iou, abs(ref[4] - best[4])))
+            unused.remove(best)
+    unmatched = len(reference_boxes) + len(candidate_boxes) - 2 * len(pairs)
+    return pairs, unmatched
+
+
+def load_parity_images(image_dir, count, seed):
+    if image_dir:
+        names = sorted(name for name in os.listdir(image_dir) if name.lower().endswith(('.png', '.jpg', '.jpeg')))
+        images = [cv2.imread(os.path.join(image_dir, name)) for name in names[:count]]
+        return [image for image in images if image is not None]
+    # Without real images only classifier parity is meaningful (detectors rarely fire on noise)
+    rng = np.random.default_rng(seed)
+    return [(rng.random((512, 512, 3)) * 255).astype(np.uint8) for _ in range(count)]
+
+
+def check_parity(classifier_dir, detector_pattern, images, det_conf, prob_tol, min_iou, score_tol):
+    reference_classifiers = api_server.load_all_classifier_models(classifier_dir, engine='keras')
+    exported_classifiers = api_server.load_all_classifier_models(classifier_dir, engine='tflite')
+    reference_detectors = api_server.load_all_detector_models(detector_pattern, engine='pytorch')
+    exported_detectors = api_server.load_all_detector_models(detector_pattern, engine='onnx')
+
+    processed = np.concatenate([api_server.preprocess_image_for_classifier(image) for image in images], axis=0)
+    fold_diffs = [
+        float(np.max(np.abs(reference.predict(processed, verbose=0) - exported.predict(processed, verbose=0))))
+        for reference, exported in zip(reference_classifiers, exported_classifiers)
+    ]
+    reference_probs = [prob for _, prob in api_server.predict_with_classifiers_batch([processed], reference_classifiers)]
+    exported_probs = [prob for _, prob in api_server.predict_with_classifiers_batch([processed], exported_classifiers)]
+    ensemble_diff = float(np.max(np.abs(np.array(reference_probs) - np.array(exported_probs))))
+
+    reference_boxes = api_server.predict_with_detectors_batch(images, reference_detectors, api_server.DEFAULT_DETECTION_IOU_THRESHOLD, det_conf)
+    exported_boxes = api_server.predict_with_detectors_batch(images, exported_detectors, api_server.DEFAULT_DETECTION_IOU_THRESHOLD, det_conf)
+    pairs, unmatched = [], 0
+    for reference, exported in zip(reference_boxes, exported_boxes):
+        image_pairs, image_unmatched = match_boxes(reference, exported)
+        pairs.extend(image_pairs)
+        unmatched += image_unmatched
+
+    report = {
+        "images": len(images),
+        "classifier_max_abs_diff_per_fold": fold_diffs,
+        "classifier_ensemble_max_abs_diff": ensemble_diff,
+        "detector_boxes_reference": sum(len(boxes) for boxes in reference_boxes),
+        "detector_boxes_exported": sum(len(boxes) for boxes in exported_boxes),
+        "detector_unmatched_boxes": unmatched,
+        "detector_min_iou": min((iou for iou, _ in pairs), default=None),
+        "detector_max_score_diff": max((diff for _, diff in pairs), default=None),
+    }
+    report["passed"] = (
+        ensemble_diff <= prob_tol
+        and max(fold_diffs) <= prob_tol
+        and unmatched == 0
+        and all(iou >= min_iou and diff <= score_tol for iou, diff in pairs)
+    )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export fold models to CPU runtime formats and check parity.")
+    parser.add_argument("--classifier_dir", type=str, default=api_server.CLASSIFIER_MODEL_DIR)
+    parser.add_argument("--detector_pattern", type=str, default=api_server.DETECTOR_MODEL_PATTERN)
+    parser.add_argument("--skip_export", action="store_true", help="Only run the parity check.")
+    parser.add_argument("--images", type=str, default=None, help="Directory of images for the parity check.")
+    parser.add_argument("--num_images", type=int, default=32)
+    parser.add_argument("--det_conf", type=float, default=api_server.DEFAULT_DETECTION_CONF_THRESHOLD)
+    parser.add_argument("--prob_tol", type=float, default=1e-4, help="Max abs probability difference.")
+    parser.add_argument("--min_iou", type=float, default=0.98, help="Min IoU between matched boxes.")
+    parser.add_argument("--score_tol", type=float, default=1e-3, help="Max abs box score difference.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if not args.skip_export:
+        for fold in range(1, api_server.NUM_FOLDS + 1):
+            keras_path = classifier_model_path(args.classifier_dir, fold, 'keras')
+            if os.path.exists(keras_path):
+                print(f"Exported {export_classifier_tflite(keras_path, classifier_model_path(args.classifier_dir, fold, 'tflite'))}")
+            else:
+                print(f"Classifier model not found: {keras_path}")
+            pt_path = detector_model_path(args.detector_pattern, fold, 'pytorch')
+            if os.path.exists(pt_path):
+                print(f"Exported {export_detector_onnx(pt_path, detector_model_path(args.detector_pattern, fold, 'onnx'))}")
+            else:
+                print(f"Detector model not found: {pt_path}")
+
+    images = load_parity_images(args.images, args.num_images, args.seed)
+    report = check_parity(args.classifier_dir, args.detector_pattern, images, args.det_conf,
+                          args.prob_tol, args.min_iou, args.score_tol)
+    print(json.dumps(report, indent=4))
+    sys.exit(0 if report["passed"] else 1)
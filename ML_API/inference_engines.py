@@ -0,0 +1,164 @@
+import os
+import tempfile
+import threading
+
+import cv2
+import numpy as np
+
+# Pluggable CPU inference engines for the fold models.
+#
+# Classifier engines:
+#   keras       - the trained classifier_split_{i}.keras models (default)
+#   tflite      - classifier_split_{i}.tflite exported by export_models.py, run with the TFLite interpreter
+#   tflite_fp16 - float16-weight variant from quantize_models.py
+#   tflite_int8 - int8 variant (float input/output) calibrated by quantize_models.py
+# Detector engines:
+#   pytorch   - the trained Ultralytics best.pt weights (default)
+#   onnx      - best.onnx exported by export_models.py, run by Ultralytics on ONNX Runtime
+#   onnx_int8 - statically quantized (QDQ int8) best.int8.onnx from quantize_models.py
+#
+# Every engine exposes the same predict() call the pipeline already uses, so
+# predict_with_classifiers / predict_with_detectors work unchanged.
+
+CLASSIFIER_ENGINES = ('keras', 'tflite', 'tflite_fp16', 'tflite_int8')
+DETECTOR_ENGINES = ('pytorch', 'onnx', 'onnx_int8')
+
+CLASSIFIER_ENGINE_EXTENSIONS = {
+    'keras': '.keras', 'tflite': '.tflite', 'tflite_fp16': '.fp16.tflite', 'tflite_int8': '.int8.tflite'
+}
+DETECTOR_ENGINE_EXTENSIONS = {'pytorch': '.pt', 'onnx': '.onnx', 'onnx_int8': '.int8.onnx'}
+
+
+def classifier_model_path(model_dir, fold, engine='keras'):
+    return os.path.join(model_dir, f'classifier_split_{fold}{CLASSIFIER_ENGINE_EXTENSIONS[engine]}')
+
+
+def detector_model_path(model_pattern, fold, engine='pytorch'):
+    base, _ = os.path.splitext(model_pattern.format(fold))
+    return base + DETECTOR_ENGINE_EXTENSIONS[engine]
+
+
+class TFLiteClassifier:
+    """
+    Runs an exported .tflite classifier behind the Keras `predict` interface.
+    The interpreter is not thread-safe, so calls are serialized per model.
+    """
+
+    def __init__(self, model_path, num_threads=None):
+        import tensorflow as tf
+        self.model_path = model_path
+        self._interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = int(self._input['shape'][0])
+        self._lock = threading.Lock()
+
+    def predict(self, batch, verbose=0):
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self._interpreter.resize_tensor_input(self._input['index'], batch.shape)
+                self._interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self._interpreter.set_tensor(self._input['index'], batch)
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output['index']).copy()
+
+
+def load_classifier(model_path, engine='keras'):
+    if engine == 'keras':
+        import tensorflow as tf
+        return tf.keras.models.load_model(model_path)
+    if engine in ('tflite', 'tflite_fp16', 'tflite_int8'):
+        return TFLiteClassifier(model_path)
+    raise ValueError(f"Unknown classifier engine '{engine}'. Choose one of {CLASSIFIER_ENGINES}.")
+
+
+def load_detector(model_path, engine='pytorch'):
+    from ultralytics import YOLO
+    if engine == 'pytorch':
+        return YOLO(model_path)
+    if engine in ('onnx', 'onnx_int8'):
+        # Ultralytics runs .onnx weights on ONNX Runtime with the same pre/postprocessing
+        return YOLO(model_path, task='detect')
+    raise ValueError(f"Unknown detector engine '{engine}'. Choose one of {DETECTOR_ENGINES}.")
+
+
+# --- Export ---
+def export_classifier_tflite(keras_path, tflite_path, precision='fp32', calibration_batches=None):
+    """
+    Converts a Keras fold classifier to a TFLite flatbuffer with a dynamic batch dimension.
+    precision: 'fp32', 'fp16' (float16 weights) or 'int8' (int8 weights and activations,
+    float input/output; needs calibration_batches, an iterable of preprocessed (1, H, W, 3) arrays).
+    """
+    import tensorflow as tf
+    model = tf.keras.models.load_model(keras_path)
+    with tempfile.TemporaryDirectory() as saved_model_dir:
+        model.export(saved_model_dir)
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+        if precision == 'fp16':
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.target_spec.supported_types = [tf.float16]
+        elif precision == 'int8':
+            if calibration_batches is None:
+                raise ValueError("int8 quantization needs calibration images.")
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.representative_dataset = lambda: ([batch.astype(np.float32)] for batch in calibration_batches)
+        elif precision != 'fp32':
+            raise ValueError(f"Unknown precision '{precision}'.")
+        tflite_model = converter.convert()
+    with open(tflite_path, 'wb') as f:
+        f.write(tflite_model)
+    return tflite_path
+
+
+def export_detector_onnx(pt_path, onnx_path):
+    """Exports an Ultralytics fold detector to ONNX with dynamic batch and image size."""
+    from ultralytics import YOLO
+    exported_path = YOLO(pt_path).export(format='onnx', dynamic=True, simplify=True)
+    if os.path.abspath(exported_path) != os.path.abspath(onnx_path):
+        os.replace(exported_path, onnx_path)
+    return onnx_path
+
+
+def letterbox_for_detector(image_bgr, imgsz=640):
+    """Ultralytics-style letterbox to a square imgsz input: (1, 3, imgsz, imgsz) float32 RGB in [0, 1]."""
+    height, width = image_bgr.shape[:2]
+    scale = min(imgsz / height, imgsz / width)
+    new_width, new_height = int(round(width * scale)), int(round(height * scale))
+    resized = cv2.resize(image_bgr, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    top = (imgsz - new_height) // 2
+    left = (imgsz - new_width) // 2
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    canvas[top:top + new_height, left:left + new_width] = resized
+    rgb = cv2.cvtColor(canvas, cv2.COLOR_BGR2RGB)
+    return np.ascontiguousarray(rgb.transpose(2, 0, 1)[None], dtype=np.float32) / 255.0
+
+
+def quantize_detector_onnx_int8(onnx_path, int8_path, calibration_images_bgr, imgsz=640):
+    """Statically quantizes an exported detector to QDQ int8, calibrated on letterboxed BGR images."""
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    input_name = onnx.load(onnx_path, load_external_data=False).graph.input[0].name
+
+    class LetterboxReader(CalibrationDataReader):
+        def __init__(self):
+            self._inputs = iter(calibration_images_bgr)
+
+        def get_next(self):
+            image = next(self._inputs, None)
+            return None if image is None else {input_name: letterbox_for_detector(image, imgsz)}
+
+    quantize_static(
+        onnx_path, int8_path, LetterboxReader(),
+        quant_format=QuantFormat.QDQ, per_channel=True,
+        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+    )
+    # Keep the Ultralytics metadata (class names, stride, imgsz) that AutoBackend reads
+    source, quantized = onnx.load(onnx_path), onnx.load(int8_path)
+    if not quantized.metadata_props:
+        quantized.metadata_props.extend(source.metadata_props)
+        onnx.save(quantized, int8_path)
+    return int8_path
@@ -0,0 +1,149 @@
+import asyncio
+import itertools
+from collections import Counter
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent requests into batches for a blocking batch function.
+
+    Callers `await submit(item)`; a single background task collects queued items
+    until either `max_batch_size` items are waiting or `max_wait_ms` has passed
+    since the first one arrived, then runs `batch_fn(items)` off the event loop.
+    `batch_fn` must return one result per item, in order. A result that is an
+    Exception instance is raised to that caller only.
+
+    Up to `max_concurrent_batches` batches run at once on `executor`; while all
+    slots are busy, new requests keep queueing and form the next batch.
+
+    `submit(item, priority)`: lower priorities are batched first (FIFO within a priority),
+    so interactive requests overtake queued bulk ones.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=10.0, executor=None, max_concurrent_batches=1):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        if max_concurrent_batches < 1:
+            raise ValueError("max_concurrent_batches must be >= 1")
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.executor = executor
+        self.max_concurrent_batches = max_concurrent_batches
+        self.batch_size_counts = Counter()
+        self._queue = None
+        self._task = None
+        self._slots = None
+        self._running = set()
+        self._sequence = itertools.count()
+        self._queued = Counter() # Queued requests per priority
+
+    async def start(self):
+        self._queue = asyncio.PriorityQueue()
+        self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+        # Fail anything still waiting so callers are not left hanging
+        while self._queue is not None and not self._queue.empty():
+            _, _, _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Batcher stopped."))
+
+    async def submit(self, item, priority=0):
+        if self._task is None:
+            raise RuntimeError("Batcher is not running.")
+        future = asyncio.get_running_loop().create_future()
+        self._queued[priority] += 1
+        await self._queue.put((priority, next(self._sequence), item, future))
+        return await future
+
+    def _take(self, entry):
+        priority, _, item, future = entry
+        self._queued[priority] -= 1
+        return item, future
+
+    async def _collect_batch(self, loop):
+        batch = [self._take(await self._queue.get())]
+        deadline = loop.time() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._take(self._queue.get_nowait()))
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._take(await asyncio.wait_for(self._queue.get(), timeout)))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Wait for a free inference slot before collecting, so requests that
+            # arrive while all slots are busy accumulate into the next batch.
+            await self._slots.acquire()
+            try:
+                batch = await self._collect_batch(loop)
+            except BaseException:
+                self._slots.release()
+                raise
+            # Drop requests whose callers went away while queued
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                self._slots.release()
+                continue
+            self.batch_size_counts[len(batch)] += 1
+            task = asyncio.create_task(self._run_batch(loop, batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, loop, batch):
+        try:
+            items = [item for item, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.batch_fn, items)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def queued_requests(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self):
+        batches = sum(self.batch_size_counts.values())
+        requests = sum(size * count for size, count in self.batch_size_counts.items())
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "max_concurrent_batches": self.max_concurrent_batches,
+            "batches_in_flight": len(self._running),
+            "queued_requests": self.queued_requests(),
+            "queued_by_priority": {str(priority): count for priority, count in sorted(self._queued.items()) if count},
+            "batches": batches,
+            "requests": requests,
+            "mean_batch_size": (requests / batches) if batches else 0.0,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self.batch_size_counts.items())},
+        }
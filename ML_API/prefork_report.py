@@ -0,0 +1,105 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import psutil
+import requests
+
+# Measures per-worker memory and aggregate throughput of prefork_server.py as the worker
+# count grows. USS is memory private to a worker; PSS splits shared pages evenly, so a low
+# USS relative to RSS shows the model weights are being shared copy-on-write.
+#
+#   python prefork_report.py --image sample.png --workers 1 2 4 8
+
+
+def wait_until_healthy(url, timeout_s):
+    deadline = time.time() + timeout_s
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{url}/health", timeout=2).json().get("status") == "healthy":
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(1.0)
+    return False
+
+
+def measure_throughput(url, image_bytes, clients, duration_s):
+    completed = []
+    deadline = time.time() + duration_s
+
+    def client():
+        while time.time() < deadline:
+            response = requests.post(f"{url}/predict/image/", files={"file": ("image.png", image_bytes)}, timeout=300)
+            if response.ok:
+                completed.append(1)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(completed) / (time.perf_counter() - start)
+
+
+def worker_memory(parent_pid):
+    workers = []
+    for child in psutil.Process(parent_pid).children():
+        info = child.memory_full_info()
+        workers.append({
+            "pid": child.pid,
+            "rss_mb": info.rss / 2**20,
+            "pss_mb": info.pss / 2**20,
+            "uss_mb": info.uss / 2**20,
+        })
+    return workers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-worker RSS and aggregate throughput vs worker count.")
+    parser.add_argument("--image", type=str, required=True, help="Image used for the load test.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load per worker count.")
+    parser.add_argument("--clients_per_worker", type=int, default=2)
+    parser.add_argument("--startup_timeout", type=float, default=600.0)
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        image_bytes = f.read()
+    url = f"http://127.0.0.1:{args.port}"
+
+    report = []
+    for num_workers in args.workers:
+        start = time.perf_counter()
+        # The load test re-sends one image, so the result cache is disabled to measure inference
+        server = subprocess.Popen([
+            sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "prefork_server.py"),
+            "--host", "127.0.0.1", "--port", str(args.port), "--workers", str(num_workers), "--log_level", "warning",
+        ], env={**os.environ, "RESULT_CACHE_MAX_ENTRIES": "0", "RESULT_CACHE_DIR": ""})
+        try:
+            if not wait_until_healthy(url, args.startup_timeout):
+                print(f"Server with {num_workers} worker(s) did not become healthy; skipping.")
+                continue
+            startup_s = time.perf_counter() - start
+            throughput = measure_throughput(url, image_bytes, num_workers * args.clients_per_worker, args.duration)
+            workers = worker_memory(server.pid)
+            parent = psutil.Process(server.pid).memory_full_info()
+            report.append({
+                "workers": num_workers,
+                "startup_s": startup_s,
+                "throughput_rps": throughput,
+                "parent_rss_mb": parent.rss / 2**20,
+                "per_worker": workers,
+                "total_pss_mb": parent.pss / 2**20 + sum(worker["pss_mb"] for worker in workers),
+            })
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(json.dumps(report, indent=4))
@@ -0,0 +1,130 @@
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+# Pre-forked CPU serving: the parent loads all fold models once, then forks worker
+# processes that inherit the weights copy-on-write instead of loading their own copies.
+#
+#   python prefork_server.py --workers 4 --port 8000
+#
+# TensorFlow's thread pools do not survive fork(): a child whose parent initialised the
+# runtime with more than one intra-op thread deadlocks on its first multi-threaded op, and
+# graph functions (model.predict, tf.function) deadlock on the inter-op executor. The
+# TensorFlow runtime is therefore pinned to one thread of each kind before any model is
+# loaded, and workers execute functions eagerly; parallelism comes from the worker count.
+# torch's pool is only created on first use, so each worker sets its own torch thread
+# budget after the fork. The worker count and torch threads default to the prefork profile of the
+# config written by autotune_threads.py (THREADING_CONFIG), which is measured in this mode.
+
+
+def configure_parent_runtime():
+    # Pre-forked mode is CPU-only: a CUDA context cannot be shared across fork()
+    os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def run_worker(sock, torch_threads, log_level):
+    import tensorflow as tf
+    import torch
+    import uvicorn
+    import api_server
+
+    tf.config.run_functions_eagerly(True)
+    torch.set_num_threads(torch_threads)
+    print(f"Worker {os.getpid()} started ({torch_threads} torch thread(s)).")
+    config = uvicorn.Config(api_server.app, log_level=log_level)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def spawn_worker(sock, torch_threads, log_level):
+    pid = os.fork()
+    if pid == 0:
+        # Restore default signal handling so uvicorn can install its own
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        exit_code = 0
+        try:
+            run_worker(sock, torch_threads, log_level)
+        except Exception as e:
+            print(f"Worker {os.getpid()} crashed: {e}")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+    return pid
+
+
+if __name__ == "__main__":
+    from thread_config import load_thread_config
+    # Only the prefork profile: the main profiles' worker counts were measured with multi-threaded graph-mode TensorFlow
+    thread_config = load_thread_config(os.environ.get("THREADING_CONFIG", "threading_config.json"), prefork=True) or {}
+
+    parser = argparse.ArgumentParser(description="Pre-forked ML API server with shared model weights.")
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=thread_config.get("workers", os.cpu_count() or 1),
+                        help="Number of worker processes (default: threading config prefork profile, else one per core).")
+    parser.add_argument("--torch_threads", type=int, default=thread_config.get("torch_threads"),
+                        help="torch intra-op threads per worker (default: threading config prefork profile, else cores / workers).")
+    parser.add_argument("--log_level", type=str, default="info")
+    args = parser.parse_args()
+
+    torch_threads = args.torch_threads or max(1, (os.cpu_count() or 1) // args.workers)
+
+    configure_parent_runtime()
+    import api_server
+
+    start = time.perf_counter()
+    api_server.load_models(tensorflow_threads=False)
+    if not api_server.models_store.get("classifiers") or not api_server.models_store.get("detectors"):
+        print("CRITICAL: models failed to load in the parent; not starting workers.")
+        sys.exit(1)
+    print(f"Models loaded once in parent {os.getpid()} in {time.perf_counter() - start:.1f}s.")
+
+    # Move everything allocated so far into the permanent GC generation, so collections in
+    # the workers do not touch (and thereby copy) the pages holding the shared model objects.
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    workers = {spawn_worker(sock, torch_threads, args.log_level) for _ in range(args.workers)}
+    print(f"Serving on {args.host}:{args.port} with {args.workers} worker(s): {sorted(workers)}")
+
+    shutting_down = False
+
+    def handle_shutdown(signum, frame):
+        global shutting_down
+        shutting_down = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, handle_shutdown)
+    signal.signal(signal.SIGINT, handle_shutdown)
+
+    # Supervise: respawn workers that die unexpectedly (the parent still holds the models)
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not shutting_down:
+            print(f"Worker {pid} exited with status {status}; respawning.")
+            workers.add(spawn_worker(sock, torch_threads, args.log_level))
+    print("All workers stopped.")
@@ -0,0 +1,172 @@
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import cv2
+import psutil
+
+from inference_engines import (
+    classifier_model_path, detector_model_path, export_classifier_tflite,
+    export_detector_onnx, quantize_detector_onnx_int8
+)
+from export_models import box_iou
+import api_server
+
+# Builds reduced-precision fold models and reports speed, memory and accuracy drift against
+# the full-precision ensemble:
+#   classifier_split_{i}.fp16.tflite / classifier_split_{i}.int8.tflite  (CLASSIFIER_ENGINE=tflite_fp16 / tflite_int8)
+#   yolo_fold{i}_exp/weights/best.int8.onnx                              (DETECTOR_ENGINE=onnx_int8)
+#
+#   python quantize_models.py --calibration_dir calibration_images/ --holdout_dir holdout_images/
+
+
+def read_images(image_dir, limit):
+    names = sorted(name for name in os.listdir(image_dir) if name.lower().endswith(('.png', '.jpg', '.jpeg')))
+    images = (cv2.imread(os.path.join(image_dir, name)) for name in names)
+    return [image for image in images if image is not None][:limit]
+
+
+def total_file_size_mb(paths):
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path)) / 2**20
+
+
+def _loaded_rss_mb(loader, source, engine):
+    process = psutil.Process()
+    gc.collect()
+    before = process.memory_info().rss
+    # Keep the folds referenced until RSS is read, or they could be freed before it is measured
+    models = getattr(api_server, loader)(source, engine=engine)
+    resident = process.memory_info().rss - before
+    del models
+    return resident / 2**20
+
+
+def resident_mb(loader, source, engine):
+    """
+    Resident memory (MB) a fresh process gains loading all folds of one variant with api_server.`loader`.
+    Each variant is measured in its own process, so memory freed by an earlier variant but kept by the
+    allocator does not hide the cost of a later one. The figure includes the runtime's own start-up
+    allocations, which are about the same for every variant of a stage, so compare the differences.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(_loaded_rss_mb, loader, source, engine).result()
+
+
+def time_per_image(fn, images):
+    fn(images[:1]) # Warm up
+    start = time.perf_counter()
+    results = [fn([image]) for image in images]
+    return results, (time.perf_counter() - start) * 1000.0 / len(images)
+
+
+def classify(images, models):
+    processed = [api_server.preprocess_image_for_classifier(image) for image in images]
+    return api_server.predict_with_classifiers_batch(processed, models)[0][1]
+
+
+def detect_top_box(images, models):
+    boxes = api_server.predict_with_detectors_batch(images, models, api_server.DEFAULT_DETECTION_IOU_THRESHOLD,
+                                                    api_server.DEFAULT_DETECTION_CONF_THRESHOLD)[0]
+    # The API reports the highest-scoring ensemble box, so that is the box compared for drift
+    return max(boxes, key=lambda box: box[4]) if boxes else None
+
+
+def classifier_drift(reference_probs, variant_probs):
+    diffs = np.abs(np.array(reference_probs) - np.array(variant_probs))
+    threshold = api_server.DEFAULT_CLASSIFICATION_THRESHOLD
+    flips = sum((ref >= threshold) != (var >= threshold) for ref, var in zip(reference_probs, variant_probs))
+    return {"mean_abs_prob_diff": float(diffs.mean()), "max_abs_prob_diff": float(diffs.max()), "label_flips": int(flips)}
+
+
+def detector_drift(reference_boxes, variant_boxes):
+    ious = [box_iou(ref, var) for ref, var in zip(reference_boxes, variant_boxes) if ref is not None and var is not None]
+    presence_mismatches = sum((ref is None) != (var is None) for ref, var in zip(reference_boxes, variant_boxes))
+    return {
+        "images_with_box_in_both": len(ious),
+        "box_presence_mismatches": int(presence_mismatches),
+        "mean_top_box_iou": float(np.mean(ious)) if ious else None,
+        "min_top_box_iou": float(np.min(ious)) if ious else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantize fold models and report speedup, memory and drift.")
+    parser.add_argument("--calibration_dir", type=str, required=True, help="Images used to calibrate int8 ranges.")
+    parser.add_argument("--holdout_dir", type=str, required=True, help="Held-out images for the drift report.")
+    parser.add_argument("--num_calibration", type=int, default=100)
+    parser.add_argument("--num_holdout", type=int, default=200)
+    parser.add_argument("--classifier_dir", type=str, default=api_server.CLASSIFIER_MODEL_DIR)
+    parser.add_argument("--detector_pattern", type=str, default=api_server.DETECTOR_MODEL_PATTERN)
+    parser.add_argument("--classifier_precisions", type=str, nargs="*", default=["fp16", "int8"],
+                        choices=["fp16", "int8"])
+    parser.add_argument("--skip_detectors", action="store_true", help="Do not quantize the YOLO folds.")
+    parser.add_argument("--report", type=str, default="quantization_report.json")
+    args = parser.parse_args()
+
+    calibration_images = read_images(args.calibration_dir, args.num_calibration)
+    holdout_images = read_images(args.holdout_dir, args.num_holdout)
+    calibration_batches = [api_server.preprocess_image_for_classifier(image) for image in calibration_images]
+    folds = range(1, api_server.NUM_FOLDS + 1)
+
+    # --- Build the reduced-precision variants ---
+    for fold in folds:
+        keras_path = classifier_model_path(args.classifier_dir, fold, 'keras')
+        for precision in args.classifier_precisions:
+            engine = f'tflite_{precision}'
+            print(f"Exported {export_classifier_tflite(keras_path, classifier_model_path(args.classifier_dir, fold, engine), precision, calibration_batches)}")
+        if not args.skip_detectors:
+            onnx_path = detector_model_path(args.detector_pattern, fold, 'onnx')
+            if not os.path.exists(onnx_path):
+                export_detector_onnx(detector_model_path(args.detector_pattern, fold, 'pytorch'), onnx_path)
+            int8_path = detector_model_path(args.detector_pattern, fold, 'onnx_int8')
+            print(f"Quantized {quantize_detector_onnx_int8(onnx_path, int8_path, calibration_images)}")
+
+    # --- Report against the full-precision ensembles ---
+    report = {"holdout_images": len(holdout_images), "calibration_images": len(calibration_images),
+              "classifiers": {}, "detectors": {}}
+
+    reference_classifiers = api_server.load_all_classifier_models(args.classifier_dir, engine='keras')
+    reference_probs, reference_ms = time_per_image(lambda batch: classify(batch, reference_classifiers), holdout_images)
+    reference_size = total_file_size_mb(classifier_model_path(args.classifier_dir, fold, 'keras') for fold in folds)
+    reference_rss = resident_mb("load_all_classifier_models", args.classifier_dir, 'keras')
+    report["classifiers"]["keras"] = {"ms_per_image": reference_ms, "file_size_mb": reference_size,
+                                      "resident_mb": reference_rss}
+    for precision in args.classifier_precisions:
+        engine = f'tflite_{precision}'
+        models = api_server.load_all_classifier_models(args.classifier_dir, engine=engine)
+        probs, ms = time_per_image(lambda batch: classify(batch, models), holdout_images)
+        size = total_file_size_mb(classifier_model_path(args.classifier_dir, fold, engine) for fold in folds)
+        rss = resident_mb("load_all_classifier_models", args.classifier_dir, engine)
+        report["classifiers"][engine] = {
+            "ms_per_image": ms, "speedup": reference_ms / ms,
+            "file_size_mb": size, "file_size_saved_mb": reference_size - size,
+            "resident_mb": rss, "resident_saved_mb": reference_rss - rss,
+            **classifier_drift(reference_probs, probs),
+        }
+
+    if not args.skip_detectors:
+        reference_detectors = api_server.load_all_detector_models(args.detector_pattern, engine='pytorch')
+        reference_boxes, reference_ms = time_per_image(lambda batch: detect_top_box(batch, reference_detectors), holdout_images)
+        reference_size = total_file_size_mb(detector_model_path(args.detector_pattern, fold, 'pytorch') for fold in folds)
+        reference_rss = resident_mb("load_all_detector_models", args.detector_pattern, 'pytorch')
+        report["detectors"]["pytorch"] = {"ms_per_image": reference_ms, "file_size_mb": reference_size,
+                                          "resident_mb": reference_rss}
+        int8_detectors = api_server.load_all_detector_models(args.detector_pattern, engine='onnx_int8')
+        boxes, ms = time_per_image(lambda batch: detect_top_box(batch, int8_detectors), holdout_images)
+        size = total_file_size_mb(detector_model_path(args.detector_pattern, fold, 'onnx_int8') for fold in folds)
+        rss = resident_mb("load_all_detector_models", args.detector_pattern, 'onnx_int8')
+        report["detectors"]["onnx_int8"] = {
+            "ms_per_image": ms, "speedup": reference_ms / ms,
+            "file_size_mb": size, "file_size_saved_mb": reference_size - size,
+            "resident_mb": rss, "resident_saved_mb": reference_rss - rss,
+            **detector_drift(reference_boxes, boxes),
+        }
+
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=4)
+    print(json.dumps(report, indent=4))
@@ -0,0 +1,119 @@
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import shutil
+import threading
+import time
+import uuid
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+class RequestProfiler:
+    """
+    Captures a profile of one request on demand.
+
+    `profile(fn, *args)` runs `fn` under cProfile, the TensorFlow profiler and the torch profiler
+    and writes one trace directory under `output_dir`:
+
+        python.pstats      cProfile stats (snakeviz, `python -m pstats`)
+        python.txt         the top functions by cumulative time
+        tensorflow/        TensorBoard profile of the classifier ops (Profile tab)
+        torch_trace.json   Chrome trace of the detector ops (chrome://tracing, Perfetto)
+
+    The framework profilers are process-wide, so one request is profiled at a time (`ProfilerBusy`
+    otherwise) and work other threads run meanwhile also shows up in their traces. After each capture
+    the oldest traces are deleted until at most `max_traces` remain and they take at most `max_bytes`.
+    """
+
+    def __init__(self, token, output_dir, max_traces=20, max_bytes=512 * 2**20, tensorflow=True, torch=True):
+        if not token:
+            raise ValueError("A profiling token is required.")
+        self.token = token
+        self.output_dir = output_dir
+        self.max_traces = max_traces
+        self.max_bytes = max_bytes
+        self.tensorflow = tensorflow
+        self.torch = torch
+        self._lock = threading.Lock()
+
+    def authorized(self, supplied):
+        return bool(supplied) and hmac.compare_digest(supplied.encode(), self.token.encode())
+
+    def profile(self, fn, *args):
+        """
+        Returns (fn's result, trace directory name, or None if the trace alone is over the size cap).
+        Raises ProfilerBusy while another capture is running.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("Another request is being profiled.")
+        try:
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+            directory = os.path.join(self.output_dir, name)
+            os.makedirs(directory)
+            result = self._capture(directory, fn, args)
+            self._prune()
+            if not os.path.isdir(directory):
+                print(f"Trace {name} alone exceeds the {self.max_bytes}-byte profile cap and was deleted.")
+                name = None
+            return result, name
+        finally:
+            self._lock.release()
+
+    def _capture(self, directory, fn, args):
+        tf_started = torch_profile = None
+        if self.tensorflow:
+            try:
+                import tensorflow as tf
+                tf.profiler.experimental.start(os.path.join(directory, "tensorflow"))
+                tf_started = tf
+            except Exception as e: # e.g. a profiler session left running by someone else
+                print(f"TensorFlow profiler unavailable for this trace: {e}")
+        if self.torch:
+            from torch.profiler import profile, ProfilerActivity
+            torch_profile = profile(activities=[ProfilerActivity.CPU], record_shapes=True)
+            torch_profile.__enter__()
+        python_profile = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            result = python_profile.runcall(fn, *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            if torch_profile is not None:
+                torch_profile.__exit__(None, None, None)
+                torch_profile.export_chrome_trace(os.path.join(directory, "torch_trace.json"))
+            if tf_started is not None:
+                tf_started.profiler.experimental.stop()
+            python_profile.dump_stats(os.path.join(directory, "python.pstats"))
+            summary = io.StringIO()
+            summary.write(f"Wall time {elapsed * 1000.0:.1f} ms\n")
+            pstats.Stats(python_profile, stream=summary).sort_stats("cumulative").print_stats(60)
+            with open(os.path.join(directory, "python.txt"), "w") as f:
+                f.write(summary.getvalue())
+        return result
+
+    def traces(self):
+        """(name, bytes) of every stored trace, oldest first."""
+        if not os.path.isdir(self.output_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.output_dir):
+            path = os.path.join(self.output_dir, name)
+            if os.path.isdir(path):
+                size = sum(os.path.getsize(os.path.join(root, file))
+                           for root, _, files in os.walk(path) for file in files)
+                entries.append((os.path.getmtime(path), name, size))
+        return [(name, size) for _, name, size in sorted(entries)]
+
+    def _prune(self):
+        """Deletes the oldest traces (the new one last) until both caps hold."""
+        entries = self.traces()
+        total = sum(size for _, size in entries)
+        while entries and (len(entries) > self.max_traces or total > self.max_bytes):
+            name, size = entries.pop(0)
+            shutil.rmtree(os.path.join(self.output_dir, name), ignore_errors=True)
+            total -= size
@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class SloController:
+    """
+    Trades ensemble size for latency under load.
+
+    The pipeline calls `plan(queue_depth)` before each batch and `observe(latency_s)` after each
+    request. When the queue is deeper than `queue_limit`, or the p95 of the last `window` request
+    latencies is above `latency_target_s`, the controller drops one more fold; once the queue is at
+    most half the limit and p95 is below `restore_ratio` * target, it adds one back. Changes are at
+    least `cooldown_s` apart, and the latency window restarts after each change. Latencies older
+    than `window_s` are dropped, so an idle period does not keep the ensemble reduced.
+
+    Folds are dropped one at a time from the first stage in `degrade_order` that still has more
+    than `min_folds`; each stage keeps the first folds of its priority list (0-based indices).
+    """
+
+    def __init__(self, fold_priority, degrade_order, latency_target_s, queue_limit,
+                 min_folds=1, window=50, window_s=10.0, cooldown_s=2.0, restore_ratio=0.7, min_samples=5):
+        unknown = [stage for stage in degrade_order if stage not in fold_priority]
+        if unknown:
+            raise ValueError(f"Unknown stage(s) {unknown} in degrade order; expected {sorted(fold_priority)}.")
+        self.fold_priority = {stage: list(folds) for stage, folds in fold_priority.items()}
+        self.latency_target_s = latency_target_s
+        self.queue_limit = queue_limit
+        self.window_s = window_s
+        self.cooldown_s = cooldown_s
+        self.restore_ratio = restore_ratio
+        self.min_samples = min_samples
+        # Level 0 is the full ensemble; each level drops one more fold
+        counts = {stage: len(folds) for stage, folds in self.fold_priority.items()}
+        self.levels = [dict(counts)]
+        for stage in degrade_order:
+            while counts[stage] > max(min_folds, 1):
+                counts[stage] -= 1
+                self.levels.append(dict(counts))
+        self.level = 0
+        self.degrades = 0
+        self.restores = 0
+        self._latencies = deque(maxlen=window)
+        self._last_change = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, latency_s):
+        with self._lock:
+            self._latencies.append((time.monotonic(), latency_s))
+
+    def _p95(self):
+        horizon = time.monotonic() - self.window_s
+        while self._latencies and self._latencies[0][0] < horizon:
+            self._latencies.popleft()
+        if len(self._latencies) < self.min_samples:
+            return None
+        return float(np.percentile([latency for _, latency in self._latencies], 95))
+
+    def plan(self, queue_depth):
+        """Updates the level from the current load; returns {stage: fold indices to run}."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_change >= self.cooldown_s:
+                p95 = self._p95()
+                overloaded = queue_depth > self.queue_limit or (p95 is not None and p95 > self.latency_target_s)
+                recovered = (queue_depth <= self.queue_limit // 2
+                             and (p95 is None or p95 < self.restore_ratio * self.latency_target_s))
+                if overloaded and self.level < len(self.levels) - 1:
+                    self._change(+1, now)
+                    self.degrades += 1
+                elif recovered and self.level > 0:
+                    self._change(-1, now)
+                    self.restores += 1
+            counts = self.levels[self.level]
+        return {stage: self.fold_priority[stage][:count] for stage, count in counts.items()}
+
+    def _change(self, step, now):
+        self.level += step
+        self._last_change = now
+        self._latencies.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "level": self.level,
+                "max_level": len(self.levels) - 1,
+                "folds": dict(self.levels[self.level]),
+                "full_folds": dict(self.levels[0]),
+                "recent_p95_ms": (self._p95() or 0.0) * 1000.0,
+                "latency_target_ms": self.latency_target_s * 1000.0,
+                "queue_limit": self.queue_limit,
+                "degrades": self.degrades,
+                "restores": self.restores,
+            }
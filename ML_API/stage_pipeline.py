@@ -0,0 +1,189 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Stage-pipelined processing: decode + preprocess, classifier inference and detector inference each
+# get their own worker pool, connected by bounded queues, so different images (or batches) are in
+# different stages at once. Every stage records how long its workers were busy, which gives the
+# stage's steady-state capacity: the throughput it would sustain if it were never starved or blocked.
+# The stage with the lowest capacity limits the pipeline and is the one worth more workers.
+
+
+class StageStats:
+    """Busy time and item counts of one stage's workers (thread-safe)."""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.jobs = 0
+        self.items = 0
+        self.busy_s = 0.0
+        self.blocked_s = 0.0 # Time producers waited for room in the stage's queue
+        self.first_start = None
+        self.last_end = None
+        self._lock = threading.Lock()
+
+    def record(self, start, end, items=1):
+        with self._lock:
+            self.jobs += 1
+            self.items += items
+            self.busy_s += end - start
+            self.first_start = start if self.first_start is None else min(self.first_start, start)
+            self.last_end = end if self.last_end is None else max(self.last_end, end)
+
+    def add_blocked(self, seconds):
+        with self._lock:
+            self.blocked_s += seconds
+
+    def measure(self, items=1):
+        """Context manager recording the time spent inside as one job of `items` items."""
+        return _Measure(self, items)
+
+    def snapshot(self):
+        with self._lock:
+            wall_s = (self.last_end - self.first_start) if self.jobs else 0.0
+            return {
+                "workers": self.workers,
+                "jobs": self.jobs,
+                "items": self.items,
+                "busy_s": self.busy_s,
+                "blocked_s": self.blocked_s,
+                # Items per second with every worker always busy
+                "capacity_items_per_s": self.items / self.busy_s * self.workers if self.busy_s else None,
+                # Items per second actually passed between the stage's first and last job
+                "throughput_items_per_s": self.items / wall_s if wall_s else None,
+                "utilization": self.busy_s / (wall_s * self.workers) if wall_s else None,
+            }
+
+
+class _Measure:
+    def __init__(self, stats, items):
+        self.stats = stats
+        self.items = items
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.stats.record(self.start, time.perf_counter(), self.items)
+
+
+class Stage:
+    """
+    A worker pool fed through a bounded queue. `submit(*args)` runs fn(*args) on one of `workers`
+    threads and returns a concurrent.futures.Future; it blocks while `queue_size` jobs are already
+    waiting, which is what pushes back on the stage before it.
+    """
+
+    def __init__(self, name, fn, workers=1, queue_size=None):
+        if workers < 1:
+            raise ValueError(f"Stage '{name}' needs at least one worker.")
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.queue_size = workers if queue_size is None else queue_size
+        self.stats = StageStats(name, workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"stage-{name}")
+        self._slots = threading.BoundedSemaphore(workers + self.queue_size)
+
+    def submit(self, *args, items=1):
+        """`items` is how many items the job covers (e.g. images in a batch), for the throughput figures."""
+        start = time.perf_counter()
+        self._slots.acquire()
+        self.stats.add_blocked(time.perf_counter() - start)
+        try:
+            future = self._executor.submit(self._run, args, items)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _run(self, args, items):
+        start = time.perf_counter()
+        try:
+            return self.fn(*args)
+        finally:
+            self.stats.record(start, time.perf_counter(), items)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def _advance(stages, index, value, items, result):
+    """Submits value to stages[index]; its output goes on to the next stage, the last one's into result."""
+    try:
+        future = stages[index].submit(value, items=items)
+    except BaseException as e:
+        result.set_exception(e)
+        return
+
+    def done(future):
+        try:
+            output = future.result()
+        except BaseException as e:
+            result.set_exception(e)
+            return
+        if index + 1 == len(stages):
+            result.set_result(output)
+        else:
+            # Runs on the finishing worker, which waits here while the next stage's queue is full
+            _advance(stages, index + 1, output, items, result)
+
+    future.add_done_callback(done)
+
+
+def run_stages(items, stages):
+    """
+    Generator: passes each value of `items` ((value, item count) pairs) through `stages` in order,
+    each stage's output being the next stage's input, and yields the last stage's outputs in input
+    order. Values in flight are bounded by the stages' workers and queues. A stage's exception is
+    raised when its value's turn to be yielded comes.
+    """
+    capacity = sum(stage.workers + stage.queue_size for stage in stages)
+    pending = deque()
+    for value, count in items:
+        result = Future()
+        pending.append(result)
+        _advance(stages, 0, value, count, result)
+        while len(pending) > capacity or (pending and pending[0].done()):
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def split_batch_future(batch_future, size):
+    """One Future per item of a batch job whose result is a list of `size` per-item results."""
+    item_futures = [Future() for _ in range(size)]
+
+    def done(batch_future):
+        try:
+            results = batch_future.result()
+        except BaseException as e:
+            for item_future in item_futures:
+                item_future.set_exception(e)
+            return
+        for item_future, item_result in zip(item_futures, results):
+            item_future.set_result(item_result)
+
+    batch_future.add_done_callback(done)
+    return item_futures
+
+
+def format_stage_report(snapshots):
+    """Human-readable lines for {stage name: StageStats.snapshot()}, naming the limiting stage."""
+    def rate(value):
+        return "-" if value is None else f"{value:8.2f}/s"
+
+    lines = [f"{'stage':<10} {'workers':>7} {'items':>7} {'capacity':>11} {'throughput':>11} {'utilization':>11} {'blocked':>8}"]
+    for name, stats in snapshots.items():
+        utilization = "-" if stats["utilization"] is None else f"{stats['utilization'] * 100:10.0f}%"
+        lines.append(f"{name:<10} {stats['workers']:>7} {stats['items']:>7} {rate(stats['capacity_items_per_s']):>11} "
+                     f"{rate(stats['throughput_items_per_s']):>11} {utilization:>11} {stats['blocked_s']:7.1f}s")
+    measured = {name: stats["capacity_items_per_s"] for name, stats in snapshots.items()
+                if stats["capacity_items_per_s"] is not None}
+    if measured:
+        bottleneck = min(measured, key=measured.get)
+        lines.append(f"Limiting stage: {bottleneck} ({measured[bottleneck]:.2f} items/s at {snapshots[bottleneck]['workers']} worker(s))")
+    return "\n".join(lines)
@@ -0,0 +1,80 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from classify import (
+    load_all_classifier_models,
+    build_fused_classifier_ensemble,
+    predict_with_classifiers,
+    predict_with_fused_ensemble,
+    set_gpu_memory_growth,
+    CLASSIFIER_MODEL_DIR,
+    CLASSIFIER_IMG_HEIGHT,
+    CLASSIFIER_IMG_WIDTH,
+    CLASSIFIER_IMG_CHANNELS,
+)
+
+
+def time_calls(fn, inputs, warmup):
+    """Returns per-call latencies in milliseconds (after `warmup` untimed calls)."""
+    for image in inputs[:warmup]:
+        fn(image)
+    latencies = []
+    for image in inputs:
+        start = time.perf_counter()
+        fn(image)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    return latencies
+
+
+def summarize(latencies):
+    return {
+        "mean_ms": float(np.mean(latencies)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-fold vs fused classifier ensemble latency.")
+    parser.add_argument("--classifier_dir", type=str, default=CLASSIFIER_MODEL_DIR,
+                        help="Directory containing Keras classifier models.")
+    parser.add_argument("--iterations", type=int, default=50, help="Number of timed images.")
+    parser.add_argument("--warmup", type=int, default=5, help="Untimed warmup calls per path.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    set_gpu_memory_growth()
+    models = load_all_classifier_models(args.classifier_dir)
+    fused_ensemble = build_fused_classifier_ensemble(models)
+
+    rng = np.random.default_rng(args.seed)
+    inputs = [
+        rng.random((1, CLASSIFIER_IMG_HEIGHT, CLASSIFIER_IMG_WIDTH, CLASSIFIER_IMG_CHANNELS), dtype=np.float32)
+        for _ in range(args.iterations)
+    ]
+
+    # Parity: the fused path must reproduce the per-fold ensemble mean exactly
+    mismatches = 0
+    max_graph_mean_diff = 0.0
+    for image in inputs:
+        _, per_fold_prob = predict_with_classifiers(image, models)
+        _, fused_prob = predict_with_fused_ensemble(image, fused_ensemble)
+        graph_mean, _ = fused_ensemble(image)
+        mismatches += int(per_fold_prob != fused_prob)
+        max_graph_mean_diff = max(max_graph_mean_diff, abs(float(graph_mean.numpy()[0]) - per_fold_prob))
+
+    per_fold = summarize(time_calls(lambda image: predict_with_classifiers(image, models), inputs, args.warmup))
+    fused = summarize(time_calls(lambda image: predict_with_fused_ensemble(image, fused_ensemble), inputs, args.warmup))
+
+    print(json.dumps({
+        "folds": len(models),
+        "iterations": args.iterations,
+        "per_fold_predict": per_fold,
+        "fused_graph": fused,
+        "speedup_p50": per_fold["p50_ms"] / fused["p50_ms"],
+        "parity_mismatches": mismatches,
+        "max_abs_diff_graph_mean": max_graph_mean_diff,
+    }, indent=4))
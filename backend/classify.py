@@ -1,12 +1,23 @@
 import os
+import sys
+import glob
 import json
 import argparse
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import cv2
 import tensorflow as tf
 from tensorflow.keras.models import load_model
 from ultralytics import YOLO
-import torch # For NMS and checking CUDA
+
+from box_fusion import FUSION_MODES, fuse_boxes_batch
+from thread_config import load_thread_config, apply_thread_config
+from fold_store import FoldOutputWriter, FOLD_STORE_CONF_THRESH
+from stage_pipeline import Stage, run_stages, format_stage_report
 
 # --- Configuration ---
 # These paths should point to where your trained models are stored.
@@ -28,6 +39,19 @@ CLASSIFIER_IMG_CHANNELS = 3
 DEFAULT_CLASSIFICATION_THRESHOLD = 0.5 # Probability threshold for "Opacity" class
 DEFAULT_DETECTION_IOU_THRESHOLD = 0.45 # IoU threshold for Non-Maximum Suppression
 DEFAULT_DETECTION_CONF_THRESHOLD = 0.25 # Confidence threshold for considering a detection valid
+DEFAULT_BOX_FUSION = 'nms' # How the detector folds' boxes are combined: 'nms' or 'wbf' (see box_fusion.py)
+
+# Batch mode
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+DEFAULT_BATCH_SIZE = 8 # Images per model call in batch mode
+DEFAULT_DECODE_WORKERS = 4 # Threads decoding images ahead of the models
+DEFAULT_STAGE_QUEUE_SIZE = 2 # Batches waiting in front of each stage in --pipeline_stages mode
+
+# Early-exit fold evaluation
+EARLY_EXIT_MARGIN = 1e-6 # Keeps the bound check safe against float32 rounding of the full-ensemble mean
+
+# Speculative detection: detector folds start alongside the classifier folds, only with a core to spare
+SPECULATIVE_MIN_CORES = 2
 
 # Global model lists (loaded once)
 CLASSIFIER_MODELS = []
@@ -134,44 +158,215 @@ def predict_with_classifiers(image_array_processed, models):
     return final_label_str, float(ensemble_probability)
 
 
+def build_fused_classifier_ensemble(models):
+    """
+    Fuses the fold classifiers into a single compiled graph.
+    The returned function takes a float32 batch of shape (N, height, width, channels) and
+    returns (mean_probability (N,), fold_probabilities (N, num_folds)) from one call,
+    avoiding the per-call setup cost of model.predict for every fold.
+    """
+    if not models:
+        raise ValueError("Classifier models not loaded.")
+
+    @tf.function(input_signature=[tf.TensorSpec(
+        [None, CLASSIFIER_IMG_HEIGHT, CLASSIFIER_IMG_WIDTH, CLASSIFIER_IMG_CHANNELS], tf.float32)])
+    def fused_ensemble(batch):
+        fold_probabilities = tf.concat([model(batch, training=False) for model in models], axis=-1)
+        return tf.reduce_mean(fold_probabilities, axis=-1), fold_probabilities
+
+    return fused_ensemble
+
+
+def predict_with_fused_ensemble(image_array_processed, fused_ensemble):
+    """
+    Same contract as predict_with_classifiers, using a graph from build_fused_classifier_ensemble.
+    Returns:
+        Tuple: (final_label_str, ensemble_probability_float)
+    """
+    _, fold_probabilities = fused_ensemble(tf.convert_to_tensor(image_array_processed, dtype=tf.float32))
+    # Average the per-fold outputs with NumPy, exactly as predict_with_classifiers does,
+    # so the result is bit-identical to the per-model path.
+    ensemble_probability = np.mean(fold_probabilities.numpy()[0])
+    final_label_str = "Opacity" if ensemble_probability >= DEFAULT_CLASSIFICATION_THRESHOLD else "Normal"
+
+    return final_label_str, float(ensemble_probability)
+
+
+def parse_fold_order(fold_order, num_folds):
+    """
+    Converts a fold order given as 1-based fold numbers ("3,1,5" or [3, 1, 5]) to 0-based
+    model indices. Folds that are not listed are appended in their natural order.
+    """
+    if isinstance(fold_order, str):
+        fold_order = [int(fold) for fold in fold_order.split(",") if fold.strip()]
+    order = [fold - 1 for fold in (fold_order or [])]
+    if len(set(order)) != len(order) or any(index < 0 or index >= num_folds for index in order):
+        raise ValueError(f"Invalid fold order {fold_order} for {num_folds} folds.")
+    return order + [index for index in range(num_folds) if index not in order]
+
+
+def sequential_fold_evaluation(num_images, num_folds, run_fold, fold_order=None,
+                               thresholds=(DEFAULT_CLASSIFICATION_THRESHOLD,)):
+    """
+    Evaluates the folds one at a time in `fold_order` and stops for an image as soon as the
+    remaining folds can no longer move its ensemble mean across any of `thresholds`
+    (every fold probability lies in [0, 1]).
+    Args:
+        run_fold: Callable (fold_index, image_indices) -> fold probabilities for those images.
+    Returns:
+        Tuple of arrays (probabilities, folds_used, lower_bounds, upper_bounds), one entry per image.
+        Images that used every fold get the exact ensemble mean; images that exited early get
+        the mean of the folds evaluated, and the bounds on the full-ensemble mean.
+    """
+    order = parse_fold_order(fold_order, num_folds)
+    fold_probabilities = np.zeros((num_folds, num_images), dtype=np.float32)
+    fold_sums = np.zeros(num_images)
+    folds_used = np.zeros(num_images, dtype=int)
+    lower_bounds, upper_bounds = np.zeros(num_images), np.ones(num_images)
+
+    active = np.arange(num_images)
+    for step, fold in enumerate(order, start=1):
+        outputs = np.asarray(run_fold(fold, active)).reshape(-1)
+        fold_probabilities[fold, active] = outputs
+        fold_sums[active] += outputs
+        folds_used[active] = step
+        lower_bounds[active] = fold_sums[active] / num_folds
+        upper_bounds[active] = (fold_sums[active] + num_folds - step) / num_folds
+        settled = np.ones(len(active), dtype=bool)
+        for threshold in thresholds:
+            settled &= ((lower_bounds[active] >= threshold + EARLY_EXIT_MARGIN)
+                        | (upper_bounds[active] < threshold - EARLY_EXIT_MARGIN))
+        active = active[~settled]
+        if active.size == 0:
+            break
+
+    probabilities = fold_sums / np.maximum(folds_used, 1)
+    complete = folds_used == num_folds
+    # Same NumPy mean over the fold axis as predict_with_classifiers_batch, so full evaluations match exactly
+    probabilities[complete] = np.mean(fold_probabilities[:, complete], axis=0)
+    lower_bounds[complete] = upper_bounds[complete] = probabilities[complete]
+    return probabilities, folds_used, lower_bounds, upper_bounds
+
+
+def predict_with_classifiers_early_exit(images_processed, models, fold_order=None,
+                                        thresholds=(DEFAULT_CLASSIFICATION_THRESHOLD,)):
+    """
+    Early-exit version of predict_with_classifiers_batch: folds run one at a time (in `fold_order`)
+    on the images whose decision against `thresholds` is still open.
+    Args:
+        images_processed: Preprocessed array of shape (N, height, width, channels).
+    Returns:
+        List of (final_label_str, probability_float, info), one per image, where info is
+        {"folds_used": int, "probability_bounds": [lower, upper]}.
+    """
+    if not models:
+        raise ValueError("Classifier models not loaded.")
+
+    def run_fold(fold, image_indices):
+        batch = images_processed if len(image_indices) == len(images_processed) else images_processed[image_indices]
+        return models[fold].predict(batch, verbose=0)[:, 0]
+
+    probabilities, folds_used, lower_bounds, upper_bounds = sequential_fold_evaluation(
+        len(images_processed), len(models), run_fold, fold_order, thresholds
+    )
+    return [
+        ("Opacity" if prob >= DEFAULT_CLASSIFICATION_THRESHOLD else "Normal", float(prob),
+         {"folds_used": int(used), "probability_bounds": [float(lower), float(upper)]})
+        for prob, used, lower, upper in zip(probabilities, folds_used, lower_bounds, upper_bounds)
+    ]
+
+
 def ensemble_detections_nms(all_boxes, all_scores, all_classes, iou_threshold):
     """
     Applies Non-Maximum Suppression to a combined list of detections.
     Args:
-        all_boxes: List or Tensor of bounding boxes (e.g., [[x1,y1,x2,y2], ...]).
-        all_scores: List or Tensor of confidence scores.
-        all_classes: List or Tensor of class IDs.
+        all_boxes: List or array of bounding boxes (e.g., [[x1,y1,x2,y2], ...]).
+        all_scores: List or array of confidence scores.
+        all_classes: List or array of class IDs.
         iou_threshold: IoU threshold for NMS.
     Returns:
         List of final boxes: [[x1,y1,x2,y2, score, class_id], ...]
     """
-    if not all_boxes: # Check if the list is empty
+    if len(all_boxes) == 0: # Check if there is anything to suppress
         return []
 
-    boxes_tensor = torch.tensor(all_boxes, dtype=torch.float32)
-    scores_tensor = torch.tensor(all_scores, dtype=torch.float32)
-    # classes_tensor = torch.tensor(all_classes, dtype=torch.int64) # Not used by torchvision.ops.nms directly
+    # Class-agnostic, identical to torchvision.ops.nms (only one class, 'Opacity', is trained)
+    final_boxes = fuse_boxes_batch([all_boxes], [all_scores], [all_classes], iou_threshold, mode='nms')[0]
+    return [[float(x1), float(y1), float(x2), float(y2), float(score), int(class_id)]
+            for x1, y1, x2, y2, score, class_id in final_boxes]
 
-    if boxes_tensor.nelement() == 0: # Check if tensor is empty
-        return []
 
-    # Perform NMS (expects boxes in (x1, y1, x2, y2) format)
-    # torchvision.ops.nms works per-class. Since we only have one class 'Opacity' (0), this is simpler.
-    # If multiple classes, you'd loop NMS per class or use a multi-class NMS variant.
-    keep_indices = torchvision.ops.nms(boxes_tensor, scores_tensor, iou_threshold)
+def collect_fold_detections(per_image_detections, results):
+    """Appends one fold's Ultralytics results (as arrays) to each image's (boxes, scores, classes) lists."""
+    for (boxes, scores, classes), result in zip(per_image_detections, results):
+        if result.boxes:
+            boxes.append(result.boxes.xyxy.cpu().numpy())
+            scores.append(result.boxes.conf.cpu().numpy())
+            classes.append(result.boxes.cls.cpu().numpy())
 
-    final_boxes = []
-    for idx in keep_indices:
-        final_boxes.append([
-            float(boxes_tensor[idx][0]), float(boxes_tensor[idx][1]),
-            float(boxes_tensor[idx][2]), float(boxes_tensor[idx][3]),
-            float(scores_tensor[idx]),
-            int(all_classes[idx]) # Keep original class for the kept box
-        ])
-    return final_boxes
+
+def fuse_and_format_detections(per_image_detections, iou_thresh, box_fusion, num_models):
+    """Fuses every image's fold detections in one batched call and formats them with class names."""
+    fused = fuse_boxes_batch(
+        [np.concatenate(boxes) if boxes else np.empty((0, 4), np.float32) for boxes, _, _ in per_image_detections],
+        [np.concatenate(scores) if scores else np.empty(0, np.float32) for _, scores, _ in per_image_detections],
+        [np.concatenate(classes) if classes else np.empty(0, np.float32) for _, _, classes in per_image_detections],
+        iou_thresh, mode=box_fusion, num_models=num_models
+    )
+    # Convert class_id (0) to class_name ("Opacity")
+    class_names = {0: "Opacity"}
+    return [
+        [[float(x1), float(y1), float(x2), float(y2), float(score), class_names.get(int(class_id), "Unknown")]
+         for x1, y1, x2, y2, score, class_id in image_boxes]
+        for image_boxes in fused
+    ]
+
+
+def shared_fold_predictors(models, conf_thresh):
+    """
+    The folds' Ultralytics predictors, if one preprocessed tensor can feed all of them: each fold has
+    been set up by a first predict call with this confidence, and all share input size, stride,
+    precision and device. Returns None otherwise.
+    """
+    predictors = [getattr(model, "predictor", None) for model in models]
+    if any(predictor is None or predictor.imgsz is None or predictor.args.conf != conf_thresh
+           for predictor in predictors):
+        return None
+    signatures = {(tuple(predictor.imgsz), int(predictor.model.stride), bool(predictor.model.fp16), str(predictor.device))
+                  for predictor in predictors}
+    return predictors if len(signatures) == 1 else None
 
 
-def predict_with_detectors(image_path_or_array, models, iou_thresh, conf_thresh):
+def run_detector_folds(images_rgb, models, conf_thresh, cancelled=None):
+    """
+    Returns each fold's Ultralytics results for a list of RGB arrays. Letterboxing, normalization and
+    tensor conversion run once and the tensor is shared by every fold; each fold's own postprocess
+    maps the boxes back to image coordinates, as model.predict does.
+    If the `cancelled` event is set, stops before the next fold and returns None.
+    """
+    predictors = shared_fold_predictors(models, conf_thresh)
+    all_results = []
+    if predictors is None: # First call sets the predictors up
+        for model in models:
+            if cancelled is not None and cancelled.is_set():
+                return None
+            all_results.append(model.predict(images_rgb, conf=conf_thresh, verbose=False))
+        return all_results
+
+    import torch
+    with torch.inference_mode():
+        shared_input = predictors[0].preprocess(images_rgb)
+        for predictor in predictors:
+            if cancelled is not None and cancelled.is_set():
+                return None
+            with predictor._lock: # As in model.predict: batch is per-call state
+                predictor.batch = ([""] * len(images_rgb), images_rgb, [""] * len(images_rgb))
+                all_results.append(predictor.postprocess(predictor.inference(shared_input), shared_input, images_rgb))
+    return all_results
+
+
+def predict_with_detectors(image_path_or_array, models, iou_thresh, conf_thresh, box_fusion=DEFAULT_BOX_FUSION,
+                           cancelled=None):
     """
     Performs object detection using an ensemble of Ultralytics YOLO models.
     Args:
@@ -180,8 +375,11 @@ def predict_with_detectors(image_path_or_array, models, iou_thresh, conf_thresh)
         models: List of loaded Ultralytics YOLO models.
         iou_thresh: IoU threshold for NMS.
         conf_thresh: Confidence threshold for initial filtering of detections.
+        box_fusion: 'nms' or 'wbf' (weighted boxes fusion).
+        cancelled: Optional threading.Event; once set, the remaining folds are skipped.
     Returns:
         List of detected bounding boxes: [[x1, y1, x2, y2, score, class_name_str], ...]
+        (None if cancelled).
     """
     if not models:
         raise ValueError("Detector models not loaded.")
@@ -201,60 +399,113 @@ def predict_with_detectors(image_path_or_array, models, iou_thresh, conf_thresh)
         image_input_for_yolo = image_path_or_array
 
 
-    all_pred_boxes = []
-    all_pred_scores = []
-    all_pred_classes = [] # We know it's class 0 for 'Opacity'
+    detections = [([], [], [])] # boxes, scores, classes from every fold, kept as arrays
 
-    for model in models:
-        # You can specify imgsz if needed, e.g., model.predict(image_input_for_yolo, conf=conf_thresh, imgsz=608)
-        # By default, Ultralytics uses the model's trained imgsz.
-        results = model.predict(image_input_for_yolo, conf=conf_thresh, verbose=False) # verbose=False for less output
+    if isinstance(image_input_for_yolo, np.ndarray):
+        # Preprocessed once, shared by every fold
+        all_results = run_detector_folds([image_input_for_yolo], models, conf_thresh, cancelled)
+        if all_results is None:
+            return None
+        for results in all_results:
+            collect_fold_detections(detections, results)
+    else:
+        for model in models:
+            # You can specify imgsz if needed, e.g., model.predict(image_input_for_yolo, conf=conf_thresh, imgsz=608)
+            # By default, Ultralytics uses the model's trained imgsz.
+            results = model.predict(image_input_for_yolo, conf=conf_thresh, verbose=False) # verbose=False for less output
+            collect_fold_detections(detections, results)
 
-        if results and results[0].boxes:
-            boxes = results[0].boxes.xyxy.cpu().numpy() # [[x1,y1,x2,y2], ...]
-            scores = results[0].boxes.conf.cpu().numpy() # [score, ...]
-            classes = results[0].boxes.cls.cpu().numpy() # [class_id, ...]
+    # Combine the folds' detections (NMS by default)
+    return fuse_and_format_detections(detections, iou_thresh, box_fusion, len(models))[0]
 
-            all_pred_boxes.extend(boxes.tolist())
-            all_pred_scores.extend(scores.tolist())
-            all_pred_classes.extend(classes.tolist()) # Should all be 0 for 'Opacity'
+# --- Speculative Detection ---
+speculation_stats = {"used": 0, "discarded": 0, "skipped_no_spare_core": 0, "wasted_detector_seconds": 0.0}
+_speculation_lock = threading.Lock()
+_speculative_executor = None
 
-    # Apply NMS to the combined list of detections
-    if not all_pred_boxes:
-        return []
 
-    # Convert class_id (0) to class_name ("Opacity")
-    # This assumes class 0 is 'Opacity' as per typical YOLO setup for single class
-    class_names = {0: "Opacity"}
-    final_ensembled_boxes = ensemble_detections_nms(
-        all_pred_boxes,
-        all_pred_scores,
-        all_pred_classes, # Pass original classes to preserve them through NMS
-        iou_thresh
-    )
+def available_cores():
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+
+def start_speculative_detection(raw_image_bgr, detect_models, det_iou_thresh, det_conf_thresh, box_fusion):
+    """
+    Starts the detector folds on a background thread while the classifier folds run.
+    Returns (future, cancel_event); the future yields (boxes, detector_seconds), boxes being None
+    if cancelled. Returns None when there is no spare core.
+    """
+    global _speculative_executor
+    if available_cores() < SPECULATIVE_MIN_CORES:
+        with _speculation_lock:
+            speculation_stats["skipped_no_spare_core"] += 1
+        return None
+    if _speculative_executor is None:
+        _speculative_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculative-detect")
+    cancelled = threading.Event()
+
+    def run():
+        start = time.perf_counter()
+        boxes = predict_with_detectors(raw_image_bgr, detect_models, det_iou_thresh, det_conf_thresh,
+                                       box_fusion, cancelled=cancelled)
+        return boxes, time.perf_counter() - start
+
+    return _speculative_executor.submit(run), cancelled
 
-    # Format output with class names
-    formatted_boxes = []
-    for box_data in final_ensembled_boxes:
-        x1, y1, x2, y2, score, class_id = box_data
-        formatted_boxes.append([x1, y1, x2, y2, score, class_names.get(int(class_id), "Unknown")])
 
-    return formatted_boxes
+def discard_speculative_detection(speculation):
+    """Cancels a speculative run (between folds) and counts its detector time as wasted once it stops."""
+    future, cancelled = speculation
+    cancelled.set()
+
+    def record(done):
+        with _speculation_lock:
+            speculation_stats["discarded"] += 1
+            if done.exception() is None:
+                speculation_stats["wasted_detector_seconds"] += done.result()[1]
+
+    future.add_done_callback(record)
+
 
 # --- Main Pipeline Function ---
 def run_complete_pipeline(image_path, class_models, detect_models,
-                           class_thresh, det_iou_thresh, det_conf_thresh):
+                           class_thresh, det_iou_thresh, det_conf_thresh,
+                           fused_ensemble=None, early_exit=False, fold_order=None,
+                           box_fusion=DEFAULT_BOX_FUSION, speculative=False):
     """
     Runs the full classification and conditional detection pipeline.
+    If fused_ensemble (from build_fused_classifier_ensemble) is given, it replaces
+    the per-fold classifier calls. With early_exit, folds run one at a time in fold_order
+    and stop once the label and detection decisions are certain. With speculative, detection
+    starts alongside classification (given a spare core) and is thrown away if it is not needed;
+    the output is the same either way.
     """
     # Load image once (e.g. for classifier, and pass array to detector if needed)
     raw_image_bgr = cv2.imread(image_path)
     if raw_image_bgr is None:
         return {"error": f"Failed to load image: {image_path}"}
 
+    speculation = None
+    if speculative:
+        speculation = start_speculative_detection(raw_image_bgr, detect_models,
+                                                  det_iou_thresh, det_conf_thresh, box_fusion)
+
     # Stage 1: Classification
-    processed_img_classifier = preprocess_image_for_classifier(raw_image_bgr) # Pass the loaded array
-    classification_label, classification_prob = predict_with_classifiers(processed_img_classifier, class_models)
+    try:
+        processed_img_classifier = preprocess_image_for_classifier(raw_image_bgr) # Pass the loaded array
+        early_exit_info = None
+        if early_exit:
+            classification_label, classification_prob, early_exit_info = predict_with_classifiers_early_exit(
+                processed_img_classifier, class_models, fold_order,
+                thresholds=(DEFAULT_CLASSIFICATION_THRESHOLD, class_thresh)
+            )[0]
+        elif fused_ensemble is not None:
+            classification_label, classification_prob = predict_with_fused_ensemble(processed_img_classifier, fused_ensemble)
+        else:
+            classification_label, classification_prob = predict_with_classifiers(processed_img_classifier, class_models)
+    except BaseException:
+        if speculation is not None:
+            discard_speculative_detection(speculation)
+        raise
 
     output = {
         "image_path": image_path,
@@ -264,23 +515,328 @@ def run_complete_pipeline(image_path, class_models, detect_models,
         },
         "detections": []
     }
+    if early_exit_info is not None:
+        output["classification"].update(early_exit_info)
 
     # Stage 2: Detection (if classified as Opacity)
     if classification_label == "Opacity" and classification_prob >= class_thresh:
-        # Pass the raw BGR image array to the detector function, which handles conversion if needed
-        detected_boxes = predict_with_detectors(raw_image_bgr, detect_models,
-                                                det_iou_thresh, det_conf_thresh)
+        if speculation is not None:
+            detected_boxes, _ = speculation[0].result()
+            with _speculation_lock:
+                speculation_stats["used"] += 1
+        else:
+            # Pass the raw BGR image array to the detector function, which handles conversion if needed
+            detected_boxes = predict_with_detectors(raw_image_bgr, detect_models,
+                                                    det_iou_thresh, det_conf_thresh, box_fusion)
         output["detections"] = detected_boxes
     else:
+        if speculation is not None:
+            discard_speculative_detection(speculation)
         print(f"Skipping detection for {os.path.basename(image_path)} as classification is '{classification_label}' (Prob: {classification_prob:.4f})")
 
 
     return output
 
+# --- Batch / Streaming Mode ---
+def iter_image_paths(sources):
+    """
+    Lazily yields image paths from a mix of sources:
+    a directory (walked recursively), a glob pattern, a .txt file listing one path per line,
+    or a plain image path.
+    """
+    for source in sources:
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield os.path.join(root, name)
+        elif source.lower().endswith('.txt') and os.path.isfile(source):
+            with open(source) as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        yield line
+        elif glob.has_magic(source):
+            yield from sorted(glob.iglob(source, recursive=True))
+        else:
+            yield source
+
+
+def prefetch_decoded_images(image_paths, num_workers=DEFAULT_DECODE_WORKERS, max_prefetch=None):
+    """
+    Decodes images on a thread pool while preserving input order.
+    At most `max_prefetch` decodes are in flight, so memory stays bounded for any input size.
+    Yields (image_path, image_bgr_or_None).
+    """
+    max_prefetch = max_prefetch or num_workers * 2
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for image_path in image_paths:
+            pending.append((image_path, executor.submit(cv2.imread, image_path)))
+            if len(pending) >= max_prefetch:
+                path, future = pending.popleft()
+                yield path, future.result()
+        while pending:
+            path, future = pending.popleft()
+            yield path, future.result()
+
+
+def classifier_fold_probabilities(images_processed, models, fused_ensemble=None):
+    """Every fold's probability for N preprocessed images, as a (folds, N) array."""
+    if not models:
+        raise ValueError("Classifier models not loaded.")
+
+    if fused_ensemble is not None:
+        _, fold_probabilities = fused_ensemble(tf.convert_to_tensor(images_processed, dtype=tf.float32))
+        return fold_probabilities.numpy().T
+    return np.stack([model.predict(images_processed, verbose=0)[:, 0] for model in models])
+
+
+def classifications_from_fold_probabilities(all_probabilities):
+    ensemble_probabilities = np.mean(all_probabilities, axis=0)
+    return [
+        ("Opacity" if prob >= DEFAULT_CLASSIFICATION_THRESHOLD else "Normal", float(prob))
+        for prob in ensemble_probabilities
+    ]
+
+
+def predict_with_classifiers_batch(images_processed, models, fused_ensemble=None):
+    """
+    Batched version of predict_with_classifiers: one call per fold (or one fused call) for N images.
+    Args:
+        images_processed: Preprocessed array of shape (N, height, width, channels).
+    Returns:
+        List of (final_label_str, ensemble_probability_float), one per image.
+    """
+    return classifications_from_fold_probabilities(
+        classifier_fold_probabilities(images_processed, models, fused_ensemble)
+    )
+
+
+def predict_with_detectors_batch(images_bgr, models, iou_thresh, conf_thresh, box_fusion=DEFAULT_BOX_FUSION):
+    """
+    Batched version of predict_with_detectors: one YOLO call per fold for N BGR images.
+    Returns:
+        One list of [x1, y1, x2, y2, score, class_name_str] boxes per image.
+    """
+    if not models:
+        raise ValueError("Detector models not loaded.")
+
+    images_rgb = [cv2.cvtColor(image, cv2.COLOR_BGR2RGB) for image in images_bgr]
+    per_image = [([], [], []) for _ in images_rgb]
+
+    for results in run_detector_folds(images_rgb, models, conf_thresh):
+        collect_fold_detections(per_image, results)
+
+    return fuse_and_format_detections(per_image, iou_thresh, box_fusion, len(models))
+
+
+def detector_fold_outputs(images_bgr, detect_models, conf_thresh):
+    """Every detector fold's raw (boxes, scores, classes) per image at conf_thresh, before fusion."""
+    images_rgb = [cv2.cvtColor(image, cv2.COLOR_BGR2RGB) for image in images_bgr]
+    per_image = [[] for _ in images_rgb]
+    for results in run_detector_folds(images_rgb, detect_models, conf_thresh):
+        for fold_outputs, result in zip(per_image, results):
+            fold_outputs.append((result.boxes.xyxy.cpu().numpy(), result.boxes.conf.cpu().numpy(),
+                                 result.boxes.cls.cpu().numpy()))
+    return per_image
+
+
+def append_fold_outputs(fold_store, image_paths, all_probabilities, per_image):
+    for i, image_path in enumerate(image_paths):
+        fold_store.append(image_path, all_probabilities[:, i], per_image[i])
+
+
+def store_fold_outputs(fold_store, image_paths, images_bgr, all_probabilities, detect_models):
+    """
+    Runs every detector fold on every image at the store's low capture threshold and appends each
+    image's raw fold outputs to `fold_store`. Returns the per-image (boxes, scores, classes) per fold.
+    """
+    per_image = detector_fold_outputs(images_bgr, detect_models, fold_store.meta["conf_thresh"])
+    append_fold_outputs(fold_store, image_paths, all_probabilities, per_image)
+    return per_image
+
+
+def classify_preprocessed_batch(processed, class_models, class_thresh, fused_ensemble=None, early_exit=False,
+                                fold_order=None, keep_fold_probabilities=False):
+    """
+    Classification half of run_pipeline_on_batch.
+    Returns ((label, probability, early-exit info or None) per image, (folds, N) fold probabilities or None).
+    """
+    if keep_fold_probabilities:
+        all_probabilities = classifier_fold_probabilities(processed, class_models, fused_ensemble)
+        return [(label, prob, None) for label, prob in classifications_from_fold_probabilities(all_probabilities)], all_probabilities
+    if early_exit:
+        return predict_with_classifiers_early_exit(
+            processed, class_models, fold_order, thresholds=(DEFAULT_CLASSIFICATION_THRESHOLD, class_thresh)
+        ), None
+    return [(label, prob, None) for label, prob in
+            predict_with_classifiers_batch(processed, class_models, fused_ensemble)], None
+
+
+def detect_classified_batch(image_paths, images_bgr, classifications, detect_models, class_thresh,
+                            det_iou_thresh, det_conf_thresh, box_fusion=DEFAULT_BOX_FUSION, fold_outputs=None):
+    """
+    Detection half of run_pipeline_on_batch: runs the detector folds on the images classified as
+    Opacity (or filters their stored fold_outputs) and returns one output dict per image.
+    """
+    outputs = []
+    positive_indices = []
+    for i, (image_path, (label, prob, early_exit_info)) in enumerate(zip(image_paths, classifications)):
+        outputs.append({
+            "image_path": image_path,
+            "classification": {"label": label, "probability": prob, **(early_exit_info or {})},
+            "detections": []
+        })
+        if label == "Opacity" and prob >= class_thresh:
+            positive_indices.append(i)
+
+    if positive_indices:
+        if fold_outputs is not None:
+            # Same boxes as a detector call at det_conf_thresh: a fold's own NMS only drops a box for
+            # a higher-scored one, which passes the same filter (unless a fold hits YOLO's max_det cap)
+            per_image = []
+            for i in positive_indices:
+                kept = [(boxes[scores >= det_conf_thresh], scores[scores >= det_conf_thresh],
+                         classes[scores >= det_conf_thresh]) for boxes, scores, classes in fold_outputs[i]]
+                per_image.append(tuple(list(column) for column in zip(*kept)))
+            batch_boxes = fuse_and_format_detections(per_image, det_iou_thresh, box_fusion, len(detect_models))
+        else:
+            batch_boxes = predict_with_detectors_batch([images_bgr[i] for i in positive_indices], detect_models,
+                                                       det_iou_thresh, det_conf_thresh, box_fusion)
+        for i, boxes in zip(positive_indices, batch_boxes):
+            outputs[i]["detections"] = boxes
+    return outputs
+
+
+def run_pipeline_on_batch(image_paths, images_bgr, class_models, detect_models,
+                          class_thresh, det_iou_thresh, det_conf_thresh, fused_ensemble=None,
+                          early_exit=False, fold_order=None, box_fusion=DEFAULT_BOX_FUSION, fold_store=None):
+    """
+    Batched equivalent of run_complete_pipeline for already-decoded images.
+    Returns one output dict per image, in the same format as run_complete_pipeline.
+    With a fold_store (FoldOutputWriter), every fold's raw output for every image is also stored,
+    and the served boxes are derived from those stored outputs.
+    """
+    processed = np.concatenate([preprocess_image_for_classifier(image) for image in images_bgr], axis=0)
+    classifications, all_probabilities = classify_preprocessed_batch(
+        processed, class_models, class_thresh, fused_ensemble, early_exit, fold_order,
+        keep_fold_probabilities=fold_store is not None
+    )
+    fold_outputs = None
+    if fold_store is not None:
+        fold_outputs = store_fold_outputs(fold_store, image_paths, images_bgr, all_probabilities, detect_models)
+    return detect_classified_batch(image_paths, images_bgr, classifications, detect_models, class_thresh,
+                                   det_iou_thresh, det_conf_thresh, box_fusion, fold_outputs)
+
+
+def stream_pipeline_results(image_paths, class_models, detect_models, class_thresh, det_iou_thresh,
+                            det_conf_thresh, batch_size=DEFAULT_BATCH_SIZE,
+                            decode_workers=DEFAULT_DECODE_WORKERS, fused_ensemble=None,
+                            early_exit=False, fold_order=None, box_fusion=DEFAULT_BOX_FUSION, fold_store=None):
+    """
+    Generator: decodes `image_paths` ahead on a thread pool, runs the models on batches of
+    `batch_size` images, and yields one output dict per image as soon as its batch finishes.
+    With a fold_store, each batch's raw fold outputs are stored and flushed before it is yielded.
+    """
+    decoded = prefetch_decoded_images(image_paths, decode_workers, max_prefetch=batch_size * 2)
+    while True:
+        chunk = list(itertools.islice(decoded, batch_size))
+        if not chunk:
+            return
+        valid = [(path, image) for path, image in chunk if image is not None]
+        if valid:
+            paths, images = zip(*valid)
+            batch_outputs = iter(run_pipeline_on_batch(list(paths), list(images), class_models, detect_models,
+                                                       class_thresh, det_iou_thresh, det_conf_thresh,
+                                                       fused_ensemble, early_exit, fold_order, box_fusion,
+                                                       fold_store))
+            if fold_store is not None:
+                fold_store.flush()
+        for path, image in chunk:
+            if image is None:
+                yield {"image_path": path, "error": f"Failed to load image: {path}"}
+            else:
+                yield next(batch_outputs)
+
+
+def stream_pipeline_results_staged(image_paths, class_models, detect_models, class_thresh, det_iou_thresh,
+                                   det_conf_thresh, batch_size=DEFAULT_BATCH_SIZE,
+                                   decode_workers=DEFAULT_DECODE_WORKERS, classify_workers=1, detect_workers=1,
+                                   queue_size=DEFAULT_STAGE_QUEUE_SIZE, fused_ensemble=None, early_exit=False,
+                                   fold_order=None, box_fusion=DEFAULT_BOX_FUSION, fold_store=None, stage_stats=None):
+    """
+    Same results, in the same order, as stream_pipeline_results, but decode + preprocessing,
+    classification and detection run as three stages with their own workers, connected by queues
+    of `queue_size` batches: one batch is being detected while the next is classified and later
+    ones are decoded. Each stage's throughput is stored in `stage_stats` (a dict) when done.
+    """
+    def decode(paths):
+        images = [cv2.imread(path) for path in paths]
+        valid = [i for i, image in enumerate(images) if image is not None]
+        processed = (np.concatenate([preprocess_image_for_classifier(images[i]) for i in valid], axis=0)
+                     if valid else None)
+        return {"paths": paths, "images": images, "valid": valid, "processed": processed}
+
+    def classify(batch):
+        if batch["valid"]:
+            batch["classifications"], batch["fold_probabilities"] = classify_preprocessed_batch(
+                batch.pop("processed"), class_models, class_thresh, fused_ensemble, early_exit, fold_order,
+                keep_fold_probabilities=fold_store is not None
+            )
+        return batch
+
+    def detect(batch):
+        if batch["valid"]:
+            paths = [batch["paths"][i] for i in batch["valid"]]
+            images = [batch["images"][i] for i in batch["valid"]]
+            batch["fold_outputs"] = (detector_fold_outputs(images, detect_models, fold_store.meta["conf_thresh"])
+                                     if fold_store is not None else None)
+            batch["outputs"] = detect_classified_batch(paths, images, batch["classifications"], detect_models,
+                                                       class_thresh, det_iou_thresh, det_conf_thresh, box_fusion,
+                                                       batch["fold_outputs"])
+        batch.pop("images")
+        return batch
+
+    def chunks():
+        image_paths_iter = iter(image_paths)
+        while True:
+            chunk = list(itertools.islice(image_paths_iter, batch_size))
+            if not chunk:
+                return
+            yield chunk, len(chunk)
+
+    stages = [Stage("decode", decode, decode_workers, queue_size),
+              Stage("classify", classify, classify_workers, queue_size),
+              Stage("detect", detect, detect_workers, queue_size)]
+    try:
+        for batch in run_stages(chunks(), stages):
+            if fold_store is not None and batch["valid"]:
+                # Appended here, in input order, whichever detect worker finished first
+                append_fold_outputs(fold_store, [batch["paths"][i] for i in batch["valid"]],
+                                    batch["fold_probabilities"], batch["fold_outputs"])
+                fold_store.flush()
+            batch_outputs = iter(batch.get("outputs", []))
+            valid = set(batch["valid"])
+            for i, path in enumerate(batch["paths"]):
+                if i in valid:
+                    yield next(batch_outputs)
+                else:
+                    yield {"image_path": path, "error": f"Failed to load image: {path}"}
+    finally:
+        for stage in stages:
+            stage.shutdown()
+        if stage_stats is not None:
+            stage_stats.update({stage.name: stage.stats.snapshot() for stage in stages})
+
+
 # --- Main Execution ---
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Pneumonia Classification and Detection Pipeline.")
-    parser.add_argument("image_path", type=str, help="Path to the input image.")
+    parser.add_argument("image_path", type=str, nargs="+",
+                        help="Path to the input image. With --batch: directories, glob patterns, "
+                             "or .txt files listing image paths.")
     parser.add_argument("--classifier_dir", type=str, default=CLASSIFIER_MODEL_DIR,
                         help="Directory containing Keras classifier models.")
     parser.add_argument("--detector_pattern", type=str, default=DETECTOR_MODEL_PATTERN,
@@ -291,10 +847,54 @@ if __name__ == "__main__":
                         help="IoU threshold for detection NMS.")
     parser.add_argument("--det_conf_thresh", type=float, default=DEFAULT_DETECTION_CONF_THRESHOLD,
                         help="Confidence threshold for YOLO detections.")
+    parser.add_argument("--box_fusion", type=str, default=DEFAULT_BOX_FUSION, choices=FUSION_MODES,
+                        help="How detector folds' boxes are combined: NMS or weighted boxes fusion.")
     parser.add_argument("--cpu", action="store_true", help="Force all operations on CPU.")
+    parser.add_argument("--fused_ensemble", action="store_true",
+                        help="Run all classifier folds as one fused graph instead of one call per fold.")
+    parser.add_argument("--early_exit", action="store_true",
+                        help="Run classifier folds one at a time and stop once the remaining folds cannot flip the decision.")
+    parser.add_argument("--fold_order", type=str, default=None,
+                        help="Comma-separated fold numbers evaluated first in early-exit mode, e.g. '3,1,5,2,4'.")
+    parser.add_argument("--speculative_detection", action="store_true",
+                        help="Start detection alongside classification when a core is spare (single-image mode).")
+    parser.add_argument("--batch", action="store_true",
+                        help="Stream many images through the pipeline and write one JSON line per image.")
+    parser.add_argument("--batch_size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Images per model call in batch mode.")
+    parser.add_argument("--decode_workers", type=int, default=DEFAULT_DECODE_WORKERS,
+                        help="Threads used to decode images ahead of the models in batch mode.")
+    parser.add_argument("--pipeline_stages", action="store_true",
+                        help="Batch mode: run decode + preprocessing, classification and detection as separate "
+                             "stages that work on different batches at once, and report each stage's throughput.")
+    parser.add_argument("--classify_workers", type=int, default=1,
+                        help="Threads running classifier batches in --pipeline_stages mode.")
+    parser.add_argument("--detect_workers", type=int, default=1,
+                        help="Threads running detector batches in --pipeline_stages mode.")
+    parser.add_argument("--stage_queue_size", type=int, default=DEFAULT_STAGE_QUEUE_SIZE,
+                        help="Batches that may wait in front of each stage in --pipeline_stages mode.")
+    parser.add_argument("--output", type=str, default="-",
+                        help="JSONL output file for batch mode ('-' for stdout).")
+    parser.add_argument("--threading_config", type=str, default="threading_config.json",
+                        help="TensorFlow/torch thread settings written by ML_API/autotune_threads.py (applied if the file exists).")
+    parser.add_argument("--store_fold_outputs", type=str, default=None,
+                        help="Batch mode: also store every fold's raw outputs for every image in this directory "
+                             "(memory-mapped columns read by sweep_thresholds.py). Detectors then run on all images.")
+    parser.add_argument("--store_conf_thresh", type=float, default=FOLD_STORE_CONF_THRESH,
+                        help="Detector confidence at which boxes are captured into the fold output store.")
 
 
     args = parser.parse_args()
+    if not args.batch and len(args.image_path) != 1:
+        parser.error("Pass exactly one image_path, or use --batch for multiple inputs.")
+    if args.store_fold_outputs and (not args.batch or args.early_exit):
+        parser.error("--store_fold_outputs needs --batch and every fold's output (no --early_exit).")
+
+    # In batch mode stdout carries the JSONL results, so every diagnostic print (model loading,
+    # GPU and thread setup, per-image notes) goes to stderr instead
+    results_stdout = sys.stdout
+    if args.batch:
+        sys.stdout = sys.stderr
 
     # Handle CPU forcing
     if args.cpu:
@@ -304,6 +904,10 @@ if __name__ == "__main__":
         # This is a simpler global way for TF. Ultralytics usually adapts.
         print("Attempting to force CPU usage.")
 
+    # Thread pool sizes must be set before TensorFlow runs its first op
+    thread_config = load_thread_config(args.threading_config)
+    if thread_config:
+        print(f"Applied threading config from {args.threading_config}: {apply_thread_config(thread_config)}")
 
     # Configure TensorFlow GPU Memory (do this before TF initializes GPU)
     if not args.cpu:
@@ -331,15 +935,64 @@ if __name__ == "__main__":
         print("Critical error: Not all models could be loaded. Exiting.")
         exit(1)
 
+    fused_ensemble = build_fused_classifier_ensemble(CLASSIFIER_MODELS) if args.fused_ensemble else None
+    if args.early_exit:
+        parse_fold_order(args.fold_order, len(CLASSIFIER_MODELS)) # Fail fast on an invalid --fold_order
+
+    if args.batch:
+        output_file = results_stdout if args.output == "-" else open(args.output, "w")
+        fold_store = (FoldOutputWriter(args.store_fold_outputs, len(CLASSIFIER_MODELS), len(DETECTOR_MODELS),
+                                       args.store_conf_thresh) if args.store_fold_outputs else None)
+        stage_stats = {}
+        if args.pipeline_stages:
+            results = stream_pipeline_results_staged(
+                iter_image_paths(args.image_path), CLASSIFIER_MODELS, DETECTOR_MODELS,
+                args.class_thresh, args.det_iou_thresh, args.det_conf_thresh,
+                batch_size=args.batch_size, decode_workers=args.decode_workers,
+                classify_workers=args.classify_workers, detect_workers=args.detect_workers,
+                queue_size=args.stage_queue_size, fused_ensemble=fused_ensemble, early_exit=args.early_exit,
+                fold_order=args.fold_order, box_fusion=args.box_fusion, fold_store=fold_store, stage_stats=stage_stats
+            )
+        else:
+            results = stream_pipeline_results(
+                iter_image_paths(args.image_path), CLASSIFIER_MODELS, DETECTOR_MODELS,
+                args.class_thresh, args.det_iou_thresh, args.det_conf_thresh,
+                batch_size=args.batch_size, decode_workers=args.decode_workers,
+                fused_ensemble=fused_ensemble, early_exit=args.early_exit, fold_order=args.fold_order,
+                box_fusion=args.box_fusion, fold_store=fold_store
+            )
+        try:
+            for result in results:
+                output_file.write(json.dumps(result) + "\n")
+                output_file.flush()
+        finally:
+            results.close()
+            if output_file is not results_stdout:
+                output_file.close()
+            if fold_store is not None:
+                fold_store.close()
+        if stage_stats:
+            print(f"Stage throughput (images):\n{format_stage_report(stage_stats)}", file=sys.stderr)
+        sys.exit(0)
+
     # Run the pipeline
     results = run_complete_pipeline(
-        args.image_path,
+        args.image_path[0],
         CLASSIFIER_MODELS,
         DETECTOR_MODELS,
         args.class_thresh,
         args.det_iou_thresh,
-        args.det_conf_thresh
+        args.det_conf_thresh,
+        fused_ensemble=fused_ensemble,
+        early_exit=args.early_exit,
+        fold_order=args.fold_order,
+        box_fusion=args.box_fusion,
+        speculative=args.speculative_detection
     )
 
     # Print results as JSON
-    print(json.dumps(results, indent=4))
\ No newline at end of file
+    print(json.dumps(results, indent=4))
+    if args.speculative_detection:
+        if _speculative_executor is not None:
+            _speculative_executor.shutdown(wait=True) # Let a discarded run stop so its time is counted
+        print(f"Speculative detection: {json.dumps(speculation_stats)}", file=sys.stderr)
\ No newline at end of file
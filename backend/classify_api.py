@@ -1,3 +1,4 @@
+import os
 from flask import Flask, request, jsonify
 import numpy as np
 import cv2
@@ -11,48 +12,97 @@ from classify import (
     set_gpu_memory_growth,
     CLASSIFIER_MODEL_DIR,
     DETECTOR_MODEL_PATTERN,
+    NUM_FOLDS,
     DEFAULT_CLASSIFICATION_THRESHOLD,
     DEFAULT_DETECTION_IOU_THRESHOLD,
     DEFAULT_DETECTION_CONF_THRESHOLD
 )
+from result_cache import ResultCache, files_identity
+from raw_image import RAW_IMAGE_CONTENT_TYPE, RawImageError, parse_raw_image, to_bgr
+from thread_config import load_thread_config, apply_thread_config
 
 app = Flask(__name__)
 
+# Result cache keyed on image bytes + thresholds (RESULT_CACHE_MAX_ENTRIES=0 disables memory tier,
+# RESULT_CACHE_DIR enables a persistent on-disk tier of about RESULT_CACHE_MAX_DISK_ENTRIES files, 0: unbounded)
+result_cache = ResultCache(
+    max_entries=int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', '1024')),
+    disk_dir=os.environ.get('RESULT_CACHE_DIR', ''),
+    max_disk_entries=int(os.environ.get('RESULT_CACHE_MAX_DISK_ENTRIES', '100000'))
+)
+
+# Largest pre-decoded pixel array accepted by /api/analyze (height x width)
+RAW_IMAGE_MAX_PIXELS = int(os.environ.get('RAW_IMAGE_MAX_PIXELS', str(64 * 2**20)))
+
 # Initialize models
 print("Initializing models...")
+# TensorFlow/torch thread settings from ML_API/autotune_threads.py, if present
+threading_config_path = os.environ.get('THREADING_CONFIG', 'threading_config.json')
+thread_config = load_thread_config(threading_config_path)
+if thread_config:
+    print(f"Applied threading config from {threading_config_path}: {apply_thread_config(thread_config)}")
 set_gpu_memory_growth()
 classifier_models = load_all_classifier_models(CLASSIFIER_MODEL_DIR)
 detector_models = load_all_detector_models(DETECTOR_MODEL_PATTERN)
 print("Models loaded successfully!")
+# Part of the cache key, so replaced fold weights don't hit results cached on disk for the old ones
+weights_identity = files_identity(
+    [os.path.join(CLASSIFIER_MODEL_DIR, f'classifier_split_{i}.keras') for i in range(1, NUM_FOLDS + 1)]
+    + [DETECTOR_MODEL_PATTERN.format(i) for i in range(1, NUM_FOLDS + 1)]
+)
 
-def base64_to_image(base64_string):
-    """Convert base64 string to numpy array."""
+def base64_to_bytes(base64_string):
+    """Convert base64 string (optionally a data URL) to raw image bytes."""
     try:
         # Remove the data URL prefix if present
         if ',' in base64_string:
             base64_string = base64_string.split(',')[1]
-        
-        # Decode base64 string
-        image_data = base64.b64decode(base64_string)
-        nparr = np.frombuffer(image_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        return img
+        return base64.b64decode(base64_string)
     except Exception as e:
         raise ValueError(f"Error decoding base64 image: {str(e)}")
 
+def base64_to_image(base64_string):
+    """Convert base64 string to numpy array."""
+    nparr = np.frombuffer(base64_to_bytes(base64_string), np.uint8)
+    return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
 @app.route('/api/analyze', methods=['POST'])
 def analyze_image():
     try:
-        # Get image data from request
-        if 'image' not in request.files and 'image' not in request.json:
-            return jsonify({'error': 'No image provided'}), 400
-
-        # Handle both file upload and base64
-        if 'image' in request.files:
-            file = request.files['image']
-            img = cv2.imdecode(np.frombuffer(file.read(), np.uint8), cv2.IMREAD_COLOR)
+        # A pre-decoded uint8 pixel array (see raw_image.py) is wrapped without decoding
+        if request.mimetype in (RAW_IMAGE_CONTENT_TYPE, 'application/octet-stream'):
+            image_data = request.get_data()
+            try:
+                raw_image, color = parse_raw_image(image_data, request.headers, RAW_IMAGE_MAX_PIXELS)
+            except RawImageError as e:
+                return jsonify({'error': str(e)}), e.status_code
+            cache_variant = ('raw', raw_image.shape, color)
+            decode = lambda _: to_bgr(raw_image, color)
         else:
-            img = base64_to_image(request.json['image'])
+            # Get image data from request
+            if 'image' not in request.files and 'image' not in request.json:
+                return jsonify({'error': 'No image provided'}), 400
+
+            # Handle both file upload and base64
+            if 'image' in request.files:
+                image_data = request.files['image'].read()
+            else:
+                image_data = base64_to_bytes(request.json['image'])
+            cache_variant = ()
+            decode = lambda data: cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+        # A cache hit skips decoding and inference entirely
+        cache_key = None
+        if result_cache.enabled:
+            cache_key = ResultCache.make_key(
+                image_data, *cache_variant, DEFAULT_CLASSIFICATION_THRESHOLD,
+                DEFAULT_DETECTION_IOU_THRESHOLD, DEFAULT_DETECTION_CONF_THRESHOLD, weights_identity
+            )
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                return jsonify(cached)
+
+        img = decode(image_data)
 
         if img is None:
             return jsonify({'error': 'Invalid image data'}), 400
@@ -98,11 +148,17 @@ def analyze_image():
             'detections': formatted_detections
         }
 
+        if cache_key is not None:
+            result_cache.put(cache_key, response)
         return jsonify(response)
 
     except Exception as e:
         print(f"Error processing image: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(result_cache.stats())
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001) 
\ No newline at end of file
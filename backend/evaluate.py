@@ -0,0 +1,348 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from classify import (
+    load_all_classifier_models,
+    load_all_detector_models,
+    stream_pipeline_results,
+    set_gpu_memory_growth,
+    CLASSIFIER_MODEL_DIR,
+    DETECTOR_MODEL_PATTERN,
+    DEFAULT_CLASSIFICATION_THRESHOLD,
+    DEFAULT_DETECTION_IOU_THRESHOLD,
+    DEFAULT_DETECTION_CONF_THRESHOLD,
+    DEFAULT_BOX_FUSION,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_DECODE_WORKERS,
+    FUSION_MODES,
+)
+from thread_config import load_thread_config, apply_thread_config
+
+# Offline evaluation of the full pipeline on a labeled manifest, split into shards that run in
+# independent processes or on different machines, each checkpointing as it goes:
+#
+#   python evaluate.py run manifest.csv --output_dir eval/ --num_shards 8 --shard_index 3   # one shard
+#   python evaluate.py run manifest.csv --output_dir eval/ --num_shards 4                   # all shards, local processes
+#   python evaluate.py merge manifest.csv --output_dir eval/ --report report.json
+#
+# Manifest: CSV with an `image_path` column (relative paths resolve against --image_root), a `label`
+# column (1/0, Opacity/Normal) and optionally a `boxes` column holding a JSON list of [x1, y1, x2, y2].
+# RSNA-style manifests with one row per box (`x`, `y`, `width`, `height` columns) are also accepted;
+# rows of the same image are merged. An image is assigned to shard md5(image_path) % num_shards,
+# so every machine computes the same split from the same manifest without coordinating.
+#
+# Each shard appends one JSON line per image to shard-XXXXX-of-YYYYY.jsonl and fsyncs every batch.
+# That file is the checkpoint: a restarted shard skips every image it already has a result for
+# (images that failed to load are retried), and a line cut off by a crash is dropped.
+# The merged report has classification ROC AUC and detection mAP (IoU 0.5 and COCO's 0.5:0.95),
+# computed on the pipeline's output as served: boxes only for images the classifier gates through.
+
+
+def shard_of(image_path, num_shards):
+    return int.from_bytes(hashlib.md5(image_path.encode("utf-8")).digest()[:8], "big") % num_shards
+
+
+def shard_output_path(output_dir, shard_index, num_shards):
+    return os.path.join(output_dir, f"shard-{shard_index:05d}-of-{num_shards:05d}.jsonl")
+
+
+def parse_label(value):
+    value = str(value).strip().lower()
+    if value in ("1", "opacity", "true", "positive", "1.0"):
+        return 1
+    if value in ("0", "normal", "false", "negative", "0.0"):
+        return 0
+    raise ValueError(f"Unrecognised label '{value}'.")
+
+
+def load_manifest(path):
+    """Returns {image_path: {"label": 0 | 1, "boxes": [[x1, y1, x2, y2], ...]}} in manifest order."""
+    items = {}
+    with open(path, newline="") as f:
+        for line_number, row in enumerate(csv.DictReader(f), start=2):
+            image_path = (row.get("image_path") or "").strip()
+            if not image_path:
+                raise ValueError(f"{path}:{line_number}: missing image_path.")
+            item = items.setdefault(image_path, {"label": 0, "boxes": []})
+            label = row.get("label", row.get("Target"))
+            if label not in (None, ""):
+                item["label"] = max(item["label"], parse_label(label))
+            if row.get("boxes"):
+                item["boxes"].extend([float(v) for v in box] for box in json.loads(row["boxes"]))
+            elif row.get("x") not in (None, ""):
+                x, y = float(row["x"]), float(row["y"])
+                item["boxes"].append([x, y, x + float(row["width"]), y + float(row["height"])])
+    for item in items.values():
+        if item["boxes"]:
+            item["label"] = 1
+    return items
+
+
+def read_shard_results(path, truncate_partial=False):
+    """
+    Returns {image_path: record} from a shard file; later lines win. A trailing line cut off by a
+    crash is ignored, and with truncate_partial=True removed from the file so appends stay line-aligned.
+    """
+    results = {}
+    if not os.path.isfile(path):
+        return results
+    valid_bytes = 0
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b"\n"):
+                break
+            results[record["image_path"]] = record
+            valid_bytes += len(line)
+    if truncate_partial and valid_bytes != os.path.getsize(path):
+        print(f"Dropping a partial line at the end of {path}.")
+        with open(path, "r+b") as f:
+            f.truncate(valid_bytes)
+    return results
+
+
+def run_shard(args):
+    manifest = load_manifest(args.manifest)
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_path = shard_output_path(args.output_dir, args.shard_index, args.num_shards)
+    done = {path for path, record in read_shard_results(output_path, truncate_partial=True).items()
+            if "error" not in record}
+    shard_items = [path for path in manifest if shard_of(path, args.num_shards) == args.shard_index]
+    pending = [path for path in shard_items if path not in done]
+    print(f"Shard {args.shard_index}/{args.num_shards}: {len(shard_items)} images, "
+          f"{len(shard_items) - len(pending)} already done, {len(pending)} to run.")
+    if not pending:
+        return
+
+    thread_config = load_thread_config(args.threading_config)
+    if thread_config:
+        apply_thread_config(thread_config)
+    set_gpu_memory_growth()
+    class_models = load_all_classifier_models(args.classifier_dir)
+    detect_models = load_all_detector_models(args.detector_pattern)
+    if not class_models or not detect_models:
+        raise SystemExit("Critical error: Not all models could be loaded.")
+
+    resolve = {os.path.join(args.image_root, path): path for path in pending}
+    start = time.perf_counter()
+    completed = 0
+    with open(output_path, "a") as output_file:
+        for result in stream_pipeline_results(
+            list(resolve), class_models, detect_models, args.class_thresh, args.det_iou_thresh,
+            args.det_conf_thresh, batch_size=args.batch_size, decode_workers=args.decode_workers,
+            box_fusion=args.box_fusion
+        ):
+            record = {"image_path": resolve[result["image_path"]]}
+            if "error" in result:
+                record["error"] = result["error"]
+            else:
+                record["probability"] = result["classification"]["probability"]
+                record["detections"] = [box[:5] for box in result["detections"]]
+            output_file.write(json.dumps(record) + "\n")
+            completed += 1
+            if completed % args.batch_size == 0 or completed == len(pending):
+                output_file.flush()
+                os.fsync(output_file.fileno())
+            if completed % args.progress_every == 0 or completed == len(pending):
+                rate = completed / (time.perf_counter() - start)
+                print(f"Shard {args.shard_index}: {completed}/{len(pending)} ({rate:.2f} images/s, "
+                      f"ETA {(len(pending) - completed) / rate / 60:.1f} min)")
+
+
+def run_local_shards(args):
+    """Runs every shard as a separate local process with the same arguments; returns the worst exit code."""
+    processes = [subprocess.Popen([sys.executable, os.path.abspath(__file__), *sys.argv[1:],
+                                   "--shard_index", str(index)]) for index in range(args.num_shards)]
+    return max(process.wait() for process in processes)
+
+
+def roc_auc(labels, scores):
+    """Area under the ROC curve (Mann-Whitney U, ties counted half); None without both classes."""
+    labels = np.asarray(labels, dtype=bool)
+    scores = np.asarray(scores, dtype=np.float64)
+    num_positive, num_negative = int(labels.sum()), int((~labels).sum())
+    if not num_positive or not num_negative:
+        return None
+    _, inverse, counts = np.unique(scores, return_inverse=True, return_counts=True)
+    ends = np.cumsum(counts)
+    ranks = ((ends - counts + 1 + ends) / 2.0)[inverse] # Average rank of tied scores
+    return float((ranks[labels].sum() - num_positive * (num_positive + 1) / 2.0) / (num_positive * num_negative))
+
+
+def box_iou(boxes_a, boxes_b):
+    """Pairwise IoU of (N, 4) and (M, 4) boxes -> (N, M)."""
+    a, b = boxes_a[:, None, :], boxes_b[None, :, :]
+    width = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    height = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    intersection = width * height
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return intersection / np.maximum(area_a + area_b - intersection, 1e-9)
+
+
+def match_detections(boxes, scores, ground_truth, iou_threshold):
+    """
+    True-positive flags for one image's predicted boxes against its (G, 4) ground truth: each box,
+    highest score first, matches the unmatched ground-truth box it overlaps most, if by iou_threshold.
+    """
+    true_positive = np.zeros(len(scores), dtype=bool)
+    if not len(ground_truth) or not len(scores):
+        return true_positive
+    ious = box_iou(np.asarray(boxes, dtype=np.float64).reshape(-1, 4), ground_truth)
+    if len(ground_truth) == 1: # Only the first box (by score) that overlaps enough matches
+        hits = np.flatnonzero(ious[:, 0] >= iou_threshold)
+        if len(hits):
+            order = np.argsort(-np.asarray(scores), kind="stable")
+            true_positive[order[np.isin(order, hits)][0]] = True
+        return true_positive
+    matched = np.zeros(len(ground_truth), dtype=bool)
+    for i in np.argsort(-np.asarray(scores), kind="stable"):
+        row = np.where(matched, -1.0, ious[i])
+        best = int(np.argmax(row))
+        if row[best] >= iou_threshold:
+            matched[best] = True
+            true_positive[i] = True
+        if matched.all():
+            break
+    return true_positive
+
+
+def average_precision_from_matches(scores, true_positive, num_ground_truth, sorted_by_score=False):
+    """COCO-style AP (101-point interpolated) from every prediction's score and true-positive flag."""
+    if not num_ground_truth:
+        return None
+    true_positive = np.asarray(true_positive)
+    if not sorted_by_score:
+        true_positive = true_positive[np.argsort(-np.asarray(scores), kind="stable")]
+    tp = np.cumsum(true_positive)
+    recall = tp / num_ground_truth
+    precision = tp / np.arange(1, len(tp) + 1)
+    precision = np.maximum.accumulate(precision[::-1])[::-1] # Precision envelope
+    indices = np.searchsorted(recall, np.linspace(0, 1, 101), side="left")
+    padded = np.append(precision, 0.0)
+    return float(np.mean(padded[np.minimum(indices, len(precision))]))
+
+
+def average_precision(predictions, ground_truth, iou_threshold):
+    """
+    COCO-style AP for one class. Matching is per image, so it equals matching the whole list in score order.
+    predictions: list of (image_key, score, [x1, y1, x2, y2]); ground_truth: {image_key: (G, 4) array}.
+    """
+    num_ground_truth = sum(len(boxes) for boxes in ground_truth.values())
+    by_image = {}
+    for key, score, box in predictions:
+        by_image.setdefault(key, ([], []))
+        by_image[key][0].append(box)
+        by_image[key][1].append(score)
+    scores, true_positive = [], []
+    for key, (boxes, image_scores) in by_image.items():
+        image_ground_truth = ground_truth.get(key, np.empty((0, 4)))
+        scores.extend(image_scores)
+        true_positive.extend(match_detections(boxes, image_scores, image_ground_truth, iou_threshold))
+    return average_precision_from_matches(scores, true_positive, num_ground_truth)
+
+
+def build_report(manifest, results, class_thresh):
+    evaluated = [path for path in manifest if path in results and "error" not in results[path]]
+    labels = np.array([manifest[path]["label"] for path in evaluated], dtype=bool)
+    probabilities = np.array([results[path]["probability"] for path in evaluated])
+    predicted = probabilities >= class_thresh
+    ground_truth = {path: np.asarray(manifest[path]["boxes"], dtype=np.float64).reshape(-1, 4) for path in evaluated}
+    predictions = [(path, box[4], box[:4]) for path in evaluated for box in results[path]["detections"]]
+    ap_by_iou = {round(t, 2): average_precision(predictions, ground_truth, t) for t in np.arange(0.5, 0.96, 0.05)}
+    true_positive = int(np.sum(predicted & labels))
+    return {
+        "images": {
+            "manifest": len(manifest),
+            "evaluated": len(evaluated),
+            "failed": sum(1 for path in manifest if path in results and "error" in results[path]),
+            "missing": sum(1 for path in manifest if path not in results),
+        },
+        "classification": {
+            "auc": roc_auc(labels, probabilities),
+            "threshold": class_thresh,
+            "accuracy": float(np.mean(predicted == labels)) if len(evaluated) else None,
+            "sensitivity": true_positive / int(labels.sum()) if labels.sum() else None,
+            "specificity": int(np.sum(~predicted & ~labels)) / int((~labels).sum()) if (~labels).sum() else None,
+            "positives": int(labels.sum()),
+            "negatives": int((~labels).sum()),
+        },
+        "detection": {
+            "map_50": ap_by_iou[0.5],
+            "map_50_95": (float(np.mean(list(ap_by_iou.values()))) if ap_by_iou[0.5] is not None else None),
+            "ap_by_iou": {str(t): ap for t, ap in ap_by_iou.items()},
+            "ground_truth_boxes": sum(len(boxes) for boxes in ground_truth.values()),
+            "predicted_boxes": len(predictions),
+        },
+    }
+
+
+def merge_shards(args):
+    manifest = load_manifest(args.manifest)
+    results = {}
+    shard_files = sorted(name for name in os.listdir(args.output_dir)
+                         if name.startswith("shard-") and name.endswith(".jsonl"))
+    for name in shard_files:
+        for path, record in read_shard_results(os.path.join(args.output_dir, name)).items():
+            if path not in results or "error" in results[path]: # A success in any shard wins over a failure
+                results[path] = record
+    report = build_report(manifest, results, args.class_thresh)
+    report["shard_files"] = shard_files
+    print(json.dumps(report, indent=4))
+    if report["images"]["missing"]:
+        print(f"Warning: {report['images']['missing']} manifest images have no result yet; "
+              "the metrics cover the evaluated images only.")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded, resumable offline evaluation of the pipeline.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the pipeline over one shard (or all shards locally).")
+    run_parser.add_argument("manifest", type=str, help="CSV manifest of labeled images.")
+    run_parser.add_argument("--output_dir", type=str, required=True, help="Directory holding the shard files.")
+    run_parser.add_argument("--num_shards", type=int, default=1)
+    run_parser.add_argument("--shard_index", type=int, default=None,
+                            help="Shard to run in this process (default: run every shard as a local process).")
+    run_parser.add_argument("--image_root", type=str, default="", help="Prefix for relative manifest paths.")
+    run_parser.add_argument("--classifier_dir", type=str, default=CLASSIFIER_MODEL_DIR)
+    run_parser.add_argument("--detector_pattern", type=str, default=DETECTOR_MODEL_PATTERN)
+    run_parser.add_argument("--class_thresh", type=float, default=DEFAULT_CLASSIFICATION_THRESHOLD,
+                            help="Classifier gate in front of the detectors.")
+    run_parser.add_argument("--det_iou_thresh", type=float, default=DEFAULT_DETECTION_IOU_THRESHOLD)
+    run_parser.add_argument("--det_conf_thresh", type=float, default=DEFAULT_DETECTION_CONF_THRESHOLD)
+    run_parser.add_argument("--box_fusion", type=str, default=DEFAULT_BOX_FUSION, choices=FUSION_MODES)
+    run_parser.add_argument("--batch_size", type=int, default=DEFAULT_BATCH_SIZE)
+    run_parser.add_argument("--decode_workers", type=int, default=DEFAULT_DECODE_WORKERS)
+    run_parser.add_argument("--progress_every", type=int, default=500)
+    run_parser.add_argument("--threading_config", type=str, default="threading_config.json")
+
+    merge_parser = commands.add_parser("merge", help="Merge the shard files into one report.")
+    merge_parser.add_argument("manifest", type=str, help="CSV manifest of labeled images.")
+    merge_parser.add_argument("--output_dir", type=str, required=True, help="Directory holding the shard files.")
+    merge_parser.add_argument("--class_thresh", type=float, default=DEFAULT_CLASSIFICATION_THRESHOLD,
+                              help="Threshold for accuracy, sensitivity and specificity.")
+    merge_parser.add_argument("--report", type=str, default=None, help="Optional JSON report path.")
+    args = parser.parse_args()
+
+    if args.command == "merge":
+        merge_shards(args)
+    elif args.shard_index is None:
+        sys.exit(run_local_shards(args))
+    else:
+        run_shard(args)
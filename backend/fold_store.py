@@ -0,0 +1,129 @@
+import json
+import os
+
+import numpy as np
+
+# Columnar store of every fold's raw output per image, written by `classify.py --batch
+# --store_fold_outputs DIR` and read memory-mapped by sweep_thresholds.py. Each column is a flat
+# binary file that only grows, so a store is written while the batch streams and can be reopened to
+# append more images:
+#
+#   images.txt              one image path per line
+#   fold_probabilities.f32  (images, folds) classifier fold probabilities
+#   box_offsets.i64         (images,) end offset of each image's boxes in the box columns
+#   boxes.f32               (boxes, 4) x1, y1, x2, y2 in image pixels
+#   box_scores.f32          (boxes,) confidence
+#   box_folds.u8            (boxes,) detector fold that produced the box
+#   box_classes.u8          (boxes,) class id
+#   meta.json               fold counts, capture threshold, row counts
+#
+# Boxes are each fold's output at `conf_thresh` (far below the serving threshold), after the fold's
+# own YOLO NMS but before the confidence filter and the cross-fold fusion, which a sweep re-applies.
+# meta.json is rewritten after every batch; rows past its counts (a crash mid-batch) are ignored
+# and cut off when the store is reopened for writing.
+
+STORE_VERSION = 1
+FOLD_STORE_CONF_THRESH = 0.001 # Detector confidence at which boxes are captured
+
+_COLUMNS = {
+    "fold_probabilities": ("fold_probabilities.f32", np.float32, "images"),
+    "box_offsets": ("box_offsets.i64", np.int64, "images"),
+    "boxes": ("boxes.f32", np.float32, "boxes"),
+    "box_scores": ("box_scores.f32", np.float32, "boxes"),
+    "box_folds": ("box_folds.u8", np.uint8, "boxes"),
+    "box_classes": ("box_classes.u8", np.uint8, "boxes"),
+}
+
+
+def _row_shape(name, meta):
+    return {"fold_probabilities": (meta["num_classifier_folds"],), "boxes": (4,)}.get(name, ())
+
+
+class FoldOutputWriter:
+    """Appends images to a store directory (created, or reopened if it holds a store with the same folds)."""
+
+    def __init__(self, directory, num_classifier_folds, num_detector_folds, conf_thresh=FOLD_STORE_CONF_THRESH):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        meta_path = os.path.join(directory, "meta.json")
+        if os.path.isfile(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+            expected = (num_classifier_folds, num_detector_folds, conf_thresh)
+            found = (self.meta["num_classifier_folds"], self.meta["num_detector_folds"], self.meta["conf_thresh"])
+            if found != expected:
+                raise ValueError(f"Fold store {directory} holds folds/threshold {found}, not {expected}.")
+        else:
+            self.meta = {"version": STORE_VERSION, "num_classifier_folds": num_classifier_folds,
+                         "num_detector_folds": num_detector_folds, "conf_thresh": conf_thresh,
+                         "num_images": 0, "num_boxes": 0}
+        self._truncate_to_meta()
+        self._files = {name: open(os.path.join(directory, filename), "ab")
+                       for name, (filename, _, _) in _COLUMNS.items()}
+        self._images = open(os.path.join(directory, "images.txt"), "a")
+
+    def _truncate_to_meta(self):
+        for name, (filename, dtype, rows) in _COLUMNS.items():
+            path = os.path.join(self.directory, filename)
+            size = self.meta["num_" + rows] * int(np.prod(_row_shape(name, self.meta))) * np.dtype(dtype).itemsize
+            if os.path.isfile(path) and os.path.getsize(path) > size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+        path = os.path.join(self.directory, "images.txt")
+        if os.path.isfile(path):
+            with open(path) as f:
+                lines = f.readlines()[:self.meta["num_images"]]
+            with open(path, "w") as f:
+                f.writelines(lines)
+
+    def append(self, image_path, fold_probabilities, fold_detections):
+        """
+        fold_probabilities: one probability per classifier fold.
+        fold_detections: one (boxes (K, 4), scores (K,), classes (K,)) tuple per detector fold.
+        """
+        self._images.write(image_path.replace("\n", " ") + "\n")
+        self._files["fold_probabilities"].write(np.asarray(fold_probabilities, dtype=np.float32).tobytes())
+        for fold, (boxes, scores, classes) in enumerate(fold_detections):
+            self._files["boxes"].write(np.asarray(boxes, dtype=np.float32).reshape(-1, 4).tobytes())
+            self._files["box_scores"].write(np.asarray(scores, dtype=np.float32).tobytes())
+            self._files["box_folds"].write(np.full(len(scores), fold, dtype=np.uint8).tobytes())
+            self._files["box_classes"].write(np.asarray(classes, dtype=np.uint8).tobytes())
+            self.meta["num_boxes"] += len(scores)
+        self._files["box_offsets"].write(np.int64(self.meta["num_boxes"]).tobytes())
+        self.meta["num_images"] += 1
+
+    def flush(self):
+        """Makes the rows appended so far durable, then commits their counts to meta.json."""
+        for f in [*self._files.values(), self._images]:
+            f.flush()
+            os.fsync(f.fileno())
+        temp_path = os.path.join(self.directory, "meta.json.tmp")
+        with open(temp_path, "w") as f:
+            json.dump(self.meta, f, indent=4)
+        os.replace(temp_path, os.path.join(self.directory, "meta.json"))
+
+    def close(self):
+        self.flush()
+        for f in [*self._files.values(), self._images]:
+            f.close()
+
+
+class FoldOutputStore:
+    """Read-only, memory-mapped view of a store: columns are NumPy memmaps, image_paths a list."""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.num_classifier_folds = self.meta["num_classifier_folds"]
+        self.num_detector_folds = self.meta["num_detector_folds"]
+        self.conf_thresh = self.meta["conf_thresh"]
+        self.num_images = self.meta["num_images"]
+        with open(os.path.join(directory, "images.txt")) as f:
+            self.image_paths = [line.rstrip("\n") for _, line in zip(range(self.num_images), f)]
+        for name, (filename, dtype, rows) in _COLUMNS.items():
+            shape = (self.meta["num_" + rows], *_row_shape(name, self.meta))
+            # Plain ndarray views of the mapping: indexing a np.memmap subclass is several times slower
+            column = (np.asarray(np.memmap(os.path.join(directory, filename), dtype=dtype, mode="r", shape=shape))
+                      if shape[0] else np.zeros(shape, dtype=dtype))
+            setattr(self, name, column)
+        self.box_starts = np.concatenate([[0], self.box_offsets[:-1]]).astype(np.int64)
@@ -0,0 +1,123 @@
+import argparse
+import itertools
+import json
+import time
+
+import numpy as np
+
+from classify import (
+    load_all_classifier_models,
+    iter_image_paths,
+    prefetch_decoded_images,
+    preprocess_image_for_classifier,
+    predict_with_classifiers_batch,
+    predict_with_classifiers_early_exit,
+    sequential_fold_evaluation,
+    parse_fold_order,
+    set_gpu_memory_growth,
+    CLASSIFIER_MODEL_DIR,
+    DEFAULT_CLASSIFICATION_THRESHOLD,
+    DEFAULT_BATCH_SIZE,
+)
+
+# Measures how many classifier folds early-exit evaluation saves on a sample set.
+# Every fold is run once on every image; early exit is then replayed on those outputs for the
+# requested fold order (and, with --search_orders, every order) without re-running the models.
+#
+#   python measure_early_exit.py sample_images/ --fold_order 3,1,5,2,4 --search_orders
+
+
+def fold_probability_matrix(images_processed, models, batch_size):
+    """Returns an (N, folds) array of per-fold probabilities."""
+    columns = []
+    for model in models:
+        columns.append(np.concatenate([
+            model.predict(images_processed[start:start + batch_size], verbose=0)[:, 0]
+            for start in range(0, len(images_processed), batch_size)
+        ]))
+    return np.stack(columns, axis=1)
+
+
+def replay_early_exit(fold_probabilities, fold_order, thresholds):
+    num_images, num_folds = fold_probabilities.shape
+    probabilities, folds_used, lower_bounds, upper_bounds = sequential_fold_evaluation(
+        num_images, num_folds, lambda fold, indices: fold_probabilities[indices, fold], fold_order, thresholds
+    )
+    full_probabilities = np.mean(fold_probabilities.T, axis=0)
+    decisions_match = all(
+        np.array_equal(probabilities >= threshold, full_probabilities >= threshold) for threshold in thresholds
+    )
+    return {
+        "fold_order": [index + 1 for index in parse_fold_order(fold_order, num_folds)],
+        "mean_folds_used": float(folds_used.mean()),
+        "mean_folds_saved": float(num_folds - folds_used.mean()),
+        "fold_evaluations_saved_pct": float(100.0 * (1.0 - folds_used.sum() / (num_images * num_folds))),
+        "early_exit_rate": float(np.mean(folds_used < num_folds)),
+        "folds_used_histogram": {str(k): int(np.sum(folds_used == k)) for k in range(1, num_folds + 1)},
+        "max_abs_prob_diff": float(np.max(np.abs(probabilities - full_probabilities))),
+        "bounds_contain_full_mean": bool(np.all((lower_bounds <= full_probabilities + 1e-6)
+                                                & (full_probabilities - 1e-6 <= upper_bounds))),
+        "decisions_match": bool(decisions_match),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure folds saved by early-exit classifier evaluation.")
+    parser.add_argument("images", type=str, nargs="+",
+                        help="Directories, glob patterns, or .txt files listing sample images.")
+    parser.add_argument("--classifier_dir", type=str, default=CLASSIFIER_MODEL_DIR,
+                        help="Directory containing Keras classifier models.")
+    parser.add_argument("--fold_order", type=str, default=None,
+                        help="Comma-separated fold numbers evaluated first, e.g. '3,1,5,2,4'.")
+    parser.add_argument("--class_thresh", type=float, default=DEFAULT_CLASSIFICATION_THRESHOLD,
+                        help="Detection gate threshold; early exit must also settle this decision.")
+    parser.add_argument("--search_orders", action="store_true",
+                        help="Also replay every fold order and report the one that saves the most folds.")
+    parser.add_argument("--batch_size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--output", type=str, default=None, help="Optional JSON report path.")
+    args = parser.parse_args()
+
+    set_gpu_memory_growth()
+    models = load_all_classifier_models(args.classifier_dir)
+    paths, images = [], []
+    for path, image in prefetch_decoded_images(iter_image_paths(args.images)):
+        if image is not None:
+            paths.append(path)
+            images.append(preprocess_image_for_classifier(image))
+    if not images:
+        raise SystemExit("No readable images found.")
+    images_processed = np.concatenate(images, axis=0)
+    thresholds = (DEFAULT_CLASSIFICATION_THRESHOLD, args.class_thresh)
+
+    fold_probabilities = fold_probability_matrix(images_processed, models, args.batch_size)
+    report = {
+        "images": len(paths),
+        "folds": len(models),
+        "thresholds": sorted(set(thresholds)),
+        "configured_order": replay_early_exit(fold_probabilities, args.fold_order, thresholds),
+    }
+
+    if args.search_orders:
+        replays = [replay_early_exit(fold_probabilities, [fold + 1 for fold in order], thresholds)
+                   for order in itertools.permutations(range(len(models)))]
+        best = min(replays, key=lambda replay: replay["mean_folds_used"])
+        worst = max(replays, key=lambda replay: replay["mean_folds_used"])
+        report["best_order"] = best
+        report["worst_order_mean_folds_used"] = worst["mean_folds_used"]
+
+    # Wall-clock check on the real models: full ensemble vs early exit in the configured order
+    def timed(fn):
+        start = time.perf_counter()
+        for begin in range(0, len(images_processed), args.batch_size):
+            fn(images_processed[begin:begin + args.batch_size])
+        return (time.perf_counter() - start) * 1000.0 / len(images_processed)
+
+    timed(lambda batch: predict_with_classifiers_batch(batch[:1], models)) # Warm up
+    full_ms = timed(lambda batch: predict_with_classifiers_batch(batch, models))
+    early_exit_ms = timed(lambda batch: predict_with_classifiers_early_exit(batch, models, args.fold_order, thresholds))
+    report["ms_per_image"] = {"full_ensemble": full_ms, "early_exit": early_exit_ms, "speedup": full_ms / early_exit_ms}
+
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
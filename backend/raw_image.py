@@ -0,0 +1,101 @@
+import struct
+
+import cv2
+import numpy as np
+
+# Pre-decoded image uploads: the request body is a raw uint8 pixel array instead of an encoded
+# PNG/JPEG, and the server wraps the received buffer as a NumPy array without copying or decoding.
+# The layout travels in headers:
+#
+#   Content-Type: application/x-raw-image
+#   X-Image-Shape: <height>,<width>[,<channels>]    channels 1 or 3 (default 1)
+#   X-Image-Dtype: uint8                             optional; only uint8 is accepted
+#   X-Image-Color: gray | bgr | rgb                  optional; default gray for 1 channel, rgb for 3
+#
+# or, when X-Image-Shape is absent, in a 16-byte little-endian preamble in front of the pixels:
+#
+#   b"RIMG" | uint32 height | uint32 width | uint16 channels | uint8 color (0 gray, 1 bgr, 2 rgb) | uint8 dtype (1 uint8)
+#
+# Pixels are row-major (height, width[, channels]) with no row padding. Grayscale and BGR arrays go
+# into the pipeline as they are; RGB costs one channel swap.
+
+RAW_IMAGE_CONTENT_TYPE = "application/x-raw-image"
+PREAMBLE = struct.Struct("<4sIIHBB")
+PREAMBLE_MAGIC = b"RIMG"
+COLOR_CODES = {0: "gray", 1: "bgr", 2: "rgb"}
+DTYPE_CODES = {1: "uint8"}
+
+
+class RawImageError(ValueError):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def encode_preamble(height, width, channels=1, color=None):
+    """The 16-byte preamble for an array of this shape (for clients)."""
+    color = color or ("gray" if channels == 1 else "rgb")
+    color_code = {name: code for code, name in COLOR_CODES.items()}[color]
+    return PREAMBLE.pack(PREAMBLE_MAGIC, height, width, channels, color_code, 1)
+
+
+def _layout_from_headers(headers):
+    try:
+        dims = [int(part) for part in headers["x-image-shape"].split(",")]
+    except ValueError:
+        raise RawImageError(f"Invalid X-Image-Shape '{headers['x-image-shape']}'; expected height,width[,channels].")
+    if len(dims) not in (2, 3):
+        raise RawImageError(f"X-Image-Shape must have 2 or 3 dimensions, got {len(dims)}.")
+    height, width, channels = (*dims, 1) if len(dims) == 2 else dims
+    dtype = headers.get("x-image-dtype", "uint8").strip().lower()
+    if dtype != "uint8":
+        raise RawImageError(f"Unsupported dtype '{dtype}'; only uint8 pixels are accepted.", status_code=415)
+    color = headers.get("x-image-color", "gray" if channels == 1 else "rgb").strip().lower()
+    return height, width, channels, color, 0
+
+
+def _layout_from_preamble(body):
+    if len(body) < PREAMBLE.size or bytes(body[:4]) != PREAMBLE_MAGIC:
+        raise RawImageError("Missing X-Image-Shape header and no RIMG preamble in the body.")
+    _, height, width, channels, color_code, dtype_code = PREAMBLE.unpack_from(body)
+    if dtype_code not in DTYPE_CODES:
+        raise RawImageError(f"Unsupported dtype code {dtype_code}; only 1 (uint8) is accepted.", status_code=415)
+    if color_code not in COLOR_CODES:
+        raise RawImageError(f"Unknown color code {color_code}.")
+    return height, width, channels, COLOR_CODES[color_code], PREAMBLE.size
+
+
+def parse_raw_image(body, headers, max_pixels):
+    """
+    Wraps a raw image body as a read-only uint8 array, without copying.
+    `headers` is a case-insensitive mapping (Starlette / Werkzeug request headers).
+    Returns (array of shape (H, W) or (H, W, 3), color in {"gray", "bgr", "rgb"}).
+    """
+    height, width, channels, color, offset = (_layout_from_headers(headers) if "x-image-shape" in headers
+                                              else _layout_from_preamble(body))
+    if channels not in (1, 3):
+        raise RawImageError(f"Images must have 1 or 3 channels, got {channels}.")
+    if color not in ({"gray"} if channels == 1 else {"bgr", "rgb"}):
+        raise RawImageError(f"Color '{color}' does not match {channels} channel(s).")
+    if height <= 0 or width <= 0:
+        raise RawImageError(f"Invalid image size {height}x{width}.")
+    if height * width > max_pixels:
+        raise RawImageError(f"Image of {height}x{width} pixels exceeds the {max_pixels}-pixel limit.", status_code=413)
+    expected = height * width * channels
+    if len(body) - offset != expected:
+        raise RawImageError(f"Body holds {len(body) - offset} pixel bytes; a {height}x{width}x{channels} "
+                            f"uint8 image needs {expected}.")
+    image = np.frombuffer(body, dtype=np.uint8, count=expected, offset=offset)
+    return image.reshape((height, width) if channels == 1 else (height, width, 3)), color
+
+
+def to_pipeline_image(image, color):
+    """Grayscale (H, W) or BGR (H, W, 3), the two layouts the pipeline takes (copies only RGB)."""
+    return cv2.cvtColor(image, cv2.COLOR_RGB2BGR) if color == "rgb" else image
+
+
+def to_bgr(image, color):
+    """A BGR (H, W, 3) image, for code that only handles color input."""
+    if color == "gray":
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return to_pipeline_image(image, color)
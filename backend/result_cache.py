@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def files_identity(paths):
+    """
+    Fingerprint of the (path, size, modification time) of the files in `paths` that exist.
+    Part of the cache key, so results computed with since-replaced model weights are not served.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    Content-addressed cache for pipeline results.
+
+    Keys are a SHA-256 of the uploaded bytes plus the thresholds that affect the result,
+    so a re-submitted study skips decoding and inference entirely. The in-memory tier
+    holds at most `max_entries` results with LRU eviction; if `disk_dir` is set, results
+    are also written there as JSON and survive restarts.
+    Values must be JSON-serializable.
+
+    The disk tier may be shared by several processes (pre-forked workers). It keeps about
+    `max_disk_entries` results (0: unbounded): after every `max_disk_entries // 100` writes
+    a process deletes the least recently used files beyond the bound, so the directory can
+    briefly exceed it by that many writes per process.
+    """
+
+    def __init__(self, max_entries=1024, disk_dir=None, max_disk_entries=100_000):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir or None
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._prune_disk()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 or self.disk_dir is not None
+
+    @staticmethod
+    def make_key(contents, *params):
+        digest = hashlib.sha256(contents)
+        for param in params:
+            digest.update(f"|{param!r}".encode())
+        return digest.hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def get(self, key):
+        """Returns the cached value or None."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key)) as f:
+                    value = json.load(f)
+            except (OSError, ValueError):
+                value = None
+            if value is not None:
+                try:
+                    os.utime(self._disk_path(key)) # Mark as recently used for the disk bound
+                except OSError:
+                    pass
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                self._put_memory(key, value)
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self._put_memory(key, value)
+        if self.disk_dir:
+            # Write-then-rename so a crash never leaves a truncated entry behind; the temporary
+            # name is unique across the processes sharing the directory
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+                with os.fdopen(fd, "w") as f:
+                    json.dump(value, f)
+                os.replace(tmp_path, self._disk_path(key))
+            except OSError as e:
+                print(f"Could not persist cache entry {key}: {e}")
+                if tmp_path is not None and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return
+            with self._lock:
+                self._disk_writes += 1
+                prune = self.max_disk_entries > 0 and self._disk_writes >= max(self.max_disk_entries // 100, 1)
+                if prune:
+                    self._disk_writes = 0
+            if prune:
+                self._prune_disk()
+
+    def _prune_disk(self):
+        """Deletes the least recently used disk entries beyond `max_disk_entries`."""
+        if self.max_disk_entries <= 0:
+            return
+        entries = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".json"):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError: # Deleted by another process meanwhile
+                    pass
+        if len(entries) <= self.max_disk_entries:
+            return
+        entries.sort()
+        removed = 0
+        for _, path in entries[:len(entries) - self.max_disk_entries]:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        with self._lock:
+            self.disk_evictions += removed
+
+    def _put_memory(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "disk_dir": self.disk_dir,
+                "max_disk_entries": self.max_disk_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
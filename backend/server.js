@@ -79,7 +79,15 @@ app.post('/api/analyze', upload.single('image'), async (req, res) => {
     res.json(responseData);
   } catch (error) {
     console.error('Error calling ML API:', error);
-    res.status(500).json({ 
+    if (error.response?.status === 429) {
+      // ML API admission control: pass the backpressure on to the client
+      res.set('Retry-After', error.response.headers['retry-after'] || '1');
+      return res.status(429).json({
+        error: 'Server busy, please retry shortly',
+        details: error.response.data?.detail
+      });
+    }
+    res.status(500).json({
       error: 'Error processing image',
       details: error.response?.data?.detail || error.message
     });
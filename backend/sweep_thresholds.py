@@ -0,0 +1,191 @@
+import argparse
+import csv
+import os
+import time
+
+import numpy as np
+
+from box_fusion import FUSION_MODES, fuse_boxes_batch
+from evaluate import load_manifest, roc_auc, match_detections, average_precision_from_matches
+from fold_store import FoldOutputStore
+from classify import (
+    DEFAULT_CLASSIFICATION_THRESHOLD,
+    DEFAULT_DETECTION_CONF_THRESHOLD,
+    DEFAULT_DETECTION_IOU_THRESHOLD,
+    DEFAULT_BOX_FUSION,
+)
+
+# Sweeps the classification threshold, detection confidence threshold and fusion IoU threshold over
+# a fold output store (classify.py --batch --store_fold_outputs DIR) without running any model:
+# ensemble averaging, the confidence filter and the cross-fold NMS / WBF are re-applied to the stored
+# raw fold outputs for every combination and scored against a labeled manifest.
+#
+#   python sweep_thresholds.py fold_store/ manifest.csv --image_root /data/ \
+#       --class_thresh 0.2:0.8:0.05 --det_conf_thresh 0.05:0.5:0.05 --det_iou_thresh 0.3:0.7:0.1 --output sweep.csv
+#
+# The classification threshold here is the decision threshold itself (a candidate for
+# DEFAULT_CLASSIFICATION_THRESHOLD): images at or above it are Opacity and go on to detection.
+# Boxes are fused once per (confidence, IoU) pair and matched to the ground truth once per image;
+# each classification threshold then only selects which images' boxes count.
+
+MAP_IOU_THRESHOLDS = np.round(np.arange(0.5, 0.96, 0.05), 2)
+
+
+def parse_grid(values):
+    """Each value is a number or an inclusive start:stop:step range."""
+    grid = []
+    for value in values:
+        if ":" in value:
+            start, stop, step = (float(part) for part in value.split(":"))
+            grid.extend(np.round(np.arange(start, stop + step / 2, step), 6))
+        else:
+            grid.append(float(value))
+    return sorted(set(float(v) for v in grid))
+
+
+def align_with_manifest(store, manifest, image_root):
+    """Returns (store row per evaluated image, labels, ground-truth boxes) for images in both."""
+    rows_by_path = {path: row for row, path in enumerate(store.image_paths)}
+    rows, labels, ground_truth = [], [], []
+    for path, item in manifest.items():
+        row = rows_by_path.get(os.path.join(image_root, path), rows_by_path.get(path))
+        if row is None:
+            continue
+        rows.append(row)
+        labels.append(item["label"])
+        ground_truth.append(np.asarray(item["boxes"], dtype=np.float64).reshape(-1, 4))
+    return np.asarray(rows, dtype=np.int64), np.asarray(labels, dtype=bool), ground_truth
+
+
+def fuse_stored_boxes(store, rows, det_conf_thresh, det_iou_thresh, box_fusion, chunk_size):
+    """Each row's fused (K, 6) boxes from the stored fold outputs at or above det_conf_thresh."""
+    fused = [np.empty((0, 6), np.float32)] * len(rows)
+    passing = np.flatnonzero(np.asarray(store.box_scores) >= det_conf_thresh)
+    # Boxes are stored image by image, so each row's passing boxes are one slice of `passing`
+    first = np.searchsorted(passing, store.box_starts[rows])
+    last = np.searchsorted(passing, store.box_offsets[rows])
+    with_boxes = [(i, passing[first[i]:last[i]]) for i in np.flatnonzero(last > first)]
+    # Similar box counts share a padded batch
+    with_boxes.sort(key=lambda item: len(item[1]))
+    for chunk_start in range(0, len(with_boxes), chunk_size):
+        chunk = with_boxes[chunk_start:chunk_start + chunk_size]
+        results = fuse_boxes_batch([store.boxes[keep] for _, keep in chunk], [store.box_scores[keep] for _, keep in chunk],
+                                   [store.box_classes[keep] for _, keep in chunk], det_iou_thresh,
+                                   mode=box_fusion, num_models=store.num_detector_folds)
+        for (i, _), boxes in zip(chunk, results):
+            fused[i] = boxes
+    return fused
+
+
+def sweep(store, rows, labels, ground_truth, class_thresholds, conf_thresholds, iou_thresholds, box_fusion,
+          map_iou_thresholds, chunk_size):
+    probabilities = np.asarray(store.fold_probabilities[rows], dtype=np.float64).mean(axis=1)
+    num_ground_truth = sum(len(boxes) for boxes in ground_truth)
+    gates = {class_thresh: probabilities >= class_thresh for class_thresh in class_thresholds}
+    results = []
+    # NMS keeps or drops a box only for higher-scored boxes, so NMS at a higher confidence threshold is
+    # NMS at the lowest one restricted to boxes scoring above it; matching visits boxes by score too, so
+    # a box's match does not change either. NMS therefore fuses and matches once per IoU threshold.
+    # WBF scores depend on every box in a cluster, so WBF is redone per confidence threshold.
+    fuse_per_conf = box_fusion != "nms"
+    for det_iou_thresh in iou_thresholds:
+        for conf_index, det_conf_thresh in enumerate(conf_thresholds):
+            if fuse_per_conf or conf_index == 0:
+                fused = fuse_stored_boxes(store, rows, det_conf_thresh, det_iou_thresh, box_fusion, chunk_size)
+                with_boxes = [i for i, boxes in enumerate(fused) if len(boxes)]
+                image_of_box = np.concatenate([np.full(len(fused[i]), i, dtype=np.int64) for i in with_boxes] or
+                                              [np.empty(0, np.int64)])
+                scores = np.concatenate([fused[i][:, 4] for i in with_boxes] or [np.empty(0)])
+                true_positive = {
+                    t: np.concatenate([match_detections(fused[i][:, :4], fused[i][:, 4], ground_truth[i], t)
+                                       for i in with_boxes] or [np.empty(0, bool)])
+                    for t in map_iou_thresholds
+                }
+                # Sorted by score once; every subset below stays sorted
+                order = np.argsort(-scores, kind="stable")
+                image_of_box, scores = image_of_box[order], scores[order]
+                true_positive = {t: flags[order] for t, flags in true_positive.items()}
+            above = scores >= det_conf_thresh
+            for class_thresh in class_thresholds:
+                gate = gates[class_thresh]
+                counted = gate[image_of_box] & above
+                aps = {t: average_precision_from_matches(None, true_positive[t][counted], num_ground_truth,
+                                                         sorted_by_score=True)
+                       for t in map_iou_thresholds}
+                result = {
+                    "class_thresh": class_thresh, "det_conf_thresh": det_conf_thresh, "det_iou_thresh": det_iou_thresh,
+                    "accuracy": float(np.mean(gate == labels)),
+                    "sensitivity": float(np.mean(gate[labels])) if labels.any() else None,
+                    "specificity": float(np.mean(~gate[~labels])) if (~labels).any() else None,
+                    "map_50": aps.get(0.5),
+                }
+                if len(map_iou_thresholds) > 1 and aps[0.5] is not None:
+                    result["map_50_95"] = float(np.mean(list(aps.values())))
+                results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep pipeline thresholds over stored fold outputs.")
+    parser.add_argument("store", type=str, help="Fold output store directory (classify.py --store_fold_outputs).")
+    parser.add_argument("manifest", type=str, help="Labeled CSV manifest, as for evaluate.py.")
+    parser.add_argument("--image_root", type=str, default="", help="Prefix for relative manifest paths.")
+    parser.add_argument("--class_thresh", type=str, nargs="+", default=["0.1:0.9:0.05"],
+                        help="Values or start:stop:step ranges (the current defaults are always included).")
+    parser.add_argument("--det_conf_thresh", type=str, nargs="+", default=["0.05:0.6:0.05"])
+    parser.add_argument("--det_iou_thresh", type=str, nargs="+", default=["0.3:0.7:0.05"])
+    parser.add_argument("--box_fusion", type=str, default=DEFAULT_BOX_FUSION, choices=FUSION_MODES)
+    parser.add_argument("--coco_map", action="store_true", help="Also compute mAP over IoU 0.5:0.95 (slower).")
+    parser.add_argument("--objective", type=str, default="map_50",
+                        choices=["map_50", "map_50_95", "accuracy", "youden"],
+                        help="Metric the combinations are ranked by (youden = sensitivity + specificity - 1).")
+    parser.add_argument("--top", type=int, default=10, help="Combinations printed.")
+    parser.add_argument("--chunk_size", type=int, default=256, help="Images fused per padded batch.")
+    parser.add_argument("--output", type=str, default=None, help="Optional CSV with every combination.")
+    args = parser.parse_args()
+    if args.objective == "map_50_95" and not args.coco_map:
+        parser.error("--objective map_50_95 needs --coco_map.")
+
+    store = FoldOutputStore(args.store)
+    manifest = load_manifest(args.manifest)
+    rows, labels, ground_truth = align_with_manifest(store, manifest, args.image_root)
+    if not len(rows):
+        raise SystemExit("No stored image matches the manifest (check --image_root).")
+    defaults = (DEFAULT_CLASSIFICATION_THRESHOLD, DEFAULT_DETECTION_CONF_THRESHOLD, DEFAULT_DETECTION_IOU_THRESHOLD)
+    class_thresholds = sorted(set(parse_grid(args.class_thresh)) | {defaults[0]})
+    conf_thresholds = sorted(set(parse_grid(args.det_conf_thresh)) | {defaults[1]})
+    iou_thresholds = sorted(set(parse_grid(args.det_iou_thresh)) | {defaults[2]})
+    if min(conf_thresholds) < store.conf_thresh:
+        raise SystemExit(f"The store holds boxes from confidence {store.conf_thresh} up; "
+                         f"--det_conf_thresh cannot go below it.")
+    print(f"{len(rows)} of {len(manifest)} manifest images are in the store "
+          f"({store.num_images} images, {len(store.box_scores)} raw boxes).")
+
+    start = time.perf_counter()
+    results = sweep(store, rows, labels, ground_truth, class_thresholds, conf_thresholds, iou_thresholds,
+                    args.box_fusion, MAP_IOU_THRESHOLDS if args.coco_map else [0.5], args.chunk_size)
+    elapsed = time.perf_counter() - start
+    print(f"Evaluated {len(results)} threshold combinations in {elapsed:.1f} s "
+          f"(classification AUC {roc_auc(labels, store.fold_probabilities[rows].mean(axis=1))}).")
+
+    def objective(result):
+        if args.objective == "youden":
+            value = (result["sensitivity"] or 0.0) + (result["specificity"] or 0.0) - 1.0
+        else:
+            value = result.get(args.objective)
+        return -np.inf if value is None else value
+
+    columns = ["class_thresh", "det_conf_thresh", "det_iou_thresh", "accuracy", "sensitivity", "specificity",
+               "map_50"] + (["map_50_95"] if args.coco_map else [])
+    print(" | ".join(columns))
+    current = next(result for result in results
+                   if (result["class_thresh"], result["det_conf_thresh"], result["det_iou_thresh"]) == defaults)
+    for result in [*sorted(results, key=objective, reverse=True)[:args.top], current]:
+        label = "  (current defaults)" if result is current else ""
+        print(" | ".join("-" if result.get(c) is None else f"{result[c]:.4f}" for c in columns) + label)
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(results)
+        print(f"All combinations written to {args.output}")
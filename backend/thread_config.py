@@ -0,0 +1,49 @@
+import json
+import os
+
+# TensorFlow / torch thread pool settings, as written by ML_API/autotune_threads.py.
+# Apply them before either framework runs its first op: TensorFlow ignores (and rejects)
+# thread changes once its runtime is initialised.
+
+THREAD_CONFIG_KEYS = ("tf_intra_op_threads", "tf_inter_op_threads", "torch_threads", "workers")
+
+
+def load_thread_config(path, prefork=False):
+    """
+    Returns the selected profile of a config file as {key: int}, or None if there is no file.
+    Keys set to 0 (framework default) are left out. prefork=True returns the profile measured the way
+    prefork_server.py runs (TensorFlow pinned to one thread of each kind, eager), or None if the file
+    has none.
+    """
+    if not path or not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        config = json.load(f)
+    if prefork:
+        if "prefork_profiles" not in config:
+            return None
+        profile = config["prefork_profiles"][config["selected"]]
+    else:
+        profile = config["profiles"][config["selected"]] if "profiles" in config else config
+    return {key: int(profile[key]) for key in THREAD_CONFIG_KEYS if profile.get(key)}
+
+
+def apply_thread_config(config, tensorflow=True, torch=True):
+    """Applies the TensorFlow and torch thread counts in `config`; returns the settings applied."""
+    applied = {}
+    if tensorflow and (config.get("tf_intra_op_threads") or config.get("tf_inter_op_threads")):
+        import tensorflow as tf
+        try:
+            if config.get("tf_intra_op_threads"):
+                tf.config.threading.set_intra_op_parallelism_threads(config["tf_intra_op_threads"])
+                applied["tf_intra_op_threads"] = config["tf_intra_op_threads"]
+            if config.get("tf_inter_op_threads"):
+                tf.config.threading.set_inter_op_parallelism_threads(config["tf_inter_op_threads"])
+                applied["tf_inter_op_threads"] = config["tf_inter_op_threads"]
+        except RuntimeError as e:
+            print(f"TensorFlow thread settings not applied (runtime already initialised): {e}")
+    if torch and config.get("torch_threads"):
+        import torch as torch_module
+        torch_module.set_num_threads(config["torch_threads"])
+        applied["torch_threads"] = config["torch_threads"]
+    return applied